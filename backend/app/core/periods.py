@@ -0,0 +1,41 @@
+"""
+Period Expressions
+Parsing shared by the API routes and the command line tools - raises ValueError,
+each caller reports it its own way (HTTP 400, argparse usage error)
+"""
+from datetime import datetime
+from typing import List
+
+# Upper bound for multi-period requests
+MAX_BATCH_YEARS = 25
+
+
+def parse_years(years: str) -> List[int]:
+    """
+    Parse a years expression: "2017-2024", "2017,2019,2021" or a mix ("2015-2017,2020")
+    Returns unique years in ascending order, raises ValueError on invalid input
+    """
+    current_year = datetime.now().year
+    parsed = set()
+    try:
+        for part in years.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '-' in part:
+                start, end = (int(value) for value in part.split('-', 1))
+                if start > end:
+                    raise ValueError(part)
+                parsed.update(range(start, end + 1))
+            else:
+                parsed.add(int(part))
+    except ValueError:
+        raise ValueError(f"Invalid years '{years}'. Use e.g. 2017-2024 or 2017,2019") from None
+
+    if not parsed:
+        raise ValueError("At least one year is required")
+    if min(parsed) < 2000 or max(parsed) > current_year:
+        raise ValueError(f"Years must be between 2000 and {current_year}")
+    if len(parsed) > MAX_BATCH_YEARS:
+        raise ValueError(f"At most {MAX_BATCH_YEARS} years per batch request")
+    return sorted(parsed)
@@ -0,0 +1,169 @@
+"""
+Negotiated API Responses
+Serializes route results in the format the client asks for (Accept header)
+and compresses large bodies (Accept-Encoding)
+
+- application/json: orjson (datetimes and NumPy scalars natively), stdlib json fallback
+- application/x-msgpack: msgpack, when installed
+- application/vnd.apache.arrow.stream: Arrow IPC stream of the result's rows, when
+  pyarrow is installed; the remaining fields travel as JSON schema metadata
+- br / gzip above settings.RESPONSE_COMPRESSION_MIN_BYTES
+"""
+import gzip
+import json
+from typing import Dict, List, Optional
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.types
+except ImportError:
+    pyarrow = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _parse_header(value: Optional[str]) -> List[tuple]:
+    """Accept-style header -> [(token, q)] sorted by q (stable for equal q)"""
+    items = []
+    for part in (value or "").split(","):
+        token, *params = (piece.strip() for piece in part.split(";"))
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        items.append((token.lower(), q))
+    return sorted(items, key=lambda item: -item[1])
+
+
+def available_media_types(has_rows: bool) -> List[str]:
+    """Formats this process can produce, preferred first"""
+    media_types = [JSON]
+    if msgpack is not None:
+        media_types.append(MSGPACK)
+    if pyarrow is not None and has_rows:
+        media_types.append(ARROW)
+    return media_types
+
+
+def negotiate_media_type(accept: Optional[str], has_rows: bool = True) -> str:
+    """Best supported media type for an Accept header, JSON when nothing matches"""
+    supported = available_media_types(has_rows)
+    for token, q in _parse_header(accept):
+        if q <= 0:
+            continue
+        if token in supported:
+            return token
+        if token in ("*/*", "application/*"):
+            return JSON
+    return JSON
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """'br', 'gzip' or None"""
+    offered = {token: q for token, q in _parse_header(accept_encoding)}
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def _fallback(value):
+    # NumPy scalars, Decimals, dates, ... - anything orjson / msgpack do not know
+    if hasattr(value, "item"):
+        return value.item()
+    return jsonable_encoder(value)
+
+
+def dumps_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_fallback, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(jsonable_encoder(content)).encode()
+
+
+def dumps_msgpack(content) -> bytes:
+    return msgpack.packb(content, default=_fallback, use_bin_type=True)
+
+
+def dumps_arrow(content: Dict, rows: List[Dict]) -> bytes:
+    """
+    Rows as one Arrow table; the scalar response fields as JSON schema metadata
+    (lists of row dicts - stocks, periods - are carried by the table only)
+    Timestamps travel as ISO strings, the same values a JSON-decoded cache hit carries
+    """
+    table = pyarrow.Table.from_pylist(rows)
+    for pos, field in enumerate(table.schema):
+        if pyarrow.types.is_temporal(field.type):
+            iso = [value.isoformat() if value is not None else None for value in table.column(pos).to_pylist()]
+            table = table.set_column(pos, field.name, pyarrow.array(iso, pyarrow.string()))
+    metadata = {
+        key: value for key, value in content.items()
+        if not (isinstance(value, list) and value and isinstance(value[0], dict))
+    }
+    table = table.replace_schema_metadata({"response": dumps_json(metadata)})
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def negotiated_response(request: Request, content: Dict, rows: Optional[List[Dict]] = None) -> Response:
+    """
+    Serialize content for the request's Accept / Accept-Encoding headers
+
+    rows: the tabular part of the response (e.g. content["stocks"]) - enables Arrow;
+        responses without rows are offered as JSON / msgpack only
+    """
+    media_type = negotiate_media_type(request.headers.get("accept"), has_rows=rows is not None)
+    if media_type == ARROW:
+        body = dumps_arrow(content, rows)
+    elif media_type == MSGPACK:
+        body = dumps_msgpack(content)
+    else:
+        body = dumps_json(content)
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if len(body) >= settings.RESPONSE_COMPRESSION_MIN_BYTES:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        if encoding:
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+
+    return Response(content=body, media_type=media_type, headers=headers)
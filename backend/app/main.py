@@ -10,9 +10,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import stocks, admin
 from app.core.config import settings
-from app.models.database import init_db
+from app.models.database import init_db, SessionLocal
+from app.services.dynamic_magic_formula import dynamic_magic_formula
+from app.services.period_summary import period_summary_service
+from app.services.backtest import backtest_service
 from app.services.background_processor import background_processor
 from app.services.continuous_fetcher import continuous_fetcher
+from app.services.http_client import http_client
 import logging
 import asyncio
 
@@ -41,13 +45,35 @@ async def startup_event():
     logger.info("Starting Magic Formula API v2.0")
     init_db()
     
-    # Start continuous fetcher (1 stock/minute = 60/hour = 1440/day)
-    # Will run for 1 WEEK to collect all stocks for years 2017-2024
+    # Warm the in-process period snapshots so the first dashboard hits are served from memory
+    db = SessionLocal()
+    try:
+        dynamic_magic_formula.preload_snapshots(db)
+    except Exception as e:
+        logger.error(f"Snapshot preload failed: {e}")
+    finally:
+        db.close()
+    
+    # Zone-map statistics for periods stored before period_summary existed
+    db = SessionLocal()
+    try:
+        period_summary_service.backfill(db)
+    except Exception as e:
+        logger.error(f"Period summary backfill failed: {e}")
+    finally:
+        db.close()
+    
+    # One pooled HTTP client (keep-alive, DNS cache, timeouts) shared by every provider call
+    await http_client.start()
+    
+    # Backtest sweep workers, spawned once and reused by every sweep request
+    backtest_service.start_pool()
+    
+    # Start continuous fetcher (paced by the per-provider token-bucket rate limiter)
+    # Collects all stocks for years 2017-2024
     logger.info("="*70)
     logger.info("🚀 Starting Continuous Stock Fetcher")
-    logger.info("Strategy: 1 stock per minute")
-    logger.info("Rate: 60 stocks/hour, 1,440 stocks/day")
-    logger.info("Duration: Running for 1 WEEK to complete data collection")
+    logger.info("Strategy: 1 stock at a time, as fast as provider rate limits allow")
     logger.info("Target: ~516 stocks × 8 years = ~4,128 records")
     logger.info("Years: 2017-2024 (8 years)")
     logger.info("="*70)
@@ -55,7 +81,7 @@ async def startup_event():
     
     # DISABLED: background_processor (stopped for 1 WEEK while continuous_fetcher runs)
     # background_processor runs in large batches and hits rate limits
-    # continuous_fetcher is slower but respects API limits (1 stock/min)
+    # continuous_fetcher is slower but respects API limits (per-provider rate limiter)
     # After 3 days, re-enable it and disable continuous_fetcher
     # asyncio.create_task(background_processor.run_continuous())
 
@@ -63,6 +89,8 @@ async def startup_event():
 async def shutdown_event():
     logger.info("Shutting down...")
     # background_processor.stop()  # Disabled for now
+    await http_client.close()
+    backtest_service.shutdown_pool()
 
 @app.get("/")
 async def root():
@@ -71,10 +99,21 @@ async def root():
 @app.get("/health")
 async def health_check():
     from app.services.cache_service import cache_service
+    from app.services.period_snapshot_cache import period_snapshot_cache
+    from app.services.http_cache import http_cache
+    from app.services.rank_index import rank_index_registry
+    from app.services.rate_limiter import rate_limiter
+    from app.services.ticker_details_cache import ticker_details_cache
     return {
         "status": "healthy",
         "cache": {
             "status": "connected" if cache_service.health_check() else "unavailable",
             "stats": cache_service.get_cache_stats()
-        }
+        },
+        "period_snapshots": period_snapshot_cache.get_stats(),
+        "rank_indexes": rank_index_registry.get_stats(),
+        "rate_limits": rate_limiter.get_stats(),
+        "ticker_details": ticker_details_cache.get_stats(),
+        "http_cache": http_cache.get_stats(),
+        "http_client": http_client.get_stats()
     }
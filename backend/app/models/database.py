@@ -2,8 +2,12 @@
 Database Models for Stock Data Storage
 Stores ALL stocks with complete financial data - Magic Formula applied dynamically on query
 """
-from sqlalchemy import Column, Integer, String, Float, DateTime, Index, create_engine, UniqueConstraint
+from sqlalchemy import (
+    Column, Integer, String, Float, DateTime, Index, JSON, create_engine, UniqueConstraint,
+    delete, func, select, text, tuple_
+)
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 from app.core.config import settings
@@ -51,12 +55,12 @@ class StockData(Base):
     # Indexes for fast queries
     __table_args__ = (
         # Unique constraint: one record per symbol + year + month combination
+        # (its index also serves per-symbol history lookups)
         UniqueConstraint('symbol', 'year', 'month', name='uix_symbol_year_month'),
         
         # Query optimization indexes
         Index('idx_year', 'year'),
         Index('idx_year_month', 'year', 'month'),
-        Index('idx_symbol_year', 'symbol', 'year'),
         Index('idx_earnings_yield', 'earnings_yield'),
         Index('idx_return_on_capital', 'return_on_capital'),
     )
@@ -129,14 +133,109 @@ class YearCompletion(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+class PrecomputedRanking(Base):
+    """
+    Pre-computed Magic Formula ranking under the default filter profile
+    Rebuilt set-wise after each background batch - read with ORDER BY rank LIMIT n
+    """
+    __tablename__ = 'stock_rankings'
+    
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # Ranked row in stock_data
+    stock_data_id = Column(Integer, nullable=False, index=True)
+    symbol = Column(String(10), nullable=False)
+    
+    # Ranked period - month NULL = ranked across every record of the year
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=True)
+    
+    # Ranks (lower = better)
+    ey_rank = Column(Integer, nullable=False)
+    roc_rank = Column(Integer, nullable=False)
+    magic_formula_score = Column(Integer, nullable=False)
+    rank = Column(Integer, nullable=False)
+    
+    computed_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_rankings_period_rank', 'year', 'month', 'rank'),
+    )
+
+
+class PeriodSummary(Base):
+    """
+    Period catalog + zone-map statistics, one row per (year, month)
+    Counters are maintained by the ingest code in the same transaction as each write;
+    statistics are refreshed after each write batch (min / max widened on every write)
+    Lets the API list periods, report completion and answer impossible filters without scanning stock_data
+    """
+    __tablename__ = 'period_summary'
+    
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # Summarized period - month NULL = yearly data
+    year = Column(Integer, nullable=False)
+    month = Column(Integer, nullable=True)
+    
+    # Ranked rows: month NULL = every record of the year (same scope as the rankings)
+    stock_count = Column(Integer, default=0)
+    
+    # Rows stored with exactly this (year, month) and their latest update
+    stored_count = Column(Integer, default=0)
+    last_updated = Column(DateTime, nullable=True)
+    
+    # failed_stocks rows of exactly this (year, month) by status
+    pending_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    
+    # {metric: {min, max, null_count, quantiles}} for ebit / market_cap / earnings_yield / return_on_capital
+    column_stats = Column(JSON, nullable=False, default=dict)
+    # {sector: row count}
+    sector_counts = Column(JSON, nullable=False, default=dict)
+    
+    computed_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # One row per period; month is coalesced so two yearly (NULL month) rows collide too
+        Index('uix_period_summary_period', year, func.coalesce(month, 0), unique=True),
+    )
+
+
 # Database connection - use Keycloak database
 DATABASE_URL = settings.DATABASE_URL
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Indexes replaced by newer ones - dropped from existing databases by init_db
+# once their replacements exist, so writes stop maintaining both
+RETIRED_INDEXES = [
+    'idx_symbol_year',  # prefix of uix_symbol_year_month
+    'idx_symbol_period',  # same key as uix_symbol_year_month
+]
+
+def drop_duplicate_period_summaries(conn):
+    """
+    Remove every row of a period summarized more than once (written before the
+    unique index existed) - PeriodSummaryService.backfill rebuilds them from scratch
+    """
+    period = (PeriodSummary.year, func.coalesce(PeriodSummary.month, 0))
+    duplicated = select(*period).group_by(*period).having(func.count() > 1)
+    conn.execute(delete(PeriodSummary.__table__).where(tuple_(*period).in_(duplicated)))
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
+    
+    # create_all skips existing tables - add indexes introduced since and drop the ones they replace
+    with engine.begin() as conn:
+        drop_duplicate_period_summaries(conn)
+        for table in (StockData.__table__, PeriodSummary.__table__):
+            for index in table.indexes:
+                # IF NOT EXISTS rather than checkfirst: reflection misses expression indexes
+                conn.execute(CreateIndex(index, if_not_exists=True))
+        for name in RETIRED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
 
 def get_db():
     """Get database session"""
@@ -4,6 +4,7 @@ Pydantic Models for API Responses
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
 from datetime import datetime
+from app.core.config import settings
 
 class StockRanking(BaseModel):
     """Stock with Magic Formula ranking"""
@@ -42,3 +43,32 @@ class UserInfo(BaseModel):
     username: str
     email: Optional[str]
     roles: List[str]
+
+class BacktestSweepRequest(BaseModel):
+    """Parameter grid for a backtest sweep - every combination is run"""
+    start_year: int
+    end_year: int
+    top_n: List[int] = Field(default=[30])
+    rebalance_every: List[int] = Field(default=[1])
+    min_earnings_yield: List[float] = Field(default=[0.0])
+    min_return_on_capital: List[float] = Field(default=[0.0])
+    min_market_cap: List[float] = Field(default=[settings.MIN_MARKET_CAP])
+
+class FilterCombination(BaseModel):
+    """One set of screener thresholds"""
+    min_earnings_yield: float = 0.0
+    min_return_on_capital: float = 0.0
+    min_market_cap: float = settings.MIN_MARKET_CAP
+
+class FilterSweepRequest(BaseModel):
+    """Several screener settings evaluated against one period"""
+    year: int
+    month: Optional[int] = Field(default=None, ge=1, le=12)
+    top_n: int = Field(default=10, ge=1, le=500)
+    combinations: List[FilterCombination]
+
+class SymbolLookupRequest(BaseModel):
+    """Current metrics and rank of a list of symbols in one period"""
+    symbols: List[str] = Field(min_length=1, max_length=settings.SYMBOL_LOOKUP_MAX_SYMBOLS)
+    year: int
+    month: Optional[int] = Field(default=None, ge=1, le=12)
@@ -1,14 +1,24 @@
 """
 Admin endpoints for cache management
 """
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from typing import Dict
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, Optional
+from sqlalchemy.orm import Session
+from app.core.periods import parse_years
+from app.models.database import get_db
 from app.services.keycloak_auth import get_current_user
+from app.services.parquet_transfer import parquet_transfer_service
 from app.services.stock_data_service import stock_data_service
 from app.services.magic_formula import magic_formula
 from app.services.cache_service import cache_service
 from datetime import datetime
 import logging
+import os
+import shutil
+import tempfile
 
 logger = logging.getLogger(__name__)
 
@@ -107,3 +117,42 @@ async def invalidate_cache(
         return {"message": f"Cache invalidated for {year}"}
     else:
         raise HTTPException(status_code=500, detail="Failed to invalidate cache")
+
+@router.get("/export/parquet")
+async def export_parquet(
+    years: str = Query(..., description="Years to export, e.g. 2017-2024 or 2017,2019"),
+    month: Optional[int] = Query(default=None, ge=1, le=12, description="Only this month of each year"),
+    current_user: Dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Download stock_data periods as a zipped Parquet dataset (one partition per year)
+    Load it elsewhere with: python stock_data_transfer.py import <unzipped dir>
+    """
+    try:
+        year_list = parse_years(years)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"User {current_user['username']} exporting stock_data for {years} to Parquet")
+    
+    workdir = tempfile.mkdtemp(prefix="stock_data_export_")
+    try:
+        result = await run_in_threadpool(
+            parquet_transfer_service.export, db, year_list, os.path.join(workdir, "stock_data"), month
+        )
+        if not result["rows"]:
+            raise HTTPException(status_code=404, detail=f"No stock data stored for {years}")
+        archive = shutil.make_archive(os.path.join(workdir, "stock_data"), "zip", os.path.join(workdir, "stock_data"))
+    except RuntimeError as e:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+    
+    return FileResponse(
+        archive,
+        media_type="application/zip",
+        filename=f"stock_data_{years.replace(',', '_')}.zip",
+        background=BackgroundTask(shutil.rmtree, workdir, ignore_errors=True)
+    )
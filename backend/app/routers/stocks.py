@@ -3,27 +3,178 @@ FAST API Routes for Dynamic Magic Formula Ranking
 Reads ALL stocks from database, applies Magic Formula dynamically
 Fast responses with flexible filtering
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import List, Dict, Optional
 from sqlalchemy.orm import Session
-from app.models.database import StockData, get_db
-from app.services.dynamic_magic_formula import dynamic_magic_formula
+from app.models.database import StockData, SessionLocal, get_db
+from app.services.dynamic_magic_formula import DETAIL_COLUMNS, dynamic_magic_formula
+from app.services.cache_service import cache_service
+from app.services.backtest import backtest_service
+from app.services.period_summary import period_summary_service
+from app.models.schemas import BacktestSweepRequest, FilterSweepRequest, SymbolLookupRequest
 from app.services.keycloak_auth import get_current_user
 from app.core.config import settings
+from app.core.periods import parse_years
+from app.core.responses import dumps_json, negotiated_response
 from datetime import datetime
+import csv
+import io
+import itertools
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# CSV export columns: rank fields first, then the stock data
+EXPORT_FIELDS = ['rank', 'magic_formula_score', 'ey_rank', 'roc_rank'] + [column.key for column in DETAIL_COLUMNS]
+
+
+@router.post("/top/sweep")
+async def sweep_filters(
+    request: FilterSweepRequest,
+    http_request: Request,
+    current_user: Dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Evaluate a list of filter combinations for one period in one request
+    
+    The period is loaded and sorted once; every combination reuses the sort.
+    Lets the UI prefetch a slider's neighbouring values in a single round trip.
+    """
+    current_year = datetime.now().year
+    if request.year < 2000 or request.year > current_year:
+        raise HTTPException(status_code=400, detail=f"Year must be between 2000 and {current_year}")
+    if not request.combinations or len(request.combinations) > settings.FILTER_SWEEP_MAX_COMBINATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Between 1 and {settings.FILTER_SWEEP_MAX_COMBINATIONS} combinations per request"
+        )
+    
+    logger.info(f"User {current_user['username']} sweeping {len(request.combinations)} filter combinations "
+                f"for {request.year}{f'-{request.month:02d}' if request.month else ''}")
+    
+    stock_count = dynamic_magic_formula.get_stock_count(db, year=request.year, month=request.month)
+    if stock_count == 0:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No data available for {request.year}. Check /periods for available data."
+        )
+    
+    results = dynamic_magic_formula.sweep_filters(
+        db, request.year, request.month,
+        [combination.model_dump() for combination in request.combinations],
+        top_n=request.top_n
+    )
+    
+    return negotiated_response(http_request, {
+        "year": request.year,
+        "month": request.month,
+        "top_n": request.top_n,
+        "total_in_database": stock_count,
+        "results": results,
+        "generated_at": datetime.now().isoformat()
+    })
+
+def reject_impossible_filters(db: Session, year: int, month: Optional[int], filters: Dict):
+    """
+    404 straight from the period's zone map when no stock can pass the filters
+    Periods without a summary (e.g. months that fall back to yearly data) are ranked normally
+    """
+    if dynamic_magic_formula.is_default_filters(**filters):
+        return
+    estimate = period_summary_service.estimate(db, year, month, **filters)
+    if estimate and estimate["stock_count"] > 0 and estimate["impossible"]:
+        period_str = f"{year}-{month:02d}" if month else f"{year}"
+        logger.info(f"🚫 Filters cannot match any stock in {period_str} (period summary)")
+        raise HTTPException(
+            status_code=404,
+            detail=f"No stocks match the criteria for {period_str}. Try relaxing filters."
+        )
+
+def validate_year_range(start_year: int, end_year: int):
+    """Backtest year range: at least two years inside 2000..current year"""
+    current_year = datetime.now().year
+    if start_year < 2000 or end_year > current_year:
+        raise HTTPException(status_code=400, detail=f"Years must be between 2000 and {current_year}")
+    if end_year <= start_year:
+        raise HTTPException(status_code=400, detail="end_year must be after start_year")
+
+@router.get("/top/batch")
+async def get_top_stocks_batch(
+    request: Request,
+    years: str = Query(..., description="Years to rank, e.g. 2017-2024 or 2017,2019,2021"),
+    month: Optional[int] = Query(default=None, ge=1, le=12, description="Optional month (applies to every year)"),
+    top_n: int = Query(default=10, ge=1, le=500, description="Number of top stocks per period"),
+    min_earnings_yield: float = Query(default=0.0, description="Minimum earnings yield filter"),
+    min_return_on_capital: float = Query(default=0.0, description="Minimum return on capital filter"),
+    min_market_cap: float = Query(default=settings.MIN_MARKET_CAP, description="Minimum market cap filter"),
+    stream: bool = Query(default=False, description="Stream one NDJSON line per period as it is ranked"),
+    current_user: Dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Get top N stocks for several periods in one request
+    
+    - One query loads all requested periods, each period is ranked in one vectorized pass
+    - Periods without data are returned with an empty stocks list
+    - stream=true returns application/x-ndjson, one line per period in year order
+    """
+    try:
+        year_list = parse_years(years)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"User {current_user['username']} requesting top {top_n} stocks for {len(year_list)} periods ({years})")
+    
+    filters = {
+        "min_earnings_yield": min_earnings_yield,
+        "min_return_on_capital": min_return_on_capital,
+        "min_market_cap": min_market_cap
+    }
+    
+    if stream:
+        def generate():
+            # Request-scoped dependencies are closed before the body is streamed
+            stream_db = SessionLocal()
+            try:
+                for period in dynamic_magic_formula.iter_top_stocks_batch(
+                    stream_db, year_list, month=month, top_n=top_n, **filters
+                ):
+                    yield json.dumps(jsonable_encoder(period)) + "\n"
+            finally:
+                stream_db.close()
+        
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+    
+    periods = dynamic_magic_formula.get_top_stocks_batch(
+        db, year_list, month=month, top_n=top_n, **filters
+    )
+    
+    logger.info(f"✅ Returned {sum(len(p['stocks']) for p in periods)} stocks across {len(periods)} periods")
+    
+    return negotiated_response(request, {
+        "years": year_list,
+        "month": month,
+        "top_n": top_n,
+        "periods": periods,
+        "filters_applied": filters,
+        "generated_at": datetime.now().isoformat()
+    }, rows=[stock for period in periods for stock in period["stocks"]])
+
 @router.get("/top/year/{year}")
 async def get_top_stocks_by_year(
+    request: Request,
     year: int,
     top_n: int = Query(default=10, ge=1, le=500, description="Number of top stocks to return"),
     min_earnings_yield: float = Query(default=0.0, description="Minimum earnings yield filter"),
     min_return_on_capital: float = Query(default=0.0, description="Minimum return on capital filter"),
     min_market_cap: float = Query(default=settings.MIN_MARKET_CAP, description="Minimum market cap filter"),
+    after_rank: int = Query(default=0, ge=0, description="Return stocks ranked after this rank (next_after_rank of the previous page)"),
     current_user: Dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -37,70 +188,102 @@ async def get_top_stocks_by_year(
     
     Query Parameters:
     - top_n: Number of top stocks (1-500)
+    - after_rank: Keyset pagination cursor (default: 0 = first page)
     - min_earnings_yield: Minimum earnings yield % (default: 0)
     - min_return_on_capital: Minimum return on capital % (default: 0)
     - min_market_cap: Minimum market cap in $ (default: 1B)
     """
     logger.info(f"User {current_user['username']} requesting top {top_n} stocks for {year}")
-    logger.info(f"Filters: EY>={min_earnings_yield}%, ROC>={min_return_on_capital}%, Market Cap>=${min_market_cap}")
+    
+    filters = {
+        "min_earnings_yield": min_earnings_yield,
+        "min_return_on_capital": min_return_on_capital,
+        "min_market_cap": min_market_cap
+    }
+    payload = top_stocks_for_year(db, year, top_n, filters, after_rank)
+    return negotiated_response(request, payload, rows=payload["stocks"])
+
+def top_stocks_for_year(db: Session, year: int, top_n: int, filters: Dict, after_rank: int = 0) -> Dict:
+    """
+    Response body of /top/year/{year} - shared with the legacy route
+    Validates the year, serves cached results, raises 404 when nothing matches
+    """
+    logger.info(f"Filters: EY>={filters['min_earnings_yield']}%, ROC>={filters['min_return_on_capital']}%, "
+                f"Market Cap>=${filters['min_market_cap']}")
     
     # Validate year
     current_year = datetime.now().year
     if year < 2000 or year > current_year:
         raise HTTPException(status_code=400, detail=f"Year must be between 2000 and {current_year}")
     
-    # Check if data exists
-    stock_count = dynamic_magic_formula.get_stock_count(db, year=year, month=None)
-    if stock_count == 0:
-        raise HTTPException(
-            status_code=404, 
-            detail=f"No data available for {year}. Background job may still be processing. Check /periods for available data."
+    # Popular screener settings are served straight from Redis; the generation is read
+    # once, before ranking, so a concurrent write cannot file a stale result under a newer one
+    generation = cache_service.get_period_generation(year, None)
+    cached = cache_service.get_ranked_result(year, None, top_n, generation, **filters, after_rank=after_rank)
+    if cached:
+        logger.info(f"⚡ Ranked result cache hit for {year}")
+        result = cached
+    else:
+        reject_impossible_filters(db, year, None, filters)
+        
+        # Apply Magic Formula dynamically - ranking and row counts from one read
+        result = dynamic_magic_formula.rank_period(
+            db=db,
+            year=year,
+            month=None,
+            top_n=top_n,
+            after_rank=after_rank,
+            **filters
         )
-    
-    logger.info(f"📊 Found {stock_count} stocks in database for {year}")
-    
-    # Apply Magic Formula dynamically
-    top_stocks = dynamic_magic_formula.get_top_stocks(
-        db=db,
-        year=year,
-        month=None,
-        top_n=top_n,
-        min_earnings_yield=min_earnings_yield,
-        min_return_on_capital=min_return_on_capital,
-        min_market_cap=min_market_cap
-    )
-    
-    if not top_stocks:
-        raise HTTPException(
-            status_code=404,
-            detail=f"No stocks match the criteria for {year}. Try relaxing filters."
+        
+        if result["total_in_database"] == 0:
+            raise HTTPException(
+                status_code=404, 
+                detail=f"No data available for {year}. Background job may still be processing. Check /periods for available data."
+            )
+        
+        logger.info(f"📊 Found {result['total_in_database']} stocks in database for {year}")
+        
+        # A page past the end is an empty page, not a filter problem
+        if not result["stocks"] and not after_rank:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No stocks match the criteria for {year}. Try relaxing filters."
+            )
+        
+        # Serialized once, natively (orjson); a hit decodes to what the miss renders
+        cache_service.cache_ranked_result(
+            year, None, top_n, generation, **filters, result=dumps_json(result), after_rank=after_rank
         )
     
+    top_stocks = result["stocks"]
+    
     logger.info(f"✅ Returned {len(top_stocks)} stocks after dynamic Magic Formula ranking")
     
     return {
         "year": year,
         "month": None,
         "top_n": top_n,
-        "total_in_database": stock_count,
+        "total_in_database": result["total_in_database"],
+        "total_matching": result.get("total_matching"),
         "total_after_filter": len(top_stocks),
+        "after_rank": after_rank,
+        "next_after_rank": result.get("next_after_rank"),
         "stocks": top_stocks,
-        "filters_applied": {
-            "min_earnings_yield": min_earnings_yield,
-            "min_return_on_capital": min_return_on_capital,
-            "min_market_cap": min_market_cap
-        },
+        "filters_applied": filters,
         "generated_at": datetime.now().isoformat()
     }
 
 @router.get("/top/monthly/{year}/{month}")
 async def get_top_stocks_by_month(
+    request: Request,
     year: int,
     month: int,
     top_n: int = Query(default=10, ge=1, le=500, description="Number of top stocks to return"),
     min_earnings_yield: float = Query(default=0.0, description="Minimum earnings yield filter"),
     min_return_on_capital: float = Query(default=0.0, description="Minimum return on capital filter"),
     min_market_cap: float = Query(default=settings.MIN_MARKET_CAP, description="Minimum market cap filter"),
+    after_rank: int = Query(default=0, ge=0, description="Return stocks ranked after this rank (next_after_rank of the previous page)"),
     current_user: Dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -113,6 +296,7 @@ async def get_top_stocks_by_month(
     
     Query Parameters:
     - top_n: Number of top stocks (1-500)
+    - after_rank: Keyset pagination cursor (default: 0 = first page)
     - min_earnings_yield: Minimum earnings yield % (default: 0)
     - min_return_on_capital: Minimum return on capital % (default: 0)
     - min_market_cap: Minimum market cap in $ (default: 1B)
@@ -128,58 +312,336 @@ async def get_top_stocks_by_month(
     if year < 2000 or year > current_year:
         raise HTTPException(status_code=400, detail=f"Year must be between 2000 and {current_year}")
     
-    # Check if monthly data exists
-    stock_count = dynamic_magic_formula.get_stock_count(db, year=year, month=month)
+    filters = {
+        "min_earnings_yield": min_earnings_yield,
+        "min_return_on_capital": min_return_on_capital,
+        "min_market_cap": min_market_cap
+    }
     
-    # If no monthly data, fall back to yearly
-    if stock_count == 0:
-        logger.info(f"No monthly data for {year}-{month:02d}, falling back to yearly data")
-        stock_count = dynamic_magic_formula.get_stock_count(db, year=year, month=None)
-        used_month = None
+    # Popular screener settings are served straight from Redis; the generation is read
+    # once, before ranking, so a concurrent write cannot file a stale result under a newer one
+    generation = cache_service.get_period_generation(year, month)
+    cached = cache_service.get_ranked_result(year, month, top_n, generation, **filters, after_rank=after_rank)
+    if cached:
+        logger.info(f"⚡ Ranked result cache hit for {year}-{month:02d}")
+        result = cached
     else:
-        used_month = month
+        reject_impossible_filters(db, year, month, filters)
+        
+        # Monthly ranking, falling back to yearly data when the month has none
+        result = dynamic_magic_formula.rank_period(
+            db=db,
+            year=year,
+            month=month,
+            top_n=top_n,
+            fallback_to_yearly=True,
+            after_rank=after_rank,
+            **filters
+        )
+        
+        if result["total_in_database"] == 0:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No data available for {year}. Background job may still be processing. Check /periods for available data."
+            )
+        
+        logger.info(f"📊 Found {result['total_in_database']} stocks in database for {year}{f'-{month:02d}' if result['month'] else ''}")
+        
+        # A page past the end is an empty page, not a filter problem
+        if not result["stocks"] and not after_rank:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No stocks match the criteria for {year}-{month:02d}. Try relaxing filters."
+            )
+        
+        # Serialized once, natively (orjson); a hit decodes to what the miss renders
+        cache_service.cache_ranked_result(
+            year, month, top_n, generation, **filters, result=dumps_json(result), after_rank=after_rank
+        )
     
-    if stock_count == 0:
-        raise HTTPException(
-            status_code=404,
-            detail=f"No data available for {year}. Background job may still be processing. Check /periods for available data."
+    used_month = result["month"]
+    top_stocks = result["stocks"]
+    
+    logger.info(f"✅ Returned {len(top_stocks)} stocks after dynamic Magic Formula ranking")
+    
+    return negotiated_response(request, {
+        "year": year,
+        "month": used_month,
+        "requested_month": month,
+        "fallback_to_yearly": (used_month is None and month is not None),
+        "top_n": top_n,
+        "total_in_database": result["total_in_database"],
+        "total_matching": result.get("total_matching"),
+        "total_after_filter": len(top_stocks),
+        "after_rank": after_rank,
+        "next_after_rank": result.get("next_after_rank"),
+        "stocks": top_stocks,
+        "filters_applied": filters,
+        "generated_at": datetime.now().isoformat()
+    }, rows=top_stocks)
+
+@router.get("/export/{year}")
+async def export_ranking(
+    year: int,
+    month: Optional[int] = Query(default=None, ge=1, le=12, description="Optional month (default: whole year)"),
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$", description="ndjson or csv"),
+    min_earnings_yield: float = Query(default=0.0, description="Minimum earnings yield filter"),
+    min_return_on_capital: float = Query(default=0.0, description="Minimum return on capital filter"),
+    min_market_cap: float = Query(default=settings.MIN_MARKET_CAP, description="Minimum market cap filter"),
+    current_user: Dict = Depends(get_current_user)
+):
+    """
+    Export the complete ranked universe of a period (no top_n cap)
+    
+    - Rows are streamed best first from a server-side cursor, memory stays constant
+    - format=ndjson: one JSON object per line; format=csv: header + one row per stock
+    - For paged reads of the top endpoints use after_rank instead
+    """
+    current_year = datetime.now().year
+    if year < 2000 or year > current_year:
+        raise HTTPException(status_code=400, detail=f"Year must be between 2000 and {current_year}")
+    
+    period_str = f"{year}-{month:02d}" if month else f"{year}"
+    logger.info(f"User {current_user['username']} exporting full ranking for {period_str} as {format}")
+    
+    filters = {
+        "min_earnings_yield": min_earnings_yield,
+        "min_return_on_capital": min_return_on_capital,
+        "min_market_cap": min_market_cap
+    }
+    
+    def generate():
+        # Request-scoped dependencies are closed before the body is streamed
+        stream_db = SessionLocal()
+        try:
+            rows = dynamic_magic_formula.iter_ranked_rows(stream_db, year, month, **filters)
+            if format == "ndjson":
+                for row in rows:
+                    yield json.dumps(jsonable_encoder(row)) + "\n"
+                return
+    
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(jsonable_encoder(row))
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        finally:
+            stream_db.close()
+    
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    filename = f"magic_formula_{period_str}.{format}"
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/rank-changes")
+async def get_rank_changes(
+    from_year: int = Query(..., alias="from", description="Earlier year, e.g. 2023"),
+    to_year: int = Query(..., alias="to", description="Later year, e.g. 2024"),
+    month: Optional[int] = Query(default=None, ge=1, le=12, description="Optional month (applies to both years)"),
+    top_n: int = Query(default=10, ge=1, le=500, description="Size of the top list being compared"),
+    min_earnings_yield: float = Query(default=0.0, description="Minimum earnings yield filter"),
+    min_return_on_capital: float = Query(default=0.0, description="Minimum return on capital filter"),
+    min_market_cap: float = Query(default=settings.MIN_MARKET_CAP, description="Minimum market cap filter"),
+    current_user: Dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Which stocks entered or left the top N between two periods, and how the rest moved
+    
+    - entries: in the later top N only (previous_rank = rank in the earlier period, None = not ranked)
+    - exits: in the earlier top N only (rank = rank in the later period, None = not ranked)
+    - movements: in both, change > 0 = moved up
+    """
+    current_year = datetime.now().year
+    for year in (from_year, to_year):
+        if year < 2000 or year > current_year:
+            raise HTTPException(status_code=400, detail=f"Year must be between 2000 and {current_year}")
+    if from_year == to_year:
+        raise HTTPException(status_code=400, detail="from and to must be different years")
+    
+    logger.info(f"User {current_user['username']} requesting top {top_n} rank changes {from_year} -> {to_year}")
+    
+    filters = {
+        "min_earnings_yield": min_earnings_yield,
+        "min_return_on_capital": min_return_on_capital,
+        "min_market_cap": min_market_cap
+    }
+    
+    # Both periods' generations are captured before the delta is computed (see rank_changes_key)
+    cache_key = cache_service.rank_changes_key(from_year, to_year, month, top_n, **filters)
+    result = cache_service.get_rank_changes(cache_key)
+    if result:
+        logger.info(f"⚡ Rank changes cache hit for {from_year} -> {to_year}")
+    else:
+        result = jsonable_encoder(
+            dynamic_magic_formula.rank_changes(db, from_year, to_year, month=month, top_n=top_n, **filters)
         )
+        if not result["ranked_symbols"]["from"] or not result["ranked_symbols"]["to"]:
+            missing = from_year if not result["ranked_symbols"]["from"] else to_year
+            raise HTTPException(
+                status_code=404,
+                detail=f"No stocks match the criteria for {missing}. Check /periods for available data."
+            )
+        cache_service.cache_rank_changes(cache_key, result)
     
-    logger.info(f"📊 Found {stock_count} stocks in database for {year}{f'-{month:02d}' if used_month else ''}")
+    return {
+        "from": from_year,
+        "to": to_year,
+        "month": month,
+        "top_n": top_n,
+        **result,
+        "filters_applied": filters,
+        "generated_at": datetime.now().isoformat()
+    }
+
+@router.get("/symbol/{symbol}/history")
+async def get_symbol_history(
+    symbol: str,
+    current_user: Dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    One company's metrics and Magic Formula rank in every stored period
+    
+    - Ranks use the default filter profile (rank None = did not pass the filters)
+    - Periods are ordered oldest first; yearly rows have month None
+    """
+    symbol = symbol.strip().upper()
+    logger.info(f"User {current_user['username']} requesting history for {symbol}")
+    
+    history = dynamic_magic_formula.get_symbol_history(db, symbol)
+    if history is None:
+        raise HTTPException(status_code=404, detail=f"No stored data for {symbol}")
+    
+    return {
+        **history,
+        "total_periods": len(history["periods"]),
+        "generated_at": datetime.now().isoformat()
+    }
+
+@router.post("/symbols/lookup")
+async def lookup_symbols(
+    request: SymbolLookupRequest,
+    current_user: Dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Metrics and Magic Formula rank of a list of symbols (e.g. a portfolio) in one period
+    
+    - Every symbol is resolved, including stocks ranked far below the top 500
+    - Results follow the request order; unknown symbols come back with found=false
+    - Ranks use the default filter profile (rank None = did not pass the filters)
+    """
+    current_year = datetime.now().year
+    if request.year < 2000 or request.year > current_year:
+        raise HTTPException(status_code=400, detail=f"Year must be between 2000 and {current_year}")
+    
+    symbols = [symbol.strip().upper() for symbol in request.symbols if symbol.strip()]
+    if not symbols:
+        raise HTTPException(status_code=400, detail="At least one symbol is required")
     
-    # Apply Magic Formula dynamically
-    top_stocks = dynamic_magic_formula.get_top_stocks(
-        db=db,
-        year=year,
-        month=used_month,
+    logger.info(f"User {current_user['username']} looking up {len(symbols)} symbols "
+                f"for {request.year}{f'-{request.month:02d}' if request.month else ''}")
+    
+    results = dynamic_magic_formula.lookup_symbols(db, symbols, request.year, request.month)
+    
+    return {
+        "year": request.year,
+        "month": request.month,
+        "requested": len(symbols),
+        "found": sum(1 for result in results if result["found"]),
+        "results": results,
+        "generated_at": datetime.now().isoformat()
+    }
+
+@router.get("/backtest")
+async def run_backtest(
+    start_year: int = Query(..., description="First selection year"),
+    end_year: int = Query(..., description="Last year (prices only - returns run up to this year)"),
+    top_n: int = Query(default=30, ge=1, le=500, description="Number of stocks held"),
+    rebalance_every: int = Query(default=1, ge=1, le=10, description="Rebalance frequency in years"),
+    min_earnings_yield: float = Query(default=0.0, description="Minimum earnings yield filter"),
+    min_return_on_capital: float = Query(default=0.0, description="Minimum return on capital filter"),
+    min_market_cap: float = Query(default=settings.MIN_MARKET_CAP, description="Minimum market cap filter"),
+    current_user: Dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Backtest the Magic Formula portfolio over a year range
+    
+    Returns CAGR, total return, max drawdown, average turnover and per-year returns
+    
+    Stored prices are fetch-time prices, not period-end prices: rows written outside
+    their year (plus BACKTEST_PRICE_GRACE_DAYS) are left unpriced. price_coverage and
+    each period's priced_holdings show how much of the portfolio the returns cover.
+    Periods with no priced holdings report return None; cagr is None when fewer than
+    BACKTEST_MIN_PRICED_PERIODS periods are priced
+    """
+    validate_year_range(start_year, end_year)
+    logger.info(f"User {current_user['username']} backtesting top {top_n} for {start_year}-{end_year}")
+    
+    # CPU-bound: keep the event loop free while the backtest runs
+    result = await run_in_threadpool(
+        backtest_service.run, db, start_year, end_year,
         top_n=top_n,
+        rebalance_every=rebalance_every,
         min_earnings_yield=min_earnings_yield,
         min_return_on_capital=min_return_on_capital,
         min_market_cap=min_market_cap
     )
-    
-    if not top_stocks:
+    result["generated_at"] = datetime.now().isoformat()
+    return result
+
+@router.post("/backtest/sweep")
+async def run_backtest_sweep(
+    request: BacktestSweepRequest,
+    current_user: Dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Backtest every combination of the given parameter lists
+    Data is loaded once; combinations run across a process pool
+    """
+    validate_year_range(request.start_year, request.end_year)
+    grid = {
+        "top_n": request.top_n,
+        "rebalance_every": request.rebalance_every,
+        "min_earnings_yield": request.min_earnings_yield,
+        "min_return_on_capital": request.min_return_on_capital,
+        "min_market_cap": request.min_market_cap
+    }
+    if any(n < 1 for n in request.top_n) or any(k < 1 for k in request.rebalance_every):
+        raise HTTPException(status_code=400, detail="top_n and rebalance_every must be positive")
+    combinations = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    if not combinations or len(combinations) > settings.BACKTEST_MAX_COMBINATIONS:
         raise HTTPException(
-            status_code=404,
-            detail=f"No stocks match the criteria for {year}-{month:02d}. Try relaxing filters."
+            status_code=400,
+            detail=f"Sweep must have between 1 and {settings.BACKTEST_MAX_COMBINATIONS} combinations"
         )
     
-    logger.info(f"✅ Returned {len(top_stocks)} stocks after dynamic Magic Formula ranking")
+    logger.info(f"User {current_user['username']} running a {len(combinations)}-combination backtest sweep")
+    
+    # CPU-bound: keep the event loop free while the pool works
+    results = await run_in_threadpool(
+        backtest_service.sweep, db, request.start_year, request.end_year, combinations
+    )
+    ranked = [r for r in results if r["cagr"] is not None]
+    best = max(ranked, key=lambda r: r["cagr"]) if ranked else None
     
     return {
-        "year": year,
-        "month": used_month,
-        "requested_month": month,
-        "fallback_to_yearly": (used_month is None and month is not None),
-        "top_n": top_n,
-        "total_in_database": stock_count,
-        "total_after_filter": len(top_stocks),
-        "stocks": top_stocks,
-        "filters_applied": {
-            "min_earnings_yield": min_earnings_yield,
-            "min_return_on_capital": min_return_on_capital,
-            "min_market_cap": min_market_cap
-        },
+        "start_year": request.start_year,
+        "end_year": request.end_year,
+        "combinations": len(results),
+        "best": best,
+        "results": results,
         "generated_at": datetime.now().isoformat()
     }
 
@@ -192,7 +654,13 @@ async def get_available_periods(
     Get list of available year/month combinations in database
     Useful for UI to show what data user can query
     """
-    periods = dynamic_magic_formula.get_available_periods(db)
+    # Period catalog lookup; the GROUP BY scan only runs before the catalog is built
+    periods = period_summary_service.get_available_periods(db) or dynamic_magic_formula.get_available_periods(db)
+    
+    # Zone-map statistics (min / max / quantiles / sectors) where already computed
+    summaries = period_summary_service.get_all(db)
+    for period in periods:
+        period["statistics"] = summaries.get((period["year"], period["month"]))
     
     return {
         "available_periods": periods,
@@ -200,6 +668,44 @@ async def get_available_periods(
         "generated_at": datetime.now().isoformat()
     }
 
+@router.get("/periods/{year}/estimate")
+async def estimate_matches(
+    year: int,
+    month: Optional[int] = Query(default=None, ge=1, le=12, description="Optional month"),
+    min_earnings_yield: float = Query(default=0.0, description="Minimum earnings yield filter"),
+    min_return_on_capital: float = Query(default=0.0, description="Minimum return on capital filter"),
+    min_market_cap: float = Query(default=settings.MIN_MARKET_CAP, description="Minimum market cap filter"),
+    current_user: Dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Preview how many stocks a filter set would match ("N stocks would match")
+    Answered from the period summary only - stock_data is not read
+    
+    impossible=true is exact; estimated_matches assumes independent metrics
+    """
+    current_year = datetime.now().year
+    if year < 2000 or year > current_year:
+        raise HTTPException(status_code=400, detail=f"Year must be between 2000 and {current_year}")
+    
+    filters = {
+        "min_earnings_yield": min_earnings_yield,
+        "min_return_on_capital": min_return_on_capital,
+        "min_market_cap": min_market_cap
+    }
+    estimate = period_summary_service.estimate(db, year, month, **filters)
+    if estimate is None:
+        period_str = f"{year}-{month:02d}" if month else f"{year}"
+        raise HTTPException(status_code=404, detail=f"No period summary available for {period_str} yet")
+    
+    return {
+        "year": year,
+        "month": month,
+        **estimate,
+        "filters_applied": filters,
+        "generated_at": datetime.now().isoformat()
+    }
+
 @router.get("/completion")
 async def get_completion_status(
     current_user: Dict = Depends(get_current_user),
@@ -215,9 +721,13 @@ async def get_completion_status(
     # Get all year completions ordered by year descending
     completions = db.query(YearCompletion).order_by(YearCompletion.year.desc()).all()
     
+    # Live failure counters from the period catalog (maintained on every retry transition)
+    summaries = period_summary_service.get_all(db)
+    
     status_list = []
     for comp in completions:
         period_str = f"{comp.year}-{comp.month:02d}" if comp.month else f"{comp.year}"
+        summary = summaries.get((comp.year, comp.month))
         
         status_list.append({
             "year": comp.year,
@@ -226,8 +736,8 @@ async def get_completion_status(
             "status": comp.status,
             "total_symbols": comp.total_symbols,
             "successful_fetches": comp.successful_fetches,
-            "pending_retries": comp.pending_retries,
-            "permanently_failed": comp.permanently_failed,
+            "pending_retries": summary["pending_count"] if summary else comp.pending_retries,
+            "permanently_failed": summary["failed_count"] if summary else comp.permanently_failed,
             "completion_percentage": round(comp.completion_percentage, 2),
             "is_complete": comp.status in ['completed', 'completed_with_failures'],
             "started_at": comp.started_at.isoformat() if comp.started_at else None,
@@ -256,6 +766,7 @@ async def get_completion_status(
 # Legacy endpoint maintained for backward compatibility (removed later)
 @router.get("/legacy/top/year/{year}")
 async def get_cached_top_stocks_legacy(
+    request: Request,
     year: int,
     top_n: int = Query(default=10, ge=1, le=100),
     current_user: Dict = Depends(get_current_user),
@@ -266,12 +777,9 @@ async def get_cached_top_stocks_legacy(
     Use /top/year/{year} instead for dynamic ranking with filters
     """
     logger.warning("Legacy endpoint called - redirect to /top/year/{year}")
-    return await get_top_stocks_by_year(
-        year=year,
-        top_n=top_n,
-        min_earnings_yield=0.0,
-        min_return_on_capital=0.0,
-        min_market_cap=settings.MIN_MARKET_CAP,
-        current_user=current_user,
-        db=db
-    )
+    payload = top_stocks_for_year(db, year, top_n, {
+        "min_earnings_yield": 0.0,
+        "min_return_on_capital": 0.0,
+        "min_market_cap": settings.MIN_MARKET_CAP
+    })
+    return negotiated_response(request, payload, rows=payload["stocks"])
@@ -6,6 +6,8 @@ from sqlalchemy.orm import Session
 from sqlalchemy import and_
 from app.models.database import StockData, FailedStock, YearCompletion, get_db, init_db
 from app.services.stock_data_service import stock_data_service
+from app.services.dynamic_magic_formula import dynamic_magic_formula
+from app.services.period_summary import period_summary_service
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -46,14 +48,18 @@ class BackgroundStockProcessor:
         db.commit()
         
         logger.info(f"Fetching {len(symbols)} stocks...")
-        stocks_data = await stock_data_service.fetch_multiple_stocks_async(symbols, year)
+        deferred_symbols = set()
+        stocks_data = await stock_data_service.fetch_multiple_stocks_async(symbols, year, deferred=deferred_symbols)
         
         successful_symbols = set()
         if stocks_data:
             successful_symbols = {stock['symbol'] for stock in stocks_data}
             logger.info(f"Fetched {len(stocks_data)} stocks")
         
-        failed_symbols = set(symbols) - successful_symbols
+        # Budget-deferred symbols were never attempted: no FailedStock row, no retry_count
+        failed_symbols = set(symbols) - successful_symbols - deferred_symbols
+        if deferred_symbols:
+            logger.info(f"{len(deferred_symbols)} stocks deferred (out of budget) - fetched on the next run")
         
         stored_count = 0
         updated_count = 0
@@ -70,11 +76,13 @@ class BackgroundStockProcessor:
                     ).first()
                     
                     if existing:
+                        previous_sector = existing.sector
                         for key in ['company_name', 'sector', 'ebit', 'enterprise_value', 'tangible_capital',
                                    'earnings_yield', 'return_on_capital', 'market_cap', 'current_price']:
                             setattr(existing, key, stock.get(key))
                         existing.data_source = stock.get('source', 'yfinance')
                         existing.updated_at = datetime.utcnow()
+                        period_summary_service.record_write(db, existing, is_new=False, previous_sector=previous_sector)
                         updated_count += 1
                     else:
                         db_stock = StockData(
@@ -95,6 +103,7 @@ class BackgroundStockProcessor:
                             updated_at=datetime.utcnow()
                         )
                         db.add(db_stock)
+                        period_summary_service.record_write(db, db_stock, is_new=True)
                         stored_count += 1
                     
                     failed = db.query(FailedStock).filter(
@@ -105,7 +114,7 @@ class BackgroundStockProcessor:
                         )
                     ).first()
                     if failed:
-                        failed.status = 'completed'
+                        period_summary_service.set_failure_status(db, failed, 'completed')
                         failed.completed_at = datetime.utcnow()
                     
                     if (stored_count + updated_count) % 100 == 0:
@@ -128,10 +137,10 @@ class BackgroundStockProcessor:
                     existing_failed.next_retry = datetime.utcnow() + timedelta(seconds=3)
                     
                     if existing_failed.retry_count >= existing_failed.max_retries:
-                        existing_failed.status = 'failed'
+                        period_summary_service.set_failure_status(db, existing_failed, 'failed')
                         existing_failed.next_retry = None
                     else:
-                        existing_failed.status = 'pending'
+                        period_summary_service.set_failure_status(db, existing_failed, 'pending')
                 else:
                     failed_stock = FailedStock(
                         symbol=symbol, year=year, month=month,
@@ -140,6 +149,7 @@ class BackgroundStockProcessor:
                         next_retry=datetime.utcnow() + timedelta(seconds=3)
                     )
                     db.add(failed_stock)
+                    period_summary_service.set_failure_status(db, failed_stock, 'pending', new=True)
                 
                 failed_count += 1
             except Exception as e:
@@ -147,27 +157,31 @@ class BackgroundStockProcessor:
                 continue
         
         db.commit()
+        dynamic_magic_formula.notify_period_updated(year, month)
         
+        # Failure counters are maintained with every status change - no recount
+        summary = period_summary_service.get(db, year, month)
         year_completion.successful_fetches = stored_count + updated_count
-        year_completion.pending_retries = db.query(FailedStock).filter(
-            and_(FailedStock.year == year, FailedStock.month == month, FailedStock.status == 'pending')
-        ).count()
-        year_completion.permanently_failed = db.query(FailedStock).filter(
-            and_(FailedStock.year == year, FailedStock.month == month, FailedStock.status == 'failed')
-        ).count()
+        year_completion.pending_retries = summary.pending_count if summary else 0
+        year_completion.permanently_failed = summary.failed_count if summary else 0
         
         total = year_completion.total_symbols
         success = year_completion.successful_fetches
         year_completion.completion_percentage = (success / total * 100) if total > 0 else 0
         
-        if year_completion.pending_retries == 0:
+        if year_completion.pending_retries == 0 and not deferred_symbols:
             year_completion.status = 'completed_with_failures' if year_completion.permanently_failed > 0 else 'completed'
             year_completion.completed_at = datetime.utcnow()
         
         year_completion.updated_at = datetime.utcnow()
         db.commit()
         
-        logger.info(f"Complete: {stored_count} new, {updated_count} updated, {failed_count} failed")
+        if stored_count + updated_count > 0:
+            dynamic_magic_formula.rebuild_rankings_for_writes(db, [(year, month)])
+            period_summary_service.refresh_for_writes(db, [(year, month)])
+        
+        logger.info(f"Complete: {stored_count} new, {updated_count} updated, {failed_count} failed, "
+                    f"{len(deferred_symbols)} deferred")
     
     async def should_refresh_year(self, year: int, month: int, db: Session) -> bool:
         """Check if period needs refresh"""
@@ -220,13 +234,17 @@ class BackgroundStockProcessor:
             return
         
         retry_success = 0
+        retried_periods = set()
         
         for failed in failed_stocks:
             try:
-                failed.status = 'retrying'
+                period_summary_service.set_failure_status(db, failed, 'retrying')
                 db.commit()
                 
-                result = await stock_data_service.fetch_multiple_stocks_async([failed.symbol], failed.year)
+                deferred = set()
+                result = await stock_data_service.fetch_multiple_stocks_async(
+                    [failed.symbol], failed.year, deferred=deferred
+                )
                 
                 if result and len(result) > 0:
                     stock = result[0]
@@ -243,28 +261,38 @@ class BackgroundStockProcessor:
                         fetched_at=datetime.utcnow(), updated_at=datetime.utcnow()
                     )
                     db.add(db_stock)
-                    failed.status = 'completed'
+                    period_summary_service.record_write(db, db_stock, is_new=True)
+                    period_summary_service.set_failure_status(db, failed, 'completed')
                     failed.completed_at = datetime.utcnow()
                     retry_success += 1
+                elif failed.symbol in deferred:
+                    # Out of budget is not another failed attempt - keep the retry count
+                    period_summary_service.set_failure_status(db, failed, 'pending')
                 else:
                     failed.retry_count += 1
                     failed.last_attempt = datetime.utcnow()
                     failed.next_retry = datetime.utcnow() + timedelta(seconds=3)
                     
                     if failed.retry_count >= failed.max_retries:
-                        failed.status = 'failed'
+                        period_summary_service.set_failure_status(db, failed, 'failed')
                         failed.next_retry = None
                     else:
-                        failed.status = 'pending'
+                        period_summary_service.set_failure_status(db, failed, 'pending')
                 
                 db.commit()
+                if failed.status == 'completed':
+                    dynamic_magic_formula.notify_period_updated(failed.year, failed.month, stock=db_stock)
+                    retried_periods.add((failed.year, failed.month))
                 await asyncio.sleep(1)
             except Exception as e:
                 logger.error(f"Error retrying {failed.symbol}: {e}")
-                failed.status = 'pending'
+                db.rollback()
+                period_summary_service.set_failure_status(db, failed, 'pending')
                 db.commit()
         
         if retry_success > 0:
+            dynamic_magic_formula.rebuild_rankings_for_writes(db, retried_periods)
+            period_summary_service.refresh_for_writes(db, retried_periods)
             logger.info(f"Retry complete: {retry_success} succeeded")
     
     async def process_years_sequentially(self, db: Session, start_year: int = 2024, end_year: int = 2017):
@@ -285,15 +313,10 @@ class BackgroundStockProcessor:
                 
                 await self.retry_failed_stocks(db)
                 
-                year_completion.pending_retries = db.query(FailedStock).filter(
-                    and_(FailedStock.year == year, FailedStock.month.is_(None), FailedStock.status == 'pending')
-                ).count()
-                year_completion.permanently_failed = db.query(FailedStock).filter(
-                    and_(FailedStock.year == year, FailedStock.month.is_(None), FailedStock.status == 'failed')
-                ).count()
-                year_completion.successful_fetches = db.query(StockData).filter(
-                    and_(StockData.year == year, StockData.month.is_(None))
-                ).count()
+                summary = period_summary_service.get(db, year, None)
+                year_completion.pending_retries = summary.pending_count if summary else 0
+                year_completion.permanently_failed = summary.failed_count if summary else 0
+                year_completion.successful_fetches = summary.stored_count if summary else 0
                 
                 total = year_completion.total_symbols
                 success = year_completion.successful_fetches
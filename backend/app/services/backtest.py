@@ -0,0 +1,303 @@
+"""
+Magic Formula Backtest Engine
+Replays the strategy over stored stock_data: pick the top N stocks of a year,
+hold them until the next rebalance, measure returns from stored prices
+
+Everything runs on dense symbol x year NumPy matrices loaded with one query;
+parameter sweeps fan out across a long-lived process pool started with the app
+(matrices shipped once per chunk of combinations)
+
+Limitation: stock_data has no period-end price. current_price is the price at
+fetch time (Polygon derives it from today's market cap / shares and stamps it on
+every historical year of a symbol), so a row's price is only used when the row
+was written during its year or within BACKTEST_PRICE_GRACE_DAYS after it. Other
+rows are unpriced; price_coverage reports the share of rows that kept a price
+"""
+import logging
+import multiprocessing
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.database import StockData
+from app.services.ranking_engine import RankingColumns, encode_sectors, filter_mask, rank_columns
+
+logger = logging.getLogger(__name__)
+
+
+class BacktestData:
+    """
+    Dense symbol x year matrices for a year range
+    Missing (symbol, year) cells are NaN; sector_codes -1 = no row
+    With several rows per (symbol, year) the most recently inserted one wins
+    """
+
+    __slots__ = ('years', 'symbols', 'ebit', 'market_cap', 'earnings_yield',
+                 'return_on_capital', 'price', 'sector_codes', 'sectors')
+
+    def __init__(self, years: np.ndarray, symbols: List[str], ebit: np.ndarray, market_cap: np.ndarray,
+                 earnings_yield: np.ndarray, return_on_capital: np.ndarray, price: np.ndarray,
+                 sector_codes: np.ndarray, sectors: List[Optional[str]]):
+        self.years = years
+        self.symbols = symbols
+        self.ebit = ebit
+        self.market_cap = market_cap
+        self.earnings_yield = earnings_yield
+        self.return_on_capital = return_on_capital
+        self.price = price
+        self.sector_codes = sector_codes
+        self.sectors = sectors
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[tuple], start_year: int, end_year: int) -> 'BacktestData':
+        """
+        Build the matrices from (symbol, year, ebit, market_cap, earnings_yield,
+        return_on_capital, current_price, sector) rows in insertion order
+        """
+        years = np.arange(start_year, end_year + 1, dtype=np.int64)
+        shape_years = len(years)
+        if not rows:
+            empty = np.empty((0, shape_years))
+            return cls(years, [], empty, empty, empty, empty, empty,
+                       np.empty((0, shape_years), dtype=np.int32), [])
+
+        symbols, ys, ebit, market_cap, ey, roc, price, sectors = zip(*rows)
+        symbol_table, symbol_idx = np.unique(np.asarray(symbols, dtype=object), return_inverse=True)
+        year_idx = np.asarray(ys, dtype=np.int64) - start_year
+        sector_codes, sector_table = encode_sectors(sectors)
+
+        def dense(values, dtype=np.float64, fill=np.nan):
+            matrix = np.full((len(symbol_table), shape_years), fill, dtype=dtype)
+            # Fancy assignment keeps the last write for duplicate cells
+            matrix[symbol_idx, year_idx] = np.asarray(
+                [fill if v is None else v for v in values], dtype=dtype
+            )
+            return matrix
+
+        return cls(
+            years=years,
+            symbols=symbol_table.tolist(),
+            ebit=dense(ebit),
+            market_cap=dense(market_cap),
+            earnings_yield=dense(ey),
+            return_on_capital=dense(roc),
+            price=dense(price),
+            sector_codes=dense(sector_codes, dtype=np.int32, fill=-1),
+            sectors=sector_table
+        )
+
+    def columns(self, year_pos: int) -> RankingColumns:
+        """RankingColumns of one year (rows = symbols, in symbol order)"""
+        return RankingColumns(
+            ebit=self.ebit[:, year_pos],
+            market_cap=self.market_cap[:, year_pos],
+            earnings_yield=self.earnings_yield[:, year_pos],
+            return_on_capital=self.return_on_capital[:, year_pos],
+            sector_codes=self.sector_codes[:, year_pos],
+            sectors=self.sectors
+        )
+
+    def forward_returns(self) -> np.ndarray:
+        """
+        returns[s, y] = price[s, y + 1] / price[s, y] - 1
+        NaN when either price is missing or not positive; last column is NaN
+        """
+        returns = np.full(self.price.shape, np.nan)
+        current, following = self.price[:, :-1], self.price[:, 1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = following / current - 1.0
+        step[~((current > 0) & (following > 0))] = np.nan
+        returns[:, :-1] = step
+        return returns
+
+
+def run_backtest(
+    data: BacktestData,
+    top_n: int = 30,
+    rebalance_every: int = 1,
+    min_earnings_yield: float = 0.0,
+    min_return_on_capital: float = 0.0,
+    min_market_cap: float = settings.MIN_MARKET_CAP
+) -> Dict:
+    """
+    Equal-weight Magic Formula portfolio over data.years
+
+    - Every rebalance_every years the portfolio becomes the top_n stocks of that year
+    - Holding-period return of a year = mean forward return of the held stocks
+      (stocks without a price for the next year are left out of the mean)
+    - A period where no held stock is priced reports return None and is not
+      compounded; periods ends at the last priced period
+    - cagr annualizes over the priced periods, None below BACKTEST_MIN_PRICED_PERIODS
+    - Turnover = share of the portfolio replaced at a rebalance
+
+    - price_coverage = share of stored (symbol, year) rows with a usable price
+
+    Tie-breaking follows symbol order (the live ranking uses row id order)
+    """
+    num_symbols, num_years = data.price.shape
+    returns = data.forward_returns()
+    stored = data.sector_codes >= 0
+    stored_rows = int(np.count_nonzero(stored))
+    price_coverage = float(np.count_nonzero(stored & ~np.isnan(data.price)) / stored_rows) if stored_rows else 0.0
+    holdings = np.zeros((num_symbols, num_years), dtype=bool)
+    turnover = []
+
+    held = np.zeros(num_symbols, dtype=bool)
+    for pos in range(num_years - 1):
+        if pos % rebalance_every == 0:
+            columns = data.columns(pos)
+            mask = filter_mask(
+                columns, min_earnings_yield, min_return_on_capital, min_market_cap, settings.EXCLUDED_SECTORS
+            )
+            ranked = rank_columns(columns, mask=mask, top_n=top_n)
+            selected = np.zeros(num_symbols, dtype=bool)
+            selected[ranked.positions] = True
+            if held.any() and selected.any():
+                turnover.append(1.0 - np.count_nonzero(held & selected) / np.count_nonzero(selected))
+            held = selected
+        holdings[:, pos] = held
+
+    # Mean forward return of each year's holdings (NaN when nothing held is priced:
+    # the period has no data, it is not a flat year)
+    priced = holdings & ~np.isnan(returns)
+    counts = priced.sum(axis=0)
+    totals = np.where(priced, returns, 0.0).sum(axis=0)
+    period_returns = np.divide(totals, counts, out=np.full(num_years, np.nan), where=counts > 0)[:-1]
+
+    # The curve compounds priced periods only and ends at the last priced one
+    priced_periods = np.flatnonzero(~np.isnan(period_returns))
+    periods = int(priced_periods[-1]) + 1 if len(priced_periods) else 0
+    equity = np.cumprod(np.where(np.isnan(period_returns[:periods]), 1.0, 1.0 + period_returns[:periods]))
+    curve = np.concatenate(([1.0], equity))
+    drawdowns = curve / np.maximum.accumulate(curve) - 1.0
+    compounded = len(priced_periods)
+    cagr = (float(curve[-1] ** (1.0 / compounded) - 1.0)
+            if compounded >= settings.BACKTEST_MIN_PRICED_PERIODS and curve[-1] > 0 else None)
+
+    return {
+        "top_n": top_n,
+        "rebalance_every": rebalance_every,
+        "filters": {
+            "min_earnings_yield": min_earnings_yield,
+            "min_return_on_capital": min_return_on_capital,
+            "min_market_cap": min_market_cap
+        },
+        "start_year": int(data.years[0]),
+        "end_year": int(data.years[-1]),
+        "cagr": cagr,
+        "total_return": float(curve[-1] - 1.0) if compounded else None,
+        "max_drawdown": float(drawdowns.min()) if compounded else None,
+        "average_turnover": float(np.mean(turnover)) if turnover else 0.0,
+        "price_coverage": price_coverage,
+        "priced_periods": compounded,
+        "periods": [
+            {
+                "year": int(data.years[pos]),
+                "holdings": int(holdings[:, pos].sum()),
+                "priced_holdings": int(counts[pos]),
+                "return": None if np.isnan(period_returns[pos]) else float(period_returns[pos]),
+                "equity": None if np.isnan(period_returns[pos]) else float(equity[pos])
+            }
+            for pos in range(periods)
+        ]
+    }
+
+
+def _run_chunk(data: BacktestData, chunk: List[Dict]) -> List[Dict]:
+    """Pool task: one slice of a sweep - the matrices travel with the task, once per slice"""
+    return [run_backtest(data, **params) for params in chunk]
+
+
+class BacktestService:
+    """Loads backtest matrices from the database and runs single backtests or sweeps"""
+
+    def __init__(self):
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_workers = 0
+
+    def start_pool(self, max_workers: Optional[int] = None):
+        """
+        Start the sweep process pool (app startup) - workers are spawned on first use
+        and then live as long as the app. Without a pool every sweep runs inline
+        """
+        if self._pool is not None:
+            return
+        self._pool_workers = max_workers or settings.BACKTEST_MAX_WORKERS or os.cpu_count() or 1
+        if self._pool_workers <= 1:
+            return
+        self._pool = ProcessPoolExecutor(
+            max_workers=self._pool_workers,
+            mp_context=multiprocessing.get_context(settings.BACKTEST_POOL_START_METHOD)
+        )
+        logger.info(f"🧮 Backtest pool: {self._pool_workers} {settings.BACKTEST_POOL_START_METHOD} workers")
+
+    def shutdown_pool(self):
+        """Stop the sweep process pool (app shutdown)"""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    @staticmethod
+    def is_period_price(year: int, updated_at: Optional[datetime]) -> bool:
+        """The stored price was taken during `year` or within the grace period after it"""
+        if updated_at is None:
+            return False
+        return datetime(year, 1, 1) <= updated_at < datetime(year + 1, 1, 1) + timedelta(
+            days=settings.BACKTEST_PRICE_GRACE_DAYS
+        )
+
+    def load_data(self, db: Session, start_year: int, end_year: int) -> BacktestData:
+        """One query for every stock_data row of the year range; prices outside their period are dropped"""
+        rows = db.execute(
+            select(
+                StockData.symbol, StockData.year, StockData.ebit, StockData.market_cap,
+                StockData.earnings_yield, StockData.return_on_capital, StockData.current_price,
+                StockData.sector, StockData.updated_at
+            ).where(
+                StockData.year >= start_year, StockData.year <= end_year
+            ).order_by(StockData.id)
+        ).all()
+        rows = [
+            (symbol, year, ebit, market_cap, ey, roc, price if self.is_period_price(year, updated_at) else None, sector)
+            for symbol, year, ebit, market_cap, ey, roc, price, sector, updated_at in rows
+        ]
+        data = BacktestData.from_rows(rows, start_year, end_year)
+        priced = sum(1 for row in rows if row[6] is not None)
+        logger.info(f"📈 Backtest data {start_year}-{end_year}: {len(data.symbols)} symbols x {len(data.years)} years, "
+                    f"{priced}/{len(rows)} rows with a period price")
+        return data
+
+    def run(self, db: Session, start_year: int, end_year: int, **params) -> Dict:
+        """Single backtest"""
+        return run_backtest(self.load_data(db, start_year, end_year), **params)
+
+    def sweep(
+        self,
+        db: Session,
+        start_year: int,
+        end_year: int,
+        combinations: List[Dict]
+    ) -> List[Dict]:
+        """
+        Run one backtest per parameter combination (results in input order)
+        Small sweeps run inline, larger ones across the process pool, one chunk of
+        combinations per worker so the matrices are pickled once per worker
+        """
+        data = self.load_data(db, start_year, end_year)
+        pool = self._pool
+        if pool is None or len(combinations) < settings.BACKTEST_POOL_THRESHOLD:
+            return _run_chunk(data, combinations)
+
+        size = -(-len(combinations) // self._pool_workers)
+        chunks = [combinations[start:start + size] for start in range(0, len(combinations), size)]
+        logger.info(f"🧮 Backtest sweep: {len(combinations)} combinations in {len(chunks)} pool tasks")
+        futures = [pool.submit(_run_chunk, data, chunk) for chunk in chunks]
+        return [result for future in futures for result in future.result()]
+
+
+# Global instance
+backtest_service = BacktestService()
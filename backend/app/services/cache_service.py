@@ -1,6 +1,7 @@
 """Redis Cache Service"""
 import redis
 import json
+import hashlib
 from typing import Optional, List, Dict
 from datetime import datetime
 from app.core.config import settings
@@ -75,11 +76,159 @@ class CacheService:
             logger.error(f"Cache write error: {e}")
             return False
     
+    def _period_tag(self, month: Optional[int]) -> str:
+        return "all" if month is None else str(month)
+    
+    def _generation_key(self, year: int, month: Optional[int]) -> str:
+        return f"stocks:generation:{year}:{self._period_tag(month)}"
+    
+    def get_period_generation(self, year: int, month: Optional[int] = None) -> Optional[str]:
+        """
+        Data generation token for a period
+        Monthly results also depend on the whole-year generation (yearly fallback)
+        """
+        if not self.redis:
+            return None
+        try:
+            keys = [self._generation_key(year, None)]
+            if month is not None:
+                keys.insert(0, self._generation_key(year, month))
+            return ".".join(value or "0" for value in self.redis.mget(keys))
+        except Exception as e:
+            logger.error(f"Cache read error: {e}")
+            return None
+    
+    def bump_period_generation(self, year: int, month: Optional[int] = None) -> bool:
+        """
+        Called after writes to (year, month): every ranked result cached under the
+        previous generation becomes unreachable, no key scan needed
+        """
+        if not self.redis:
+            return False
+        try:
+            pipe = self.redis.pipeline()
+            pipe.incr(self._generation_key(year, None))
+            if month is not None:
+                pipe.incr(self._generation_key(year, month))
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Cache write error: {e}")
+            return False
+    
+    def _params_digest(
+        self, top_n: int, min_earnings_yield: float, min_return_on_capital: float, min_market_cap: float,
+        after_rank: int = 0
+    ) -> str:
+        """Canonical hash: same screener settings always hash the same (e.g. 1e9 == 1000000000.0)"""
+        params = json.dumps({
+            "top_n": int(top_n),
+            "after_rank": int(after_rank),
+            "min_earnings_yield": float(min_earnings_yield),
+            "min_return_on_capital": float(min_return_on_capital),
+            "min_market_cap": float(min_market_cap)
+        }, sort_keys=True)
+        return hashlib.sha1(params.encode()).hexdigest()[:16]
+    
+    def _ranked_result_key(
+        self, year: int, month: Optional[int], top_n: int, generation: str,
+        min_earnings_yield: float, min_return_on_capital: float, min_market_cap: float,
+        after_rank: int = 0
+    ) -> str:
+        digest = self._params_digest(top_n, min_earnings_yield, min_return_on_capital, min_market_cap, after_rank)
+        return f"stocks:ranked:{year}:{self._period_tag(month)}:g{generation}:{digest}"
+    
+    def get_ranked_result(
+        self, year: int, month: Optional[int], top_n: int, generation: Optional[str],
+        min_earnings_yield: float, min_return_on_capital: float, min_market_cap: float,
+        after_rank: int = 0
+    ) -> Optional[Dict]:
+        """
+        Cached Magic Formula result for these screener settings at `generation`
+        Read the generation once (get_period_generation) before ranking and pass the
+        same value to cache_ranked_result, so a write during ranking cannot file the
+        stale result under the new generation
+        """
+        if generation is None:
+            return None
+        try:
+            data = self.redis.get(self._ranked_result_key(
+                year, month, top_n, generation, min_earnings_yield, min_return_on_capital, min_market_cap,
+                after_rank
+            ))
+            return json.loads(data) if data else None
+        except Exception as e:
+            logger.error(f"Cache read error: {e}")
+            return None
+    
+    def cache_ranked_result(
+        self, year: int, month: Optional[int], top_n: int, generation: Optional[str],
+        min_earnings_yield: float, min_return_on_capital: float, min_market_cap: float,
+        result: bytes, after_rank: int = 0, ttl: int = settings.RESULT_CACHE_TTL
+    ) -> bool:
+        """
+        Store a result computed from data read at `generation` (the value read before ranking)
+        `result` is the JSON body, serialized once by the route (app.core.responses.dumps_json)
+        and stored as-is - keeps this module free of FastAPI for the standalone fetchers
+        """
+        if generation is None:
+            return False
+        try:
+            key = self._ranked_result_key(
+                year, month, top_n, generation, min_earnings_yield, min_return_on_capital, min_market_cap,
+                after_rank
+            )
+            self.redis.setex(key, ttl, result)
+            return True
+        except Exception as e:
+            logger.error(f"Cache write error: {e}")
+            return False
+    
+    def rank_changes_key(
+        self, from_year: int, to_year: int, month: Optional[int], top_n: int,
+        min_earnings_yield: float, min_return_on_capital: float, min_market_cap: float
+    ) -> Optional[str]:
+        """
+        Key carrying both periods' data generations - a write to either side misses
+        Build it once before computing the delta and reuse it for the read and the
+        write, so a write landing mid-computation cannot file a stale delta under
+        the new generations
+        """
+        from_generation = self.get_period_generation(from_year, month)
+        to_generation = self.get_period_generation(to_year, month)
+        if from_generation is None or to_generation is None:
+            return None
+        digest = self._params_digest(top_n, min_earnings_yield, min_return_on_capital, min_market_cap)
+        return (f"stocks:rank_changes:{from_year}:{to_year}:{self._period_tag(month)}:"
+                f"g{from_generation}:g{to_generation}:{digest}")
+    
+    def get_rank_changes(self, key: Optional[str]) -> Optional[Dict]:
+        """Cached rank delta under a key from rank_changes_key"""
+        if key is None:
+            return None
+        try:
+            data = self.redis.get(key)
+            return json.loads(data) if data else None
+        except Exception as e:
+            logger.error(f"Cache read error: {e}")
+            return None
+    
+    def cache_rank_changes(self, key: Optional[str], result: Dict, ttl: int = settings.RESULT_CACHE_TTL) -> bool:
+        if key is None:
+            return False
+        try:
+            self.redis.setex(key, ttl, json.dumps(result))
+            return True
+        except Exception as e:
+            logger.error(f"Cache write error: {e}")
+            return False
+    
     def invalidate_cache(self, year: int):
         if not self.redis:
             return False
         try:
             self.redis.delete(f"stocks:year:{year}:all")
+            self.redis.incr(self._generation_key(year, None))
             return True
         except:
             return False
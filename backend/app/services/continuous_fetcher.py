@@ -1,15 +1,19 @@
 """
-Continuous Stock Fetcher - Respects Polygon API Rate Limits
-Fetches 1 stock per minute = 60 stocks/hour = 1,440 stocks/day
-Timeline: 1 WEEK to collect ~516 stocks x 8 years (2017-2024) = ~4,128 records
+Continuous Stock Fetcher - Respects Provider API Rate Limits
+Fetches one stock at a time as fast as the per-provider rate limiter allows
+Target: ~516 stocks x 8 years (2017-2024) = ~4,128 records
 Strategy: Slow and steady to avoid hitting API rate limits
 """
 import asyncio
 import logging
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from sqlalchemy.orm import Session
 from app.models.database import SessionLocal, StockData
 from app.services.stock_data_service import stock_data_service
+from app.services.dynamic_magic_formula import dynamic_magic_formula
+from app.services.period_summary import period_summary_service
+from app.services.rate_limiter import BudgetExhausted, rate_limiter
 from sqlalchemy import and_
 
 logger = logging.getLogger(__name__)
@@ -17,15 +21,14 @@ logger = logging.getLogger(__name__)
 class ContinuousFetcher:
     """
     Continuous stock fetcher - respects API rate limits
-    Fetches stocks one at a time with delays between each
+    Fetches stocks one at a time, waiting only while every provider is out of budget
     """
     
     def __init__(self):
         self.target_years = [2024, 2023, 2022, 2021, 2020, 2019, 2018, 2017]  # 8 years
-        self.delay_between_stocks = 60  # 60 seconds = 1 minute (safe for Polygon 5/min limit)
-        self.stocks_per_hour = 60
-        self.stocks_per_day = 1440
         self.failed_attempts = {}  # Track failed stock+year combinations to avoid retrying
+        self.rankings_batch_size = 10  # Rebuild pre-computed rankings every N symbols
+        self.pending_ranking_periods = set()  # (year, month) written since the last rebuild
         
     def get_next_stock_to_fetch(self, db: Session) -> tuple:
         """
@@ -58,58 +61,118 @@ class ContinuousFetcher:
         # All stocks fetched!
         return (None, None)
     
+    def store_stock(self, db: Session, stock: Dict, year: int) -> StockData:
+        """
+        Insert or update the (symbol, year) row from fetched stock data - caller commits
+        """
+        # Check if already exists (symbol+year, any month)
+        existing = db.query(StockData).filter(
+            and_(
+                StockData.symbol == stock['symbol'],
+                StockData.year == year
+            )
+        ).first()
+        
+        if existing:
+            # Update existing record
+            previous_sector = existing.sector
+            for key in ['company_name', 'sector', 'ebit', 'enterprise_value', 'tangible_capital',
+                       'earnings_yield', 'return_on_capital', 'market_cap', 'current_price']:
+                setattr(existing, key, stock.get(key))
+            existing.data_source = stock.get('source', 'polygon')
+            existing.updated_at = datetime.utcnow()
+            period_summary_service.record_write(db, existing, is_new=False, previous_sector=previous_sector)
+            stored = existing
+            logger.info(f"✅ Updated {stock['symbol']} ({year})")
+        else:
+            # Create new record
+            # Month comes from the stock data itself (financial data month)
+            db_stock = StockData(
+                symbol=stock['symbol'],
+                company_name=stock['company_name'],
+                sector=stock.get('sector'),
+                year=year,
+                month=stock.get('month'),  # Use stock's month (or None if not available)
+                ebit=stock['ebit'],
+                enterprise_value=stock['enterprise_value'],
+                tangible_capital=stock['tangible_capital'],
+                earnings_yield=stock['earnings_yield'],
+                return_on_capital=stock['return_on_capital'],
+                market_cap=stock['market_cap'],
+                current_price=stock.get('current_price'),
+                data_source=stock.get('source', 'polygon')
+            )
+            db.add(db_stock)
+            period_summary_service.record_write(db, db_stock, is_new=True)
+            stored = db_stock
+            logger.info(f"✅ Stored {stock['symbol']} ({year}) - Source: {stock.get('source', 'polygon')}")
+        
+        return stored
+    
+    def get_missing_years(self, db: Session, symbol: str) -> List[int]:
+        """Target years with no stored row for this symbol (any month) that have not failed before"""
+        stored = {
+            year for (year,) in db.query(StockData.year).filter(
+                StockData.symbol == symbol,
+                StockData.year.in_(self.target_years)
+            ).distinct()
+        }
+        return [
+            year for year in self.target_years
+            if year not in stored and f"{symbol}_{year}" not in self.failed_attempts
+        ]
+    
+    async def fetch_symbol_years(self, symbol: str, db: Session) -> Optional[Tuple[int, int]]:
+        """
+        Symbol-level fetch: one Polygon financials call covers every missing target year
+        All returned years are upserted in one transaction; years Polygon has no usable
+        report for are marked failed (the other sources only return current figures)
+        Returns (stored, failed) or None when Polygon was unavailable (no key, HTTP error)
+        Raises BudgetExhausted (nothing marked failed) when Polygon is out of budget
+        """
+        years = self.get_missing_years(db, symbol)
+        logger.info(f"📥 Fetching {symbol} for years {years} (symbol-level)...")
+        
+        records = await stock_data_service.fetch_symbol_years_async(symbol, years)
+        if records is None:
+            return None
+        
+        try:
+            stored = [self.store_stock(db, records[year], year) for year in sorted(records)]
+            db.commit()
+        except Exception as e:
+            logger.error(f"❌ Error storing {symbol} ({sorted(records)}): {str(e)}")
+            db.rollback()
+            return None
+        
+        for stock in stored:
+            dynamic_magic_formula.notify_period_updated(stock.year, stock.month, stock=stock)
+            self.pending_ranking_periods.add((stock.year, stock.month))
+        
+        failed = [year for year in years if year not in records]
+        for year in failed:
+            self.failed_attempts[f"{symbol}_{year}"] = datetime.now()
+        if failed:
+            logger.info(f"📝 Marked {symbol} {failed} as failed (total failed: {len(self.failed_attempts)})")
+        return len(stored), len(failed)
+    
     async def fetch_one_stock(self, symbol: str, year: int, db: Session) -> bool:
         """
         Fetch a single stock for a single year
         Returns: True if successful, False if failed
+        Raises BudgetExhausted (nothing marked failed) when the providers are out of budget
         """
         try:
             logger.info(f"📥 Fetching {symbol} for year {year}...")
             
             # Fetch the stock data
-            stocks_data = await stock_data_service.fetch_multiple_stocks_async([symbol], year, limit=1)
+            stock = await stock_data_service.fetch_one_stock_async(symbol, year)
             
-            if stocks_data and len(stocks_data) > 0:
-                stock = stocks_data[0]
-                
-                # Check if already exists (symbol+year, any month)
-                existing = db.query(StockData).filter(
-                    and_(
-                        StockData.symbol == stock['symbol'],
-                        StockData.year == year
-                    )
-                ).first()
-                
-                if existing:
-                    # Update existing record
-                    for key in ['company_name', 'sector', 'ebit', 'enterprise_value', 'tangible_capital',
-                               'earnings_yield', 'return_on_capital', 'market_cap', 'current_price']:
-                        setattr(existing, key, stock.get(key))
-                    existing.data_source = stock.get('source', 'polygon')
-                    existing.updated_at = datetime.utcnow()
-                    logger.info(f"✅ Updated {symbol} ({year})")
-                else:
-                    # Create new record
-                    # Month comes from the stock data itself (financial data month)
-                    db_stock = StockData(
-                        symbol=stock['symbol'],
-                        company_name=stock['company_name'],
-                        sector=stock.get('sector'),
-                        year=year,
-                        month=stock.get('month'),  # Use stock's month (or None if not available)
-                        ebit=stock['ebit'],
-                        enterprise_value=stock['enterprise_value'],
-                        tangible_capital=stock['tangible_capital'],
-                        earnings_yield=stock['earnings_yield'],
-                        return_on_capital=stock['return_on_capital'],
-                        market_cap=stock['market_cap'],
-                        current_price=stock.get('current_price'),
-                        data_source=stock.get('source', 'polygon')
-                    )
-                    db.add(db_stock)
-                    logger.info(f"✅ Stored {symbol} ({year}) - Source: {stock.get('source', 'polygon')}")
-                
+            if stock:
+                stored = self.store_stock(db, stock, year)
                 db.commit()
+                dynamic_magic_formula.notify_period_updated(year, stored.month, stock=stored)
+                self.pending_ranking_periods.add((year, stored.month))
                 return True
             else:
                 logger.warning(f"❌ Failed to fetch {symbol} ({year}) - No data from any source")
@@ -119,11 +182,21 @@ class ContinuousFetcher:
                 logger.info(f"📝 Marked {fail_key} as failed (total failed: {len(self.failed_attempts)})")
                 return False
                 
+        except BudgetExhausted:
+            raise
         except Exception as e:
             logger.error(f"❌ Error fetching {symbol} ({year}): {str(e)}")
             db.rollback()
             return False
     
+    def flush_rankings(self, db: Session):
+        """Rebuild pre-computed rankings and period summaries for every period written since the last flush"""
+        if not self.pending_ranking_periods:
+            return
+        dynamic_magic_formula.rebuild_rankings_for_writes(db, self.pending_ranking_periods)
+        period_summary_service.refresh_for_writes(db, self.pending_ranking_periods)
+        self.pending_ranking_periods.clear()
+    
     async def run_continuous(self):
         """
         Main continuous loop - runs forever fetching stocks one by one
@@ -131,17 +204,20 @@ class ContinuousFetcher:
         logger.info("="*70)
         logger.info("🚀 CONTINUOUS STOCK FETCHER STARTED")
         logger.info("="*70)
-        logger.info(f"Strategy: 1 stock every {self.delay_between_stocks} seconds")
-        logger.info(f"Rate: {self.stocks_per_hour} stocks/hour, {self.stocks_per_day} stocks/day")
+        logger.info("Strategy: 1 stock at a time, paced by the per-provider rate limiter")
         logger.info(f"Target: All S&P 500 + NASDAQ 100 + Dow 30 stocks")
         logger.info(f"Years: {', '.join(map(str, self.target_years))}")
         logger.info("="*70)
         
         stocks_fetched = 0
         stocks_failed = 0
+        symbols_processed = 0
         start_time = datetime.now()
         
         while True:
+            # Wait (only) until some provider has budget for another fetch
+            await stock_data_service.multi_source.wait_for_budget()
+            
             db = SessionLocal()
             
             try:
@@ -149,6 +225,7 @@ class ContinuousFetcher:
                 symbol, year = self.get_next_stock_to_fetch(db)
                 
                 if symbol is None:
+                    self.flush_rankings(db)
                     logger.info("="*70)
                     logger.info("🎉 ALL STOCKS FETCHED!")
                     logger.info(f"Total fetched: {stocks_fetched}")
@@ -162,16 +239,33 @@ class ContinuousFetcher:
                     await asyncio.sleep(3600)
                     continue
                 
-                # Fetch the stock
-                success = await self.fetch_one_stock(symbol, year, db)
+                # Every missing year of the symbol from one Polygon call; the per-year
+                # multi-source fetch only stands in when Polygon is not configured
+                try:
+                    result = await self.fetch_symbol_years(symbol, db)
+                    if result is None and not stock_data_service.multi_source.polygon_key:
+                        success = await self.fetch_one_stock(symbol, year, db)
+                        result = (1, 0) if success else (0, 1)
+                    elif result is None:
+                        # Polygon answered with an error - mark the year failed as a per-year fetch would
+                        self.failed_attempts[f"{symbol}_{year}"] = datetime.now()
+                        result = (0, 1)
+                except BudgetExhausted as e:
+                    # Not a failure: the symbol stays next in line until a provider it needs has budget
+                    logger.info(f"⏳ {symbol} ({year}) deferred - {e}")
+                    await rate_limiter.wait_for_any(e.providers)
+                    continue
+                
+                stocks_fetched += result[0]
+                stocks_failed += result[1]
+                symbols_processed += 1
                 
-                if success:
-                    stocks_fetched += 1
-                else:
-                    stocks_failed += 1
+                # Batch finished: refresh pre-computed rankings
+                if symbols_processed % self.rankings_batch_size == 0:
+                    self.flush_rankings(db)
                 
-                # Progress update every 10 stocks
-                if (stocks_fetched + stocks_failed) % 10 == 0:
+                # Progress update every 10 symbols
+                if symbols_processed % 10 == 0:
                     total_stocks = db.query(StockData).count()
                     elapsed = datetime.now() - start_time
                     rate = stocks_fetched / (elapsed.total_seconds() / 3600) if elapsed.total_seconds() > 0 else 0
@@ -185,10 +279,6 @@ class ContinuousFetcher:
                 
             finally:
                 db.close()
-            
-            # Wait before next fetch (60 seconds = 1 stock/minute)
-            logger.info(f"⏳ Waiting {self.delay_between_stocks} seconds before next fetch...")
-            await asyncio.sleep(self.delay_between_stocks)
 
 # Global instance
 continuous_fetcher = ContinuousFetcher()
@@ -4,23 +4,84 @@ Applies Magic Formula ranking ON-DEMAND from stored stock data
 This allows flexibility: users can query top stocks for any year/month dynamically
 """
 import logging
-from typing import List, Dict, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from app.models.database import StockData
+import time
+import numpy as np
+from typing import List, Dict, Iterator, Optional, Sequence, Tuple
+from sqlalchemy.orm import Session, aliased
+from datetime import datetime
+from sqlalchemy import (
+    and_, or_, select, func, Select, delete, insert, literal, any_, bindparam, cast, null, tuple_, union_all,
+    Integer, DateTime, String
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from app.models.database import StockData, PrecomputedRanking, PeriodSummary
 from app.core.config import settings
+from app.services.ranking_engine import (
+    RankingColumns, RankResult, filter_mask, rank_candidates, rank_columns, rank_presorted
+)
+from app.services.period_snapshot_cache import PeriodSnapshot, period_snapshot_cache
+from app.services.cache_service import cache_service
+from app.services.rank_index import PeriodRankIndex, rank_index_registry
 
 logger = logging.getLogger(__name__)
 
+# Only what the ranking needs - loaded for every row of the period
+RANKING_COLUMNS = (
+    StockData.id,
+    StockData.ebit,
+    StockData.market_cap,
+    StockData.earnings_yield,
+    StockData.return_on_capital,
+    StockData.sector,
+)
+
+# Full response fields - loaded for the final top N rows only
+DETAIL_COLUMNS = (
+    StockData.symbol,
+    StockData.company_name,
+    StockData.sector,
+    StockData.year,
+    StockData.month,
+    StockData.ebit,
+    StockData.enterprise_value,
+    StockData.tangible_capital,
+    StockData.earnings_yield,
+    StockData.return_on_capital,
+    StockData.market_cap,
+    StockData.current_price,
+    StockData.data_source,
+    StockData.updated_at,
+)
+
+# Per-symbol history fields
+HISTORY_COLUMNS = (
+    StockData.year,
+    StockData.month,
+    StockData.ebit,
+    StockData.enterprise_value,
+    StockData.tangible_capital,
+    StockData.earnings_yield,
+    StockData.return_on_capital,
+    StockData.market_cap,
+    StockData.current_price,
+    StockData.updated_at,
+)
+
+RANK_FIELDS = ('ey_rank', 'roc_rank', 'magic_formula_score', 'rank')
+
 class DynamicMagicFormulaService:
     """
     Apply Magic Formula ranking dynamically on query
-    - Reads ALL stocks from database for given year/month
-    - Filters by Magic Formula criteria
+    - Filters by Magic Formula criteria in SQL for given year/month
+    - Loads only the ranking columns of the matching stocks
     - Ranks stocks by combined Earnings Yield + Return on Capital
     - Returns top N stocks
     """
     
+    def __init__(self):
+        # (year, month) -> monotonic time we last saw no monthly rows (yearly fallback)
+        self._fallback_periods: Dict[Tuple[int, int], float] = {}
+    
     def get_top_stocks(
         self,
         db: Session,
@@ -46,69 +107,1020 @@ class DynamicMagicFormulaService:
         Returns:
             List of top ranked stocks with all data
         """
+        return self._rank(
+            db, year, month, top_n, min_earnings_yield, min_return_on_capital, min_market_cap
+        )["stocks"]
+    
+    def rank_period(
+        self,
+        db: Session,
+        year: int,
+        month: Optional[int] = None,
+        top_n: int = 10,
+        min_earnings_yield: float = 0.0,
+        min_return_on_capital: float = 0.0,
+        min_market_cap: float = settings.MIN_MARKET_CAP,
+        fallback_to_yearly: bool = False,
+        after_rank: int = 0
+    ) -> Dict:
+        """
+        Top N stocks plus the period's row counts from the same read
+        
+        Args:
+            fallback_to_yearly: when the month has no rows, rank the whole year instead
+                (the "no monthly data" decision is cached per period)
+            after_rank: keyset pagination - return the top_n stocks ranked after this rank
+        
+        Returns:
+            {'year', 'month' (month actually ranked), 'total_in_database',
+             'total_matching' (rows passing the filters), 'stocks',
+             'next_after_rank' (None on the last page)}
+        """
+        filters = (min_earnings_yield, min_return_on_capital, min_market_cap)
+        used_month = month
+        if month is not None and fallback_to_yearly and self._known_fallback(year, month):
+            used_month = None
+        
+        result = self._rank(db, year, used_month, top_n, *filters, after_rank=after_rank)
+        if used_month is not None and fallback_to_yearly and result["total_in_database"] == 0:
+            logger.info(f"No monthly data for {year}-{month:02d}, falling back to yearly data")
+            self._fallback_periods[(year, month)] = time.monotonic()
+            used_month = None
+            result = self._rank(db, year, None, top_n, *filters, after_rank=after_rank)
+        
+        last_rank = after_rank + len(result["stocks"])
+        result["year"] = year
+        result["month"] = used_month
+        result["next_after_rank"] = last_rank if last_rank < result["total_matching"] else None
+        return result
+    
+    def _known_fallback(self, year: int, month: int) -> bool:
+        seen_at = self._fallback_periods.get((year, month))
+        return seen_at is not None and time.monotonic() - seen_at < settings.FALLBACK_CACHE_SECONDS
+    
+    def _rank(
+        self,
+        db: Session,
+        year: int,
+        month: Optional[int],
+        top_n: int,
+        min_earnings_yield: float,
+        min_return_on_capital: float,
+        min_market_cap: float,
+        after_rank: int = 0
+    ) -> Dict:
+        """
+        Dispatch to the configured ranking path
+        
+        Returns:
+            {'stocks', 'total_in_database', 'total_matching'}
+        """
         period_str = f"{year}-{month:02d}" if month else f"{year}"
-        logger.info(f"🎯 Applying Magic Formula dynamically for {period_str}")
+        logger.info(f"🎯 Applying Magic Formula dynamically for {period_str} ({settings.RANKING_BACKEND} backend)")
+        filters = (min_earnings_yield, min_return_on_capital, min_market_cap)
         
-        # Query ALL stocks for this period
-        if month is None:
-            # When month is None, query all records for that year (they should all have month=12 or a value)
-            query = db.query(StockData).filter(
-                StockData.year == year
+        if settings.RANKING_BACKEND == 'sql' and self.is_default_filters(*filters):
+            result = self._top_stocks_precomputed(db, year, month, top_n, after_rank)
+            if not result["total_matching"]:
+                result = self._top_stocks_sql(db, year, month, top_n, *filters, after_rank=after_rank)
+        elif settings.RANKING_BACKEND == 'sql':
+            result = self._top_stocks_sql(db, year, month, top_n, *filters, after_rank=after_rank)
+        elif period_snapshot_cache.enabled and rank_index_registry.enabled and self.is_default_filters(*filters):
+            result = self._top_stocks_indexed(db, year, month, top_n, after_rank)
+        elif period_snapshot_cache.enabled:
+            result = self._top_stocks_snapshot(db, year, month, top_n, *filters, after_rank=after_rank)
+        else:
+            result = self._top_stocks_python(db, year, month, top_n, *filters, after_rank=after_rank)
+        
+        logger.info(f"🏆 Returning top {len(result['stocks'])} stocks for {period_str}")
+        
+        return result
+    
+    def get_top_stocks_batch(
+        self,
+        db: Session,
+        years: Sequence[int],
+        month: Optional[int] = None,
+        top_n: int = 10,
+        min_earnings_yield: float = 0.0,
+        min_return_on_capital: float = 0.0,
+        min_market_cap: float = settings.MIN_MARKET_CAP
+    ) -> List[Dict]:
+        """
+        Top N stocks for several periods at once
+        One query loads the ranking columns of every requested period, each period is
+        ranked in one vectorized pass, one query loads the details of all top rows
+        
+        Returns:
+            [{'year', 'month', 'total_after_filter', 'stocks'}, ...] in request order
+        """
+        counts = self.get_stock_counts(db, years, month)
+        ranked_periods = list(self._iter_ranked_batch(
+            db, years, month, top_n, min_earnings_yield, min_return_on_capital, min_market_cap
+        ))
+        all_ids = [stock_id for _, top_ids, _ in ranked_periods for stock_id in top_ids]
+        details = self._load_details(db, all_ids)
+        
+        return [
+            self._batch_period(year, month, counts.get(year, 0), top_ids, ranked, details)
+            for year, top_ids, ranked in ranked_periods
+        ]
+    
+    def iter_top_stocks_batch(
+        self,
+        db: Session,
+        years: Sequence[int],
+        month: Optional[int] = None,
+        top_n: int = 10,
+        min_earnings_yield: float = 0.0,
+        min_return_on_capital: float = 0.0,
+        min_market_cap: float = settings.MIN_MARKET_CAP
+    ) -> Iterator[Dict]:
+        """Streaming variant of get_top_stocks_batch - yields each period as soon as it is ranked"""
+        counts = self.get_stock_counts(db, years, month)
+        for year, top_ids, ranked in self._iter_ranked_batch(
+            db, years, month, top_n, min_earnings_yield, min_return_on_capital, min_market_cap
+        ):
+            details = self._load_details(db, top_ids)
+            yield self._batch_period(year, month, counts.get(year, 0), top_ids, ranked, details)
+    
+    def iter_ranked_rows(
+        self,
+        db: Session,
+        year: int,
+        month: Optional[int] = None,
+        min_earnings_yield: float = 0.0,
+        min_return_on_capital: float = 0.0,
+        min_market_cap: float = settings.MIN_MARKET_CAP,
+        batch_size: int = settings.EXPORT_BATCH_SIZE
+    ) -> Iterator[Dict]:
+        """
+        Every stock of the period passing the filters, best first (full export)
+        
+        Ranked in the database and read through a server-side cursor, batch_size
+        rows at a time - memory stays flat however large the period is
+        """
+        ranked = self._ranked_query(
+            year, month, min_earnings_yield, min_return_on_capital, min_market_cap
+        ).subquery('ranked')
+        stmt = select(
+            *DETAIL_COLUMNS,
+            ranked.c.ey_rank,
+            ranked.c.roc_rank,
+            ranked.c.magic_formula_score,
+            ranked.c.rank
+        ).join(ranked, StockData.id == ranked.c.id).order_by(ranked.c.rank).execution_options(
+            stream_results=True, yield_per=batch_size
+        )
+        
+        for row in db.execute(stmt):
+            yield dict(row._mapping)
+    
+    def _iter_ranked_batch(
+        self,
+        db: Session,
+        years: Sequence[int],
+        month: Optional[int],
+        top_n: int,
+        min_earnings_yield: float,
+        min_return_on_capital: float,
+        min_market_cap: float
+    ) -> Iterator[Tuple[int, List[int], RankResult]]:
+        """Single grouped read of every period, then one columnar ranking per period"""
+        period_clauses = [StockData.year.in_(list(years))]
+        if month is not None:
+            period_clauses.append(StockData.month == month)
+        stmt = select(StockData.year, *RANKING_COLUMNS).where(
+            *period_clauses,
+            *self._filter_clauses(min_earnings_yield, min_return_on_capital, min_market_cap)
+        ).order_by(StockData.year, StockData.id)
+        rows = db.execute(stmt).all()
+        logger.info(f"📊 Batch: {len(rows)} stocks passed Magic Formula criteria across {len(years)} periods")
+        
+        groups = self._year_groups(rows)
+        for year in years:
+            start, end = groups.get(year, (0, 0))
+            if start == end:
+                yield year, [], rank_columns(RankingColumns.from_sequences([], [], [], [], []), top_n=top_n)
+                continue
+            ids, columns = self._rows_to_columns([row[1:] for row in rows[start:end]])
+            ranked = rank_columns(columns, top_n=top_n)
+            yield year, ids[ranked.positions].tolist(), ranked
+    
+    def _year_groups(self, rows) -> Dict[int, Tuple[int, int]]:
+        """year -> (start, end) slice of rows that arrive ordered by year (year = first column)"""
+        if not rows:
+            return {}
+        row_years = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        starts = np.flatnonzero(np.diff(row_years, prepend=row_years[0] - 1))
+        ends = np.append(starts[1:], len(rows))
+        return {int(row_years[start]): (start, end) for start, end in zip(starts, ends)}
+    
+    def _batch_period(
+        self,
+        year: int,
+        month: Optional[int],
+        stock_count: int,
+        top_ids: List[int],
+        ranked: RankResult,
+        details: Dict[int, Dict]
+    ) -> Dict:
+        stocks = self._materialize([dict(details[stock_id]) for stock_id in top_ids], ranked, by_position=False)
+        return {
+            "year": year,
+            "month": month,
+            "total_in_database": stock_count,
+            "total_after_filter": ranked.total_ranked,
+            "stocks": stocks
+        }
+    
+    def sweep_filters(
+        self,
+        db: Session,
+        year: int,
+        month: Optional[int],
+        combinations: Sequence[Dict],
+        top_n: int = 10
+    ) -> List[Dict]:
+        """
+        Evaluate several filter combinations against one period in one pass
+        
+        The period snapshot is read once and its EY / ROC sort orders computed once;
+        each combination is a mask plus an O(n) re-rank over the shared orders.
+        Threshold masks are memoized, so slider neighbours share most of the work.
+        
+        Args:
+            combinations: dicts with min_earnings_yield / min_return_on_capital / min_market_cap
+                (missing keys use the defaults)
+        
+        Returns:
+            [{'filters', 'total_after_filter', 'stocks'}, ...] in input order
+        """
+        snapshot = self.get_snapshot(db, year, month)
+        columns = snapshot.columns
+        base = (columns.ebit > 0) & ~columns.excluded_sector_mask(settings.EXCLUDED_SECTORS)
+        threshold_masks: Dict[Tuple[str, float], np.ndarray] = {}
+        
+        def threshold_mask(field: str, values: np.ndarray, minimum: float) -> np.ndarray:
+            key = (field, minimum)
+            if key not in threshold_masks:
+                threshold_masks[key] = values >= minimum
+            return threshold_masks[key]
+        
+        results = []
+        for combination in combinations:
+            filters = {
+                "min_earnings_yield": float(combination.get("min_earnings_yield", 0.0)),
+                "min_return_on_capital": float(combination.get("min_return_on_capital", 0.0)),
+                "min_market_cap": float(combination.get("min_market_cap", settings.MIN_MARKET_CAP))
+            }
+            mask = base & threshold_mask('earnings_yield', columns.earnings_yield, filters["min_earnings_yield"])
+            mask &= threshold_mask('return_on_capital', columns.return_on_capital, filters["min_return_on_capital"])
+            mask &= threshold_mask('market_cap', columns.market_cap, filters["min_market_cap"])
+            ranked = rank_presorted(columns, mask, top_n=top_n)
+            records = [snapshot.record(pos) for pos in ranked.positions.tolist()]
+            results.append({
+                "filters": filters,
+                "total_after_filter": ranked.total_ranked,
+                "stocks": self._materialize(records, ranked, by_position=False)
+            })
+        
+        logger.info(f"🎚️ Evaluated {len(results)} filter combinations over {len(snapshot)} stocks")
+        return results
+    
+    def rank_changes(
+        self,
+        db: Session,
+        from_year: int,
+        to_year: int,
+        month: Optional[int] = None,
+        top_n: int = 10,
+        min_earnings_yield: float = 0.0,
+        min_return_on_capital: float = 0.0,
+        min_market_cap: float = settings.MIN_MARKET_CAP
+    ) -> Dict:
+        """
+        How the top N changed between two periods
+        
+        Both periods come from one grouped read and are ranked in full; the rankings
+        are joined through symbol -> (rank, id) maps, so any stock that entered or
+        left the top N also carries its rank on the other side (None = not ranked)
+        
+        Returns:
+            {'ranked_symbols': {from, to}, 'entries', 'exits', 'movements'}
+            movements: stocks in both top N, change > 0 = moved up
+        """
+        stmt = select(StockData.year, StockData.symbol, *RANKING_COLUMNS).where(
+            StockData.year.in_([from_year, to_year]),
+            *([StockData.month == month] if month is not None else []),
+            *self._filter_clauses(min_earnings_yield, min_return_on_capital, min_market_cap)
+        ).order_by(StockData.year, StockData.id)
+        rows = db.execute(stmt).all()
+        groups = self._year_groups(rows)
+        
+        rank_maps: Dict[int, Dict[str, Tuple[int, int]]] = {}
+        for year in (from_year, to_year):
+            start, end = groups.get(year, (0, 0))
+            period = rows[start:end]
+            ranks: Dict[str, Tuple[int, int]] = {}
+            if period:
+                ids, columns = self._rows_to_columns([row[2:] for row in period])
+                ranked = rank_columns(columns)
+                for rank, pos in enumerate(ranked.positions.tolist(), start=1):
+                    # Several rows per symbol (monthly + yearly): the best rank counts
+                    ranks.setdefault(period[pos][1], (rank, int(ids[pos])))
+            rank_maps[year] = ranks
+        
+        before, after = rank_maps[from_year], rank_maps[to_year]
+        top_before = {symbol for symbol, (rank, _) in before.items() if rank <= top_n}
+        top_after = {symbol for symbol, (rank, _) in after.items() if rank <= top_n}
+        
+        def other_rank(ranks: Dict[str, Tuple[int, int]], symbol: str) -> Optional[int]:
+            return ranks[symbol][0] if symbol in ranks else None
+        
+        detail_ids = [after[symbol][1] for symbol in top_after] + [before[symbol][1] for symbol in top_before - top_after]
+        details = self._load_details(db, detail_ids)
+        
+        def entry(symbol: str, stock_id: int, **ranks) -> Dict:
+            stock = details.get(stock_id, {})
+            return {"symbol": symbol, "company_name": stock.get("company_name"), "sector": stock.get("sector"), **ranks}
+        
+        entries = sorted((
+            entry(symbol, after[symbol][1], rank=after[symbol][0], previous_rank=other_rank(before, symbol))
+            for symbol in top_after - top_before
+        ), key=lambda e: e["rank"])
+        exits = sorted((
+            entry(symbol, before[symbol][1], previous_rank=before[symbol][0], rank=other_rank(after, symbol))
+            for symbol in top_before - top_after
+        ), key=lambda e: e["previous_rank"])
+        movements = sorted((
+            entry(symbol, after[symbol][1], rank=after[symbol][0], previous_rank=before[symbol][0],
+                  change=before[symbol][0] - after[symbol][0])
+            for symbol in top_after & top_before
+        ), key=lambda e: e["rank"])
+        
+        logger.info(f"🔀 Rank changes {from_year} -> {to_year}: {len(entries)} entries, {len(exits)} exits")
+        return {
+            "ranked_symbols": {"from": len(before), "to": len(after)},
+            "entries": entries,
+            "exits": exits,
+            "movements": movements
+        }
+    
+    def get_symbol_history(self, db: Session, symbol: str) -> Optional[Dict]:
+        """
+        Metrics and default-profile Magic Formula rank of one symbol in every stored period
+        
+        Rows come from one lookup on uix_symbol_year_month; ranks from stock_rankings
+        joined in the same query. Periods never pre-computed, or written to since
+        their last rebuild, are ranked together in one windowed query - no period is
+        re-ranked or indexed per request
+        
+        Returns:
+            {'symbol', 'company_name', 'sector', 'periods': [...]} (oldest first),
+            None when the symbol is unknown. A period's rank is None when the stock
+            does not pass the default filters
+        """
+        ranked_at, written_at = self._ranking_freshness(StockData.year, StockData.month)
+        stmt = select(
+            StockData.id,
+            *HISTORY_COLUMNS,
+            PrecomputedRanking.ey_rank,
+            PrecomputedRanking.roc_rank,
+            PrecomputedRanking.magic_formula_score,
+            PrecomputedRanking.rank,
+            ranked_at,
+            written_at
+        ).outerjoin(
+            PrecomputedRanking, and_(
+                PrecomputedRanking.stock_data_id == StockData.id,
+                PrecomputedRanking.year == StockData.year,
+                PrecomputedRanking.month.is_not_distinct_from(StockData.month)
             )
+        ).where(
+            StockData.symbol == symbol
+        ).order_by(StockData.year, StockData.month.nulls_first())
+        rows = db.execute(stmt).all()
+        if not rows:
+            return None
+        
+        periods = []
+        stale = {}
+        for row in rows:
+            period = dict(row._mapping)
+            stock_id = period.pop('id')
+            if not self._rankings_current(period.pop('ranked_at'), period.pop('written_at')):
+                stale[(period['year'], period['month'], stock_id)] = period
+            periods.append(period)
+        
+        if stale:
+            ranks = self._window_ranks(db, {key[:2] for key in stale}, [key[2] for key in stale])
+            for key, period in stale.items():
+                period.update(ranks.get(key) or dict.fromkeys(RANK_FIELDS))
+        
+        latest = self._load_details(db, [rows[-1].id])[rows[-1].id]
+        return {
+            "symbol": symbol,
+            "company_name": latest["company_name"],
+            "sector": latest["sector"],
+            "periods": periods
+        }
+    
+    def lookup_symbols(
+        self, db: Session, symbols: Sequence[str], year: int, month: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Metrics and default-profile rank of each symbol in one period, in request order
+        
+        One query resolves every symbol (symbol = ANY(:symbols) on PostgreSQL) joined
+        to stock_rankings; periods never pre-computed, or written to since their last
+        rebuild, read the ranks from the period's rank index in one vectorized lookup. With several rows per symbol
+        (month=None covers monthly rows too) the best ranked one is returned
+        
+        Returns:
+            one dict per requested symbol - {'symbol', 'found': False} when it has no row
+        """
+        wanted = list(dict.fromkeys(symbols))
+        if db.bind.dialect.name == 'postgresql':
+            symbol_clause = StockData.symbol == any_(bindparam('symbols', wanted, type_=ARRAY(String)))
         else:
-            # When month is specified, query for that specific month
-            query = db.query(StockData).filter(
-                and_(
-                    StockData.year == year,
-                    StockData.month == month
-                )
+            symbol_clause = StockData.symbol.in_(wanted)
+        
+        stmt = select(
+            StockData.id,
+            *DETAIL_COLUMNS,
+            PrecomputedRanking.ey_rank,
+            PrecomputedRanking.roc_rank,
+            PrecomputedRanking.magic_formula_score,
+            PrecomputedRanking.rank
+        ).outerjoin(
+            PrecomputedRanking, and_(
+                PrecomputedRanking.stock_data_id == StockData.id,
+                *self._ranking_period_clauses(year, month)
             )
+        ).where(
+            symbol_clause, *self._period_clauses(year, month)
+        )
+        rows = [dict(row._mapping) for row in db.execute(stmt)]
         
-        all_stocks = query.all()
-        logger.info(f"📊 Found {len(all_stocks)} total stocks in database for {period_str}")
+        current = self._rankings_current(*db.execute(
+            select(*self._ranking_freshness(literal(year, Integer), literal(month, Integer)))
+        ).one())
+        if rows and not current:
+            ranks = self.get_rank_index(db, year, month).ranks_of([row['id'] for row in rows])
+            for row in rows:
+                row.update(ranks.get(row['id']) or dict.fromkeys(RANK_FIELDS))
         
-        if not all_stocks:
-            logger.warning(f"❌ No stock data found for {period_str}")
-            return []
+        best: Dict[str, Dict] = {}
+        for row in sorted(rows, key=lambda r: (r['rank'] is None, r['rank'] or 0, -(r['month'] or 0))):
+            best.setdefault(row['symbol'], row)
         
-        # Convert to dictionaries for processing
-        stocks_data = []
-        for stock in all_stocks:
-            stocks_data.append({
-                'symbol': stock.symbol,
-                'company_name': stock.company_name,
-                'sector': stock.sector,
-                'year': stock.year,
-                'month': stock.month,
-                'ebit': stock.ebit,
-                'enterprise_value': stock.enterprise_value,
-                'tangible_capital': stock.tangible_capital,
-                'earnings_yield': stock.earnings_yield,
-                'return_on_capital': stock.return_on_capital,
-                'market_cap': stock.market_cap,
-                'current_price': stock.current_price,
-                'data_source': stock.data_source,
-                'updated_at': stock.updated_at
-            })
+        logger.info(f"🔎 Symbol lookup {year}{f'-{month:02d}' if month else ''}: {len(best)}/{len(wanted)} found")
+        results = []
+        for symbol in symbols:
+            row = best.get(symbol)
+            if row is None:
+                results.append({"symbol": symbol, "found": False})
+            else:
+                stock = {key: value for key, value in row.items() if key != 'id'}
+                results.append({**stock, "found": True})
+        return results
+    
+    def _top_stocks_indexed(
+        self, db: Session, year: int, month: Optional[int], top_n: int, after_rank: int = 0
+    ) -> Dict:
+        """Default filters: slice of the incrementally maintained rank index"""
+        index = self.get_rank_index(db, year, month)
+        ranked = index.top(top_n, after_rank)
+        logger.info(f"📊 {ranked.total_ranked} stocks in rank index")
         
-        # Apply Magic Formula filters
-        filtered_stocks = self._filter_stocks(
-            stocks_data,
+        top_ids = ranked.positions.tolist()
+        details = self._load_details(db, top_ids)
+        return {
+            "stocks": self._materialize(
+                [details[stock_id] for stock_id in top_ids], ranked, by_position=False, start_rank=after_rank + 1
+            ),
+            "total_in_database": index.version[0],
+            "total_matching": ranked.total_ranked
+        }
+    
+    def _top_stocks_snapshot(
+        self,
+        db: Session,
+        year: int,
+        month: Optional[int],
+        top_n: int,
+        min_earnings_yield: float,
+        min_return_on_capital: float,
+        min_market_cap: float,
+        after_rank: int = 0
+    ) -> Dict:
+        """
+        Filter + rank the cached period snapshot entirely in memory
+        Filters resolve through the snapshot's sorted threshold index (binary search),
+        so selective thresholds only touch the rows that can match
+        """
+        snapshot = self.get_snapshot(db, year, month)
+        if not len(snapshot):
+            logger.warning("❌ No stock data found")
+            return {"stocks": [], "total_in_database": 0, "total_matching": 0}
+        
+        candidates = snapshot.columns.threshold_index().candidates(
             min_earnings_yield=min_earnings_yield,
             min_return_on_capital=min_return_on_capital,
-            min_market_cap=min_market_cap
+            min_market_cap=min_market_cap,
+            excluded_sectors=settings.EXCLUDED_SECTORS
         )
+        ranked = rank_candidates(snapshot.columns, candidates, top_n=after_rank + top_n).after(after_rank)
+        logger.info(f"📊 {ranked.total_ranked}/{len(snapshot)} stocks passed Magic Formula criteria (snapshot)")
         
-        logger.info(f"✅ {len(filtered_stocks)} stocks passed Magic Formula criteria")
+        records = [snapshot.record(pos) for pos in ranked.positions.tolist()]
+        return {
+            "stocks": self._materialize(records, ranked, by_position=False, start_rank=after_rank + 1),
+            "total_in_database": len(snapshot),
+            "total_matching": ranked.total_ranked
+        }
+    
+    def _top_stocks_python(
+        self,
+        db: Session,
+        year: int,
+        month: Optional[int],
+        top_n: int,
+        min_earnings_yield: float,
+        min_return_on_capital: float,
+        min_market_cap: float,
+        after_rank: int = 0
+    ) -> Dict:
+        """Load filtered ranking columns, rank in-process with the columnar engine"""
+        # Load ONLY the ranking columns, with the Magic Formula filters pushed into SQL
+        # ORDER BY id keeps tie-breaking deterministic (ties rank in insertion order)
+        # The period's total row count rides along as a scalar subquery (same round trip)
+        stmt = select(*RANKING_COLUMNS, self._period_count(year, month)).where(
+            *self._period_clauses(year, month),
+            *self._filter_clauses(min_earnings_yield, min_return_on_capital, min_market_cap)
+        ).order_by(StockData.id)
+        rows = db.execute(stmt).all()
+        logger.info(f"📊 {len(rows)} stocks passed Magic Formula criteria in database")
         
-        # Rank stocks
-        ranked_stocks = self._rank_stocks(filtered_stocks)
+        if not rows:
+            logger.warning("❌ No stock data matching the criteria")
+            return {"stocks": [], "total_in_database": self.get_stock_count(db, year, month), "total_matching": 0}
         
-        # Return top N
-        top_stocks = ranked_stocks[:top_n]
+        total_in_database = rows[0][-1]
+        ids, columns = self._rows_to_columns([row[:-1] for row in rows])
         
-        logger.info(f"🏆 Returning top {len(top_stocks)} stocks for {period_str}")
+        # Filters already applied in SQL - rank every loaded row
+        ranked = rank_columns(columns, top_n=after_rank + top_n).after(after_rank)
         
+        # Full company details only for the final top N rows
+        top_ids = ids[ranked.positions].tolist()
+        details = self._load_details(db, top_ids)
+        return {
+            "stocks": self._materialize(
+                [details[stock_id] for stock_id in top_ids], ranked, by_position=False, start_rank=after_rank + 1
+            ),
+            "total_in_database": total_in_database,
+            "total_matching": ranked.total_ranked
+        }
+    
+    def _top_stocks_sql(
+        self,
+        db: Session,
+        year: int,
+        month: Optional[int],
+        top_n: int,
+        min_earnings_yield: float,
+        min_return_on_capital: float,
+        min_market_cap: float,
+        after_rank: int = 0
+    ) -> Dict:
+        """
+        Rank inside the database with window functions - only top_n rows cross the wire
+        
+        ROW_NUMBER() ordered by (metric DESC, id) instead of RANK(): ordinal ranks with
+        ties in id order, exactly like the in-process ranker
+        """
+        all_ranked = self._ranked_query(
+            year, month, min_earnings_yield, min_return_on_capital, min_market_cap
+        ).subquery('all_ranked')
+        ranked = select(all_ranked).where(
+            all_ranked.c.rank > after_rank
+        ).order_by(all_ranked.c.rank).limit(top_n).subquery('ranked')
+        
+        stmt = select(
+            *DETAIL_COLUMNS,
+            ranked.c.ey_rank,
+            ranked.c.roc_rank,
+            ranked.c.magic_formula_score,
+            ranked.c.rank,
+            ranked.c.total_matching,
+            self._period_count(year, month)
+        ).join(ranked, StockData.id == ranked.c.id).order_by(ranked.c.rank)
+        
+        return self._split_counts(db, year, month, stmt)
+    
+    def _top_stocks_precomputed(
+        self, db: Session, year: int, month: Optional[int], top_n: int, after_rank: int = 0
+    ) -> Dict:
+        """
+        Default filters: indexed read of stock_rankings (WHERE rank > after ORDER BY rank LIMIT n)
+        total_matching is 0 when the period has not been pre-computed yet
+        """
+        total_matching = select(func.count(PrecomputedRanking.id)).where(
+            *self._ranking_period_clauses(year, month)
+        ).correlate(None).scalar_subquery()
+        stmt = select(
+            *DETAIL_COLUMNS,
+            PrecomputedRanking.ey_rank,
+            PrecomputedRanking.roc_rank,
+            PrecomputedRanking.magic_formula_score,
+            PrecomputedRanking.rank,
+            total_matching.label('total_matching'),
+            self._period_count(year, month)
+        ).join(
+            StockData, StockData.id == PrecomputedRanking.stock_data_id
+        ).where(
+            *self._ranking_period_clauses(year, month),
+            PrecomputedRanking.rank > after_rank
+        ).order_by(PrecomputedRanking.rank).limit(top_n)
+        
+        return self._split_counts(db, year, month, stmt)
+    
+    def _period_count(self, year: int, month: Optional[int]):
+        """Uncorrelated scalar subquery: total rows of the period (labelled total_in_database)"""
+        return select(func.count(StockData.id)).where(
+            *self._period_clauses(year, month)
+        ).correlate(None).scalar_subquery().label('total_in_database')
+    
+    def _split_counts(self, db: Session, year: int, month: Optional[int], stmt: Select) -> Dict:
+        """Run a ranked statement carrying total_matching / total_in_database columns"""
+        stocks = [dict(row._mapping) for row in db.execute(stmt)]
+        if not stocks:
+            return {"stocks": [], "total_in_database": self.get_stock_count(db, year, month), "total_matching": 0}
+        counts = {key: stocks[0][key] for key in ("total_in_database", "total_matching")}
+        for stock in stocks:
+            del stock["total_in_database"]
+            del stock["total_matching"]
+        return {"stocks": stocks, **counts}
+    
+    def rebuild_rankings(self, db: Session, year: int, month: Optional[int] = None) -> int:
+        """
+        Recompute stock_rankings for one period set-wise, in one transaction:
+        DELETE the period, INSERT ... SELECT from the window-function ranking
+        """
+        ranked = self._ranked_query(
+            year, month, 0.0, 0.0, settings.MIN_MARKET_CAP
+        ).subquery('ranked')
+        
+        db.execute(delete(PrecomputedRanking).where(*self._ranking_period_clauses(year, month)))
+        result = db.execute(insert(PrecomputedRanking).from_select(
+            ['stock_data_id', 'symbol', 'year', 'month', 'ey_rank', 'roc_rank',
+             'magic_formula_score', 'rank', 'computed_at'],
+            select(
+                ranked.c.id,
+                StockData.symbol,
+                literal(year, Integer),
+                literal(month, Integer),
+                ranked.c.ey_rank,
+                ranked.c.roc_rank,
+                ranked.c.magic_formula_score,
+                ranked.c.rank,
+                literal(datetime.utcnow(), DateTime)
+            ).join(StockData, StockData.id == ranked.c.id)
+        ))
+        db.commit()
+        
+        # Results cached from the previous rankings must not outlive them
+        cache_service.bump_period_generation(year, month)
+        
+        period_str = f"{year}-{month:02d}" if month else f"{year}"
+        logger.info(f"🏁 Pre-computed {result.rowcount} rankings for {period_str}")
+        return result.rowcount
+    
+    def rebuild_rankings_for_writes(self, db: Session, periods) -> None:
+        """
+        Rebuild every ranking affected by writes to the given (year, month) periods
+        Writes to a month also change the whole-year ranking
+        """
+        affected = set()
+        for year, month in periods:
+            affected.add((year, month))
+            affected.add((year, None))
+        for year, month in sorted(affected, key=lambda key: (key[0], key[1] or 0)):
+            try:
+                self.rebuild_rankings(db, year, month)
+            except Exception as e:
+                logger.error(f"Error rebuilding rankings for {year}/{month}: {e}")
+                db.rollback()
+    
+    def _ranking_period_clauses(self, year: int, month: Optional[int]) -> list:
+        if month is None:
+            return [PrecomputedRanking.year == year, PrecomputedRanking.month.is_(None)]
+        return [PrecomputedRanking.year == year, PrecomputedRanking.month == month]
+    
+    def _ranking_freshness(self, year, month) -> Tuple:
+        """
+        Scalar subqueries (ranked_at, written_at) for the period at the given year /
+        month expressions: when stock_rankings was last rebuilt (NULL = never) and the
+        latest write to its rows per period_summary (month NULL = every month of the year)
+        """
+        # Aliased: the outer query may join stock_rankings for the row's own ranks
+        period_ranking = aliased(PrecomputedRanking)
+        ranked_at = select(period_ranking.computed_at).where(
+            period_ranking.year == year,
+            period_ranking.month.is_not_distinct_from(month)
+        ).limit(1).scalar_subquery().label('ranked_at')
+        written_at = select(func.max(PeriodSummary.last_updated)).where(
+            PeriodSummary.year == year,
+            or_(month.is_(None), PeriodSummary.month == month)
+        ).scalar_subquery().label('written_at')
+        return ranked_at, written_at
+    
+    def _rankings_current(self, ranked_at: Optional[datetime], written_at: Optional[datetime]) -> bool:
+        """stock_rankings exist for the period and no row was written after the rebuild"""
+        return ranked_at is not None and (written_at is None or ranked_at >= written_at)
+    
+    def _window_ranks(self, db: Session, periods, stock_ids: Sequence[int]) -> Dict[Tuple, Dict]:
+        """
+        Default-profile ranks of stock_ids in several periods from one windowed query
+        Whole-year and monthly periods rank over different scopes, so each kind is its
+        own partitioned SELECT and the two are UNION ALLed
+        
+        Returns:
+            {(year, month, stock_id): {ey_rank, roc_rank, magic_formula_score, rank}}
+            - stocks not passing the default filters are absent
+        """
+        years = sorted({year for year, month in periods if month is None})
+        months = sorted({(year, month) for year, month in periods if month is not None})
+        scopes = []
+        if years:
+            scopes.append((StockData.year.in_(years), cast(null(), Integer), (StockData.year,)))
+        if months:
+            scopes.append((tuple_(StockData.year, StockData.month).in_(months), StockData.month,
+                           (StockData.year, StockData.month)))
+        
+        parts = []
+        for scope, month, partition in scopes:
+            scored = select(
+                StockData.id,
+                StockData.year,
+                month.label('month'),
+                func.row_number().over(
+                    partition_by=partition, order_by=(StockData.earnings_yield.desc(), StockData.id)
+                ).label('ey_rank'),
+                func.row_number().over(
+                    partition_by=partition, order_by=(StockData.return_on_capital.desc(), StockData.id)
+                ).label('roc_rank')
+            ).where(
+                scope, *self._filter_clauses(0.0, 0.0, settings.MIN_MARKET_CAP)
+            ).subquery()
+            score = scored.c.ey_rank + scored.c.roc_rank
+            parts.append(select(
+                scored.c.id,
+                scored.c.year,
+                scored.c.month,
+                scored.c.ey_rank,
+                scored.c.roc_rank,
+                score.label('magic_formula_score'),
+                func.row_number().over(
+                    partition_by=(scored.c.year, scored.c.month), order_by=(score, scored.c.id)
+                ).label('rank')
+            ))
+        
+        ranked = union_all(*parts).subquery('ranked')
+        rows = db.execute(select(ranked).where(ranked.c.id.in_(list(stock_ids)))).all()
+        return {
+            (row.year, row.month, row.id): {field: getattr(row, field) for field in RANK_FIELDS}
+            for row in rows
+        }
+    
+    def _ranked_query(
+        self,
+        year: int,
+        month: Optional[int],
+        min_earnings_yield: float,
+        min_return_on_capital: float,
+        min_market_cap: float
+    ) -> Select:
+        """
+        Single statement computing ey_rank, roc_rank, magic_formula_score and rank
+        (plus total_matching, the filtered row count) for every stock of the period
+        passing the filters, ordered by rank
+        """
+        scored = select(
+            StockData.id,
+            func.row_number().over(
+                order_by=(StockData.earnings_yield.desc(), StockData.id)
+            ).label('ey_rank'),
+            func.row_number().over(
+                order_by=(StockData.return_on_capital.desc(), StockData.id)
+            ).label('roc_rank')
+        ).where(
+            *self._period_clauses(year, month),
+            *self._filter_clauses(min_earnings_yield, min_return_on_capital, min_market_cap)
+        ).subquery('scored')
+        
+        score = scored.c.ey_rank + scored.c.roc_rank
+        return select(
+            scored.c.id,
+            scored.c.ey_rank,
+            scored.c.roc_rank,
+            score.label('magic_formula_score'),
+            func.row_number().over(order_by=(score, scored.c.id)).label('rank'),
+            func.count().over().label('total_matching')
+        ).order_by(score, scored.c.id)
+    
+    def get_rank_index(self, db: Session, year: int, month: Optional[int] = None) -> PeriodRankIndex:
+        """
+        Rank index of one period under the default filters
+        Rebuilt from the snapshot only when the database version moved without us
+        (writes from another process) - our own fetcher writes are applied in place
+        """
+        key = (year, month)
+        index = rank_index_registry.get(key)
+        if index is not None:
+            if rank_index_registry.is_fresh(key):
+                return index
+            if index.version == self._period_version(db, year, month):
+                rank_index_registry.mark_validated(key)
+                return index
+        
+        snapshot = self.get_snapshot(db, year, month)
+        eligible = filter_mask(
+            snapshot.columns,
+            min_earnings_yield=0.0,
+            min_return_on_capital=0.0,
+            min_market_cap=settings.MIN_MARKET_CAP,
+            excluded_sectors=settings.EXCLUDED_SECTORS
+        )
+        index = PeriodRankIndex.build(
+            snapshot.version, snapshot.ids,
+            snapshot.columns.earnings_yield, snapshot.columns.return_on_capital, eligible
+        )
+        rank_index_registry.put(key, index)
+        logger.info(f"📇 Built rank index {key}: {len(index)} ranked stocks")
+        return index
+    
+    def is_default_filters(self, min_earnings_yield: float, min_return_on_capital: float, min_market_cap: float) -> bool:
+        """True for the default screener profile (no custom thresholds)"""
+        return (
+            min_earnings_yield == 0.0
+            and min_return_on_capital == 0.0
+            and min_market_cap == settings.MIN_MARKET_CAP
+        )
+    
+    def _is_eligible(self, stock: StockData) -> bool:
+        """Default Magic Formula criteria for a single row (same rules as _filter_stocks)"""
+        return (
+            stock.ebit > 0
+            and stock.market_cap >= settings.MIN_MARKET_CAP
+            and stock.earnings_yield >= 0.0
+            and stock.return_on_capital >= 0.0
+            and stock.sector not in settings.EXCLUDED_SECTORS
+        )
+    
+    def get_snapshot(self, db: Session, year: int, month: Optional[int] = None) -> PeriodSnapshot:
+        """Cached columnar snapshot of one period, revalidated against the database"""
+        return period_snapshot_cache.get(
+            (year, month),
+            current_version=lambda: self._period_version(db, year, month),
+            load=lambda version: self._load_snapshot(db, year, month, version)
+        )
+    
+    def _period_version(self, db: Session, year: int, month: Optional[int]) -> Tuple:
+        """Data version of a period: (row count, max updated_at) - one tiny aggregate query"""
+        count, last_updated = db.execute(
+            select(func.count(StockData.id), func.max(StockData.updated_at)).where(
+                *self._period_clauses(year, month)
+            )
+        ).one()
+        return (count, last_updated)
+    
+    def _load_snapshot(self, db: Session, year: int, month: Optional[int], version: Tuple) -> PeriodSnapshot:
+        """Read every row of the period once, in id order"""
+        rows = db.execute(
+            select(StockData.id, *DETAIL_COLUMNS).where(
+                *self._period_clauses(year, month)
+            ).order_by(StockData.id)
+        ).all()
+        fields = tuple(column.key for column in DETAIL_COLUMNS)
+        records = [tuple(row[1:]) for row in rows]
+        by_field = dict(zip(fields, zip(*records))) if records else {field: () for field in fields}
+        columns = RankingColumns.from_sequences(
+            by_field['ebit'], by_field['market_cap'], by_field['earnings_yield'],
+            by_field['return_on_capital'], by_field['sector']
+        )
+        return PeriodSnapshot(
+            year=year,
+            month=month,
+            version=version,
+            ids=np.asarray([row[0] for row in rows], dtype=np.int64),
+            columns=columns,
+            fields=fields,
+            rows=records
+        )
+    
+    def preload_snapshots(self, db: Session, periods: int = settings.SNAPSHOT_PRELOAD_PERIODS):
+        """Warm the snapshot cache with the latest periods (called at startup)"""
+        if not period_snapshot_cache.enabled or periods <= 0:
+            return
+        latest = db.execute(
+            select(StockData.year, StockData.month).distinct().order_by(
+                StockData.year.desc(), StockData.month.desc()
+            ).limit(periods)
+        ).all()
+        keys = []
+        for year, month in latest:
+            for key in ((year, None), (year, month)):
+                if key not in keys:
+                    keys.append(key)
+        for year, month in keys[:periods]:
+            self.get_snapshot(db, year, month)
+        logger.info(f"📦 Preloaded {min(len(keys), periods)} period snapshots")
+    
+    def notify_period_updated(self, year: int, month: Optional[int] = None, stock: Optional[StockData] = None):
+        """
+        Called by the fetchers after committing rows for (year, month)
+        Drops every in-process cache derived from that period and bumps the
+        Redis data generation so cached ranked results become unreachable
+        
+        stock: the single committed row, applied in place to the rank index
+        (None = bulk write, the rank index is rebuilt on the next read)
+        """
+        period_snapshot_cache.invalidate(year, month)
+        cache_service.bump_period_generation(year, month)
+        if month is not None:
+            self._fallback_periods.pop((year, month), None)
+        if stock is not None:
+            rank_index_registry.apply_upsert(
+                year, month, stock.id, stock.earnings_yield, stock.return_on_capital,
+                self._is_eligible(stock), stock.updated_at
+            )
+        else:
+            rank_index_registry.invalidate(year, month)
+    
+    def _period_clauses(self, year: int, month: Optional[int]) -> list:
+        """WHERE clauses selecting one period (month=None = every record of the year)"""
+        if month is None:
+            return [StockData.year == year]
+        return [StockData.year == year, StockData.month == month]
+    
+    def _filter_clauses(
+        self,
+        min_earnings_yield: float,
+        min_return_on_capital: float,
+        min_market_cap: float
+    ) -> list:
+        """
+        Magic Formula criteria as SQL WHERE clauses (same rules as _filter_stocks)
+        NULL sector is kept, like the dict path - plain NOT IN would drop it
+        """
+        return [
+            StockData.ebit > 0,
+            StockData.market_cap >= min_market_cap,
+            StockData.earnings_yield >= min_earnings_yield,
+            StockData.return_on_capital >= min_return_on_capital,
+            or_(StockData.sector.is_(None), StockData.sector.notin_(settings.EXCLUDED_SECTORS))
+        ]
+    
+    def _rows_to_columns(self, rows) -> Tuple[np.ndarray, RankingColumns]:
+        """Split (id, ebit, market_cap, earnings_yield, return_on_capital, sector) tuples into columns"""
+        ids, ebit, market_cap, earnings_yield, return_on_capital, sectors = zip(*rows)
+        columns = RankingColumns.from_sequences(ebit, market_cap, earnings_yield, return_on_capital, sectors)
+        return np.asarray(ids, dtype=np.int64), columns
+    
+    def _load_details(self, db: Session, stock_ids: List[int]) -> Dict[int, Dict]:
+        """Fetch the full response fields for the given stock_data ids"""
+        if not stock_ids:
+            return {}
+        rows = db.execute(
+            select(StockData.id, *DETAIL_COLUMNS).where(StockData.id.in_(stock_ids))
+        ).all()
+        details = {}
+        for row in rows:
+            stock = dict(row._mapping)
+            details[stock.pop('id')] = stock
+        return details
+    
+    def _materialize(
+        self, stocks: List[Dict], ranked: RankResult, by_position: bool = True, start_rank: int = 1
+    ) -> List[Dict]:
+        """
+        Attach rank fields to the ranked stock dicts, best first
+        
+        by_position=True: stocks is the whole period, indexed by ranked.positions
+        by_position=False: stocks is already in ranked order
+        start_rank: rank of the first stock (keyset pages start after 1)
+        """
+        top_stocks = []
+        for i, (pos, ey_rank, roc_rank, score, rank) in enumerate(ranked.iter_ranked(start_rank)):
+            stock = stocks[pos] if by_position else stocks[i]
+            stock['ey_rank'] = ey_rank
+            stock['roc_rank'] = roc_rank
+            stock['magic_formula_score'] = score
+            stock['rank'] = rank
+            top_stocks.append(stock)
         return top_stocks
     
     def _filter_stocks(
@@ -120,6 +1132,7 @@ class DynamicMagicFormulaService:
     ) -> List[Dict]:
         """
         Filter stocks by Magic Formula criteria
+        Reference dict implementation - get_top_stocks pushes these into SQL (_filter_clauses)
         
         Criteria:
         1. EBIT > 0 (profitable)
@@ -130,8 +1143,6 @@ class DynamicMagicFormulaService:
         """
         filtered = []
         
-        excluded_sectors = ['Financial Services', 'Financial', 'Utilities']
-        
         for stock in stocks:
             # Check EBIT
             if stock['ebit'] <= 0:
@@ -150,7 +1161,7 @@ class DynamicMagicFormulaService:
                 continue
             
             # Check sector
-            if stock.get('sector') in excluded_sectors:
+            if stock.get('sector') in settings.EXCLUDED_SECTORS:
                 continue
             
             filtered.append(stock)
@@ -160,6 +1171,7 @@ class DynamicMagicFormulaService:
     def _rank_stocks(self, stocks: List[Dict]) -> List[Dict]:
         """
         Rank stocks using Magic Formula method
+        Reference dict implementation - get_top_stocks uses ranking_engine.rank_columns
         
         Method:
         1. Rank by Earnings Yield (lower rank = better)
@@ -213,6 +1225,16 @@ class DynamicMagicFormulaService:
         
         return count
     
+    def get_stock_counts(self, db: Session, years: Sequence[int], month: Optional[int] = None) -> Dict[int, int]:
+        """Row counts of several periods in one grouped query ({year: count}, missing = 0)"""
+        clauses = [StockData.year.in_(list(years))]
+        if month is not None:
+            clauses.append(StockData.month == month)
+        rows = db.execute(
+            select(StockData.year, func.count(StockData.id)).where(*clauses).group_by(StockData.year)
+        ).all()
+        return {year: count for year, count in rows}
+    
     def get_available_periods(self, db: Session) -> List[Dict]:
         """
         Get list of available year/month combinations in database
@@ -0,0 +1,224 @@
+"""
+On-Disk HTTP Record / Replay Cache for provider calls
+Re-running ingestion (failed runs, formula changes, schema fixes) is served
+from disk instead of spending API quota again
+
+- key: sha256 of the normalized URL (lowercased scheme / host, sorted query,
+  apiKey stripped), so the same request is the same file whatever key was used
+- file: <HTTP_CACHE_DIR>/<2 hex>/<sha256>.gz - one JSON metadata line, then the raw body
+- TTL: longest matching prefix of host + path in HTTP_CACHE_TTLS, else HTTP_CACHE_DEFAULT_TTL
+- modes (HTTP_CACHE_MODE): off (default) | record (read-through, store 200s) |
+  replay (serve whatever was recorded, never touch the network; misses are 504)
+- gzip reads and writes run in a worker thread, off the event loop
+
+Only successful GETs are stored; provider throttling notices that arrive
+as HTTP 200 (Alpha Vantage "Note" / "Information") are not.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+STRIPPED_PARAMS = {'apikey'}
+THROTTLE_KEYS = {'Note', 'Information', 'Error Message'}
+THROTTLE_BODY_MAX_BYTES = 2048
+MODES = ('off', 'record', 'replay')
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a request URL, without credentials"""
+    parts = urlsplit(url)
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in STRIPPED_PARAMS
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', urlencode(query), ''))
+
+
+class CachedResponse:
+    """The subset of aiohttp.ClientResponse the fetchers use"""
+
+    def __init__(self, url: str, status: int, body: bytes, content_type: str = 'application/json', from_cache: bool = False):
+        self.url = url
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = {'Content-Type': content_type}
+        self.from_cache = from_cache
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self, encoding: Optional[str] = None) -> str:
+        return self.body.decode(encoding or 'utf-8', errors='replace')
+
+    async def json(self, **kwargs):
+        return json.loads(self.body)
+
+
+class _CachedRequest:
+    """Async context manager returned by CachedSession.get - mirrors `async with session.get(url)`"""
+
+    def __init__(self, cache: 'HttpCache', session, url: str, kwargs: Dict):
+        self.cache = cache
+        self.session = session
+        self.url = url
+        self.kwargs = kwargs
+
+    async def __aenter__(self) -> CachedResponse:
+        return await self.cache.get(self.session, self.url, **self.kwargs)
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class CachedSession:
+    """aiohttp.ClientSession wrapper whose GETs go through the HTTP cache"""
+
+    def __init__(self, session, cache: 'HttpCache'):
+        self._session = session
+        self._cache = cache
+
+    def get(self, url: str, **kwargs) -> _CachedRequest:
+        return _CachedRequest(self._cache, self._session, url, kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class HttpCache:
+    """Content-addressed gzip files keyed by normalized URL"""
+
+    def __init__(
+        self,
+        root: str = settings.HTTP_CACHE_DIR,
+        mode: str = settings.HTTP_CACHE_MODE,
+        ttls: Optional[Dict[str, int]] = None,
+        default_ttl: int = settings.HTTP_CACHE_DEFAULT_TTL
+    ):
+        if mode not in MODES:
+            raise ValueError(f"HTTP_CACHE_MODE must be one of {MODES}, got {mode!r}")
+        self.root = root
+        self.mode = mode
+        # Longest prefix first so /v3/reference/tickers/X beats /v3/reference
+        ttls = settings.HTTP_CACHE_TTLS if ttls is None else ttls
+        self.ttls = sorted(ttls.items(), key=lambda item: len(item[0]), reverse=True)
+        self.default_ttl = default_ttl
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'replay_misses': 0}
+
+    def wrap(self, session):
+        """The session itself when the cache is off, else a caching wrapper"""
+        return session if self.mode == 'off' else CachedSession(session, self)
+
+    def ttl(self, url: str) -> int:
+        parts = urlsplit(normalize_url(url))
+        target = parts.netloc + parts.path
+        for prefix, seconds in self.ttls:
+            if target.startswith(prefix):
+                return seconds
+        return self.default_ttl
+
+    def path(self, url: str) -> str:
+        digest = hashlib.sha256(normalize_url(url).encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], f"{digest}.gz")
+
+    def is_fresh(self, url: str) -> bool:
+        """A recorded response that would be served without a network call"""
+        if self.mode == 'off':
+            return False
+        try:
+            age = time.time() - os.path.getmtime(self.path(url))
+        except OSError:
+            return False
+        return self.mode == 'replay' or age < self.ttl(url)
+
+    def network_calls(self, urls: Iterable[str]) -> int:
+        """How many of these GETs would reach the provider (for rate-limit budgeting)"""
+        if self.mode == 'replay':
+            return 0
+        return sum(1 for url in urls if not self.is_fresh(url))
+
+    async def get(self, session, url: str, **kwargs) -> CachedResponse:
+        if self.mode == 'off':
+            return await self._fetch(session, url, **kwargs)
+
+        if self.is_fresh(url):
+            cached = await asyncio.to_thread(self._load, url)
+            if cached is not None:
+                self.stats['hits'] += 1
+                return cached
+
+        if self.mode == 'replay':
+            self.stats['replay_misses'] += 1
+            logger.warning(f"📼 Replay miss (no recording): {normalize_url(url)}")
+            return CachedResponse(url, 504, b'{"error": "not recorded"}')
+
+        self.stats['misses'] += 1
+        response = await self._fetch(session, url, **kwargs)
+        if self._cacheable(response) and await asyncio.to_thread(self._store, url, response):
+            self.stats['stored'] += 1
+        return response
+
+    async def _fetch(self, session, url: str, **kwargs) -> CachedResponse:
+        async with session.get(url, **kwargs) as response:
+            body = await response.read()
+            return CachedResponse(url, response.status, body, response.headers.get('Content-Type', 'application/json'))
+
+    def _cacheable(self, response: CachedResponse) -> bool:
+        if response.status != 200:
+            return False
+        if len(response.body) <= THROTTLE_BODY_MAX_BYTES:
+            try:
+                data = json.loads(response.body)
+            except ValueError:
+                return True
+            if isinstance(data, dict) and THROTTLE_KEYS.intersection(data):
+                return False
+        return True
+
+    def _load(self, url: str) -> Optional[CachedResponse]:
+        try:
+            with gzip.open(self.path(url), 'rb') as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+        except (OSError, ValueError) as e:
+            logger.error(f"HTTP cache read error: {e}")
+            return None
+        return CachedResponse(url, meta['status'], body, meta.get('content_type', 'application/json'), from_cache=True)
+
+    def _store(self, url: str, response: CachedResponse) -> bool:
+        path = self.path(url)
+        meta = {
+            'url': normalize_url(url),
+            'status': response.status,
+            'content_type': response.content_type,
+            'recorded_at': time.time()
+        }
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Per-thread temp file: concurrent stores of one URL each replace the target atomically
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(json.dumps(meta).encode() + b'\n')
+                f.write(response.body)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logger.error(f"HTTP cache write error: {e}")
+            return False
+
+    def get_stats(self) -> Dict:
+        return {"mode": self.mode, "dir": self.root, **self.stats}
+
+
+# Global instance
+http_cache = HttpCache()
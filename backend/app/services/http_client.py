@@ -0,0 +1,139 @@
+"""
+Process-wide pooled aiohttp client for the ingestion loop
+One long-lived ClientSession instead of one per fetch: connections are kept
+alive and reused, DNS answers cached, and every provider call is bounded by
+explicit timeouts. Started at application startup, closed on shutdown.
+
+get_session() hands out the session wrapped by the on-disk HTTP cache; if
+it was never started (CLI scripts) or belongs to a finished event loop, a
+fresh one is created for the running loop and the old one is closed.
+"""
+import asyncio
+import logging
+import socket
+from typing import Dict, Optional
+import aiohttp
+from app.core.config import settings
+from app.services.http_cache import http_cache
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """Managed aiohttp.ClientSession with pool statistics"""
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.in_flight = 0  # requests sent and still waiting for their response
+        self.stats = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0,
+            'sessions_created': 0,
+        }
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        def counter(name):
+            async def count(session, context, params):
+                self.stats[name] += 1
+            return count
+
+        async def started(session, context, params):
+            self.stats['requests'] += 1
+            self.in_flight += 1
+
+        async def finished(session, context, params):
+            self.in_flight -= 1
+
+        trace.on_request_start.append(started)
+        trace.on_request_end.append(finished)
+        trace.on_request_exception.append(finished)
+        trace.on_connection_create_end.append(counter('connections_created'))
+        trace.on_connection_reuseconn.append(counter('connections_reused'))
+        trace.on_dns_cache_hit.append(counter('dns_cache_hits'))
+        trace.on_dns_cache_miss.append(counter('dns_cache_misses'))
+        return trace
+
+    async def start(self) -> aiohttp.ClientSession:
+        """Create the pooled session for the running event loop (no-op if it already exists)"""
+        loop = asyncio.get_running_loop()
+        if self._session is not None and not self._session.closed and self._loop is loop:
+            return self._session
+
+        # A session bound to another (finished) loop cannot be reused - close it and replace it
+        if self._session is not None and not self._session.closed:
+            await self._close_stale(self._session, self._loop)
+        
+        connector = aiohttp.TCPConnector(
+            limit=settings.HTTP_POOL_LIMIT,
+            limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=settings.HTTP_TIMEOUT_TOTAL,
+            connect=settings.HTTP_TIMEOUT_CONNECT,
+            sock_read=settings.HTTP_TIMEOUT_READ
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[self._trace_config()])
+        self._loop = loop
+        self.stats['sessions_created'] += 1
+        logger.info(f"🌐 HTTP client started: {settings.HTTP_POOL_LIMIT} connections "
+                    f"({settings.HTTP_POOL_LIMIT_PER_HOST}/host), DNS cache {settings.HTTP_DNS_CACHE_TTL}s")
+        return self._session
+
+    async def _close_stale(self, session: aiohttp.ClientSession, loop: Optional[asyncio.AbstractEventLoop]):
+        """
+        Close a session left behind by another event loop
+        aiohttp skips the transports of a closed loop (their close callbacks could never
+        run), so the pooled sockets are shut down here first - the servers see the
+        connections end now instead of whenever the objects are collected
+        """
+        if loop is not None and loop.is_running():
+            # Still serving in another thread: close it there
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+            return
+        if loop is not None and loop.is_closed():
+            for connections in session.connector._conns.values():
+                for protocol, _ in connections:
+                    sock = protocol.transport.get_extra_info('socket') if protocol.transport else None
+                    if sock is not None:
+                        try:
+                            sock.shutdown(socket.SHUT_RDWR)
+                        except OSError:
+                            pass
+        await session.close()
+        logger.info("🌐 HTTP client: closed the session of a previous event loop")
+
+    async def get_session(self):
+        """The shared session behind the HTTP record / replay cache"""
+        return http_cache.wrap(await self.start())
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.info("🌐 HTTP client closed")
+        self._session = None
+        self._loop = None
+
+    def get_stats(self) -> Dict:
+        pool = {}
+        session = self._session
+        if session is not None and not session.closed:
+            connector = session.connector
+            pool = {
+                "limit": connector.limit,
+                "limit_per_host": connector.limit_per_host,
+                # Counted by our own trace hooks - the connector exposes no public pool occupancy
+                "in_flight": self.in_flight
+            }
+        return {"status": "open" if pool else "closed", "pool": pool, **self.stats}
+
+
+# Global instance
+http_client = HttpClient()
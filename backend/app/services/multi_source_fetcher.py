@@ -3,14 +3,23 @@ import yfinance as yf
 import pandas as pd
 import aiohttp
 import asyncio
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 import logging
 import os
 from datetime import datetime
 from app.core.config import settings
+from app.services.http_cache import http_cache
+from app.services.rate_limiter import BudgetExhausted, rate_limiter
+from app.services.ticker_details_cache import ticker_details_cache
 
 logger = logging.getLogger(__name__)
 
+# HTTP calls one fetch costs against each provider's budget - calls served by
+# the ticker details cache or the on-disk HTTP cache are not charged, and Polygon
+# calls are charged one at a time as they are made
+REQUESTS_PER_FETCH = {'polygon': 2, 'alpha_vantage': 3, 'yfinance': 1}
+ALPHA_VANTAGE_FUNCTIONS = ('INCOME_STATEMENT', 'BALANCE_SHEET', 'OVERVIEW')
+
 class MultiSourceFetcher:
     def __init__(self):
         self.alpha_vantage_key = settings.ALPHA_VANTAGE_API_KEY
@@ -21,12 +30,20 @@ class MultiSourceFetcher:
         """
         Fetch stock data with multi-source fallback
         Priority: POLYGON (1st) → Alpha Vantage (2nd) → Yahoo (3rd) → Wikipedia (4th)
+        Raises BudgetExhausted instead of storing the Wikipedia placeholder when a
+        provider was skipped only for lack of budget - the fetch is retried later
         """
+        skipped = {}
+        
         # 1. Try POLYGON FIRST (working, 5 req/min free tier)
         logger.warning(f"[{symbol}] 1️⃣ Trying Polygon...")
         if self.polygon_key:
             logger.warning(f"[{symbol}] Calling _fetch_from_polygon for year {year}...")
-            result = await self._fetch_from_polygon(symbol, year, session)
+            try:
+                result = await self._fetch_from_polygon(symbol, year, session)
+            except BudgetExhausted as e:
+                skipped.update(e.providers)
+                result = None
             if result:
                 logger.warning(f"[{symbol}] ✅ SUCCESS from Polygon")
                 self.source_stats['polygon'] += 1
@@ -35,33 +52,41 @@ class MultiSourceFetcher:
         else:
             logger.warning(f"[{symbol}] Polygon key not configured")
         
-        await asyncio.sleep(2)
-        
         # 2. Try Alpha Vantage SECOND (25 req/day limit)
         logger.warning(f"[{symbol}] 2️⃣ Trying Alpha Vantage...")
         if self.alpha_vantage_key and self.alpha_vantage_key != 'demo':
-            logger.warning(f"[{symbol}] Calling _fetch_from_alpha_vantage...")
-            result = await self._fetch_from_alpha_vantage(symbol, session)
-            if result:
-                logger.warning(f"[{symbol}] ✅ SUCCESS from Alpha Vantage")
-                self.source_stats['alpha_vantage'] += 1
-                return result
-            logger.warning(f"[{symbol}] Alpha Vantage failed/returned None")
+            calls = http_cache.network_calls(
+                self._alpha_vantage_url(function, symbol) for function in ALPHA_VANTAGE_FUNCTIONS
+            )
+            if await self._within_budget('alpha_vantage', symbol, calls):
+                logger.warning(f"[{symbol}] Calling _fetch_from_alpha_vantage...")
+                result = await self._fetch_from_alpha_vantage(symbol, session)
+                if result:
+                    logger.warning(f"[{symbol}] ✅ SUCCESS from Alpha Vantage")
+                    self.source_stats['alpha_vantage'] += 1
+                    return result
+                logger.warning(f"[{symbol}] Alpha Vantage failed/returned None")
+            else:
+                skipped['alpha_vantage'] = calls
         else:
             logger.warning(f"[{symbol}] Alpha Vantage key not configured")
         
-        await asyncio.sleep(2)
-        
         # 3. Try Yahoo Finance THIRD (IP banned)
         logger.warning(f"[{symbol}] 3️⃣ Trying Yahoo Finance...")
-        result = await self._fetch_from_yfinance(symbol)
-        if result:
-            logger.warning(f"[{symbol}] ✅ SUCCESS from Yahoo")
-            self.source_stats['yfinance'] += 1
-            return result
+        if await self._within_budget('yfinance', symbol):
+            result = await self._fetch_from_yfinance(symbol)
+            if result:
+                logger.warning(f"[{symbol}] ✅ SUCCESS from Yahoo")
+                self.source_stats['yfinance'] += 1
+                return result
+        else:
+            skipped['yfinance'] = REQUESTS_PER_FETCH['yfinance']
         logger.warning(f"[{symbol}] Yahoo failed/returned None")
         
-        await asyncio.sleep(2)
+        # A real source was only out of budget - retry later rather than store a placeholder
+        if skipped:
+            logger.warning(f"[{symbol}] ⏳ Out of budget ({', '.join(skipped)}) - retrying later")
+            raise BudgetExhausted(skipped)
         
         # 4. Last resort: Wikipedia fallback
         logger.warning(f"[{symbol}] 4️⃣ Trying Wikipedia fallback...")
@@ -74,6 +99,36 @@ class MultiSourceFetcher:
         self.source_stats['failed'] += 1
         return None
     
+    def configured_providers(self) -> Dict[str, int]:
+        """Rate-limited providers fetch_stock_data will try, with the calls one fetch costs"""
+        providers = {'yfinance': REQUESTS_PER_FETCH['yfinance']}
+        if self.polygon_key:
+            providers['polygon'] = REQUESTS_PER_FETCH['polygon']
+        if self.alpha_vantage_key and self.alpha_vantage_key != 'demo':
+            providers['alpha_vantage'] = REQUESTS_PER_FETCH['alpha_vantage']
+        return providers
+    
+    async def wait_for_budget(self):
+        """
+        Sleep until the provider the next fetch needs could take it: Polygon when
+        configured (symbol-level fetch), otherwise any provider of the per-year chain
+        """
+        providers = self.configured_providers()
+        if 'polygon' in providers:
+            providers = {'polygon': providers['polygon']}
+        await rate_limiter.wait_for_any(providers)
+    
+    async def _within_budget(self, provider: str, symbol: str, calls: Optional[int] = None) -> bool:
+        """Take one fetch worth of calls from the provider's budget, waiting only as long as its quota requires"""
+        if calls == 0:
+            return True
+        granted = await rate_limiter.acquire(
+            provider, calls or REQUESTS_PER_FETCH[provider], max_wait=settings.RATE_LIMIT_MAX_WAIT_SECONDS
+        )
+        if not granted:
+            logger.warning(f"[{symbol}] ⏭️  {provider} budget exhausted - skipping to the next source")
+        return granted
+    
     async def _fetch_from_yfinance(self, symbol: str) -> Optional[Dict]:
         try:
             loop = asyncio.get_event_loop()
@@ -152,12 +207,15 @@ class MultiSourceFetcher:
             logger.debug(f"yfinance error for {symbol}: {str(e)}")
             return None
     
+    def _alpha_vantage_url(self, function: str, symbol: str) -> str:
+        return f"https://www.alphavantage.co/query?function={function}&symbol={symbol}&apikey={self.alpha_vantage_key}"
+    
     async def _fetch_from_alpha_vantage(self, symbol: str, session: aiohttp.ClientSession) -> Optional[Dict]:
         """Fetch from Alpha Vantage API"""
         logger.warning(f"[{symbol}] → _fetch_from_alpha_vantage() entered")
         try:
             # Get income statement
-            url = f"https://www.alphavantage.co/query?function=INCOME_STATEMENT&symbol={symbol}&apikey={self.alpha_vantage_key}"
+            url = self._alpha_vantage_url('INCOME_STATEMENT', symbol)
             logger.warning(f"[{symbol}] → Fetching INCOME_STATEMENT...")
             
             async with session.get(url) as response:
@@ -194,7 +252,7 @@ class MultiSourceFetcher:
                     return None
                 
                 # Get balance sheet
-                balance_url = f"https://www.alphavantage.co/query?function=BALANCE_SHEET&symbol={symbol}&apikey={self.alpha_vantage_key}"
+                balance_url = self._alpha_vantage_url('BALANCE_SHEET', symbol)
                 
                 async with session.get(balance_url) as bal_response:
                     if bal_response.status != 200:
@@ -208,7 +266,7 @@ class MultiSourceFetcher:
                     latest_balance = bal_data['annualReports'][0]
                     
                     # Get overview for market cap
-                    overview_url = f"https://www.alphavantage.co/query?function=OVERVIEW&symbol={symbol}&apikey={self.alpha_vantage_key}"
+                    overview_url = self._alpha_vantage_url('OVERVIEW', symbol)
                     
                     async with session.get(overview_url) as ov_response:
                         if ov_response.status != 200:
@@ -262,148 +320,210 @@ class MultiSourceFetcher:
     async def _fetch_from_polygon(self, symbol: str, year: int, session: aiohttp.ClientSession) -> Optional[Dict]:
         """Fetch from Polygon.io API"""
         logger.warning(f"[{symbol}] → _fetch_from_polygon() entered for year {year}")
+        records = await self._fetch_polygon_years(symbol, [year], session)
+        return records.get(int(year)) if records else None
+    
+    async def fetch_polygon_years(self, symbol: str, years: List[int], session: aiohttp.ClientSession) -> Optional[Dict[int, Dict]]:
+        """
+        Symbol-level Polygon fetch: one details + one financials call for every requested year
+        Returns {year: record} for the years Polygon could price (possibly empty),
+        or None when Polygon could not be asked (no key, HTTP error)
+        Raises BudgetExhausted when Polygon is out of budget - retry the symbol later
+        Details come from the shared ticker details cache when fresh
+        """
+        if not self.polygon_key:
+            return None
+        records = await self._fetch_polygon_years(symbol, years, session)
+        if records:
+            self.source_stats['polygon'] += 1
+        return records
+    
+    async def _fetch_polygon_years(self, symbol: str, years: List[int], session: aiohttp.ClientSession) -> Optional[Dict[int, Dict]]:
+        """
+        Each call is charged to Polygon's budget just before it is made
+        Raises BudgetExhausted when the next call does not fit
+        """
         logger.warning(f"[{symbol}] → Polygon API key: {self.polygon_key[:10]}...")
+        details = ticker_details_cache.get(symbol)
+        financials_url = self._polygon_financials_url(symbol)
+        
         try:
-            # Get company details
-            details_url = f"https://api.polygon.io/v3/reference/tickers/{symbol}?apiKey={self.polygon_key}"
-            logger.warning(f"[{symbol}] → Fetching company details from Polygon...")
-            
-            async with session.get(details_url) as response:
-                logger.warning(f"[{symbol}] → Polygon details HTTP status: {response.status}")
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.warning(f"[{symbol}] ❌ Polygon HTTP {response.status}: {error_text[:200]}")
-                    return None
-                
-                data = await response.json()
-                logger.warning(f"[{symbol}] → Polygon response keys: {list(data.keys())}")
-                
-                if 'results' not in data:
-                    logger.warning(f"[{symbol}] ❌ No 'results' in Polygon response: {data}")
-                    return None
-                
-                details = data['results']
-                market_cap = details.get('market_cap', 0)
-                logger.warning(f"[{symbol}] → Market cap: ${market_cap:,.0f}")
-                
-                if market_cap < settings.MIN_MARKET_CAP:
-                    logger.warning(f"[{symbol}] ❌ Market cap ${market_cap:,.0f} < ${settings.MIN_MARKET_CAP:,.0f}")
+            if details is None:
+                await self._take_polygon_call(symbol, self._polygon_details_url(symbol), pending=[financials_url])
+                details = await self._polygon_details(symbol, session)
+                if details is None:
                     return None
-                
-                # Get financials - fetch multiple years and filter for the requested year
-                financials_url = f"https://api.polygon.io/vX/reference/financials?ticker={symbol}&timeframe=annual&limit=10&apiKey={self.polygon_key}"
-                logger.warning(f"[{symbol}] → Fetching financials from Polygon for year {year}...")
-                
-                async with session.get(financials_url) as fin_response:
-                    logger.warning(f"[{symbol}] → Polygon financials HTTP status: {fin_response.status}")
-                    if fin_response.status != 200:
-                        error_text = await fin_response.text()
-                        logger.warning(f"[{symbol}] ❌ Polygon financials HTTP {fin_response.status}: {error_text[:200]}")
-                        return None
-                    
-                    fin_data = await fin_response.json()
-                    
-                    if 'results' not in fin_data or not fin_data['results']:
-                        logger.warning(f"[{symbol}] ❌ No financial results from Polygon")
-                        return None
-                    
-                    # Find the financial report for the requested year
-                    # Polygon fiscal_year can be string or int, handle both
-                    target_report = None
-                    for report in fin_data['results']:
-                        fiscal_year = report.get('fiscal_year')
-                        if fiscal_year:
-                            # Convert both to string and compare (handles "2024", 2024, etc.)
-                            try:
-                                report_year = int(str(fiscal_year).strip())
-                                if report_year == int(year):
-                                    target_report = report
-                                    logger.warning(f"[{symbol}] → Matched fiscal year {fiscal_year} with requested {year}")
-                                    break
-                            except (ValueError, TypeError):
-                                logger.warning(f"[{symbol}] → Could not parse fiscal_year: {fiscal_year}")
-                                continue
-                    
-                    if not target_report:
-                        # If no exact match, log available years and return None
-                        available_years = [r.get('fiscal_year') for r in fin_data['results'] if r.get('fiscal_year')]
-                        logger.warning(f"[{symbol}] ❌ No data for year {year}. Available years: {available_years}")
-                        return None
-                    
-                    logger.warning(f"[{symbol}] → Using fiscal year {target_report.get('fiscal_year')} data")
-                    financials = target_report['financials']
-                    income = financials.get('income_statement', {})
-                    balance = financials.get('balance_sheet', {})
-                    
-                    # Helper function to safely extract numeric values from Polygon's varying formats
-                    def safe_extract(data, default=0):
-                        """Extract value from Polygon's dict format or return raw value"""
-                        if data is None:
-                            return default
-                        if isinstance(data, dict):
-                            return data.get('value', default)
-                        if isinstance(data, (int, float)):
-                            return data
-                        return default
-                    
-                    # Extract EBIT (operating income)
-                    ebit = safe_extract(income.get('operating_income_loss'))
-                    logger.warning(f"[{symbol}] → EBIT: ${ebit:,.0f}")
-                    if ebit <= 0:
-                        logger.warning(f"[{symbol}] ❌ EBIT <= 0")
-                        return None
-                    
-                    # Extract balance sheet items - use safe_extract for all
-                    total_assets = safe_extract(balance.get('assets'))
-                    intangibles = safe_extract(balance.get('intangible_assets'))
-                    current_liabilities = safe_extract(balance.get('current_liabilities'))
-                    
-                    # Cash - try multiple possible field names
-                    cash = safe_extract(balance.get('cash_and_cash_equivalents'))
-                    if cash == 0:
-                        # Try alternative field names
-                        cash = safe_extract(balance.get('cash'))
-                    
-                    # Debt - try multiple possible field names
-                    debt = safe_extract(balance.get('long_term_debt'))
-                    if debt == 0:
-                        debt = safe_extract(balance.get('debt'))
-                    
-                    enterprise_value = market_cap + debt - cash
-                    tangible_capital = total_assets - intangibles - current_liabilities
-                    
-                    if enterprise_value <= 0 or tangible_capital <= 0:
-                        return None
-                    
-                    earnings_yield = (ebit / enterprise_value) * 100
-                    return_on_capital = (ebit / tangible_capital) * 100
-                    
-                    sector = details.get('sic_description', '')
-                    if any(excluded in sector for excluded in settings.EXCLUDED_SECTORS):
-                        return None
-                    
-                    logger.warning(f"[{symbol}] ✅ POLYGON SUCCESS - Building response...")
-                    return {
-                        'symbol': symbol,
-                        'company_name': details.get('name', symbol),
-                        'sector': sector,
-                        'market_cap': market_cap,
-                        'ebit': ebit,
-                        'enterprise_value': enterprise_value,
-                        'tangible_capital': tangible_capital,
-                        'earnings_yield': earnings_yield,
-                        'return_on_capital': return_on_capital,
-                        'current_price': details.get('market_cap', 0) / details.get('share_class_shares_outstanding', 1),
-                        'year': year,  # Use the requested year, not current year
-                        'source': 'polygon'
-                    }
+                ticker_details_cache.set(symbol, details)
+            else:
+                logger.warning(f"[{symbol}] → Company details from cache")
+            
+            market_cap = details.get('market_cap', 0)
+            logger.warning(f"[{symbol}] → Market cap: ${market_cap:,.0f}")
+            if market_cap < settings.MIN_MARKET_CAP:
+                logger.warning(f"[{symbol}] ❌ Market cap ${market_cap:,.0f} < ${settings.MIN_MARKET_CAP:,.0f}")
+                return {}
+            
+            await self._take_polygon_call(symbol, financials_url)
+            reports = await self._polygon_annual_reports(symbol, session)
+            if reports is None:
+                return None
+            
+            # Index the annual reports by fiscal year - first (most recent filing) wins
+            # Polygon fiscal_year can be string or int, handle both
+            by_year = {}
+            for report in reports:
+                fiscal_year = report.get('fiscal_year')
+                if not fiscal_year:
+                    continue
+                try:
+                    by_year.setdefault(int(str(fiscal_year).strip()), report)
+                except (ValueError, TypeError):
+                    logger.warning(f"[{symbol}] → Could not parse fiscal_year: {fiscal_year}")
+            
+            records = {}
+            for year in years:
+                report = by_year.get(int(year))
+                if report is None:
+                    logger.warning(f"[{symbol}] ❌ No data for year {year}. Available years: {sorted(by_year)}")
+                    continue
+                record = self._polygon_record(symbol, int(year), details, report)
+                if record:
+                    records[int(year)] = record
+            return records
         
+        except BudgetExhausted:
+            raise
         except Exception as e:
             logger.error(f"[{symbol}] ❌ POLYGON EXCEPTION: {type(e).__name__}: {str(e)}")
             import traceback
             logger.error(f"[{symbol}] Traceback:\n{traceback.format_exc()}")
             return None
     
+    async def _take_polygon_call(self, symbol: str, url: str, pending: List[str] = ()):
+        """
+        Charge one Polygon GET right before it is sent (free when the HTTP cache serves it),
+        so a call that never happens never spends quota
+        Raises BudgetExhausted with the calls the fetch still needs (url + pending)
+        """
+        if not await self._within_budget('polygon', symbol, http_cache.network_calls([url])):
+            raise BudgetExhausted({'polygon': http_cache.network_calls([url, *pending])})
+    
+    def _polygon_details_url(self, symbol: str) -> str:
+        return f"https://api.polygon.io/v3/reference/tickers/{symbol}?apiKey={self.polygon_key}"
+    
+    def _polygon_financials_url(self, symbol: str) -> str:
+        return f"https://api.polygon.io/vX/reference/financials?ticker={symbol}&timeframe=annual&limit=10&apiKey={self.polygon_key}"
+    
+    async def _polygon_details(self, symbol: str, session: aiohttp.ClientSession) -> Optional[Dict]:
+        """Company details (name, market cap, SIC description)"""
+        details_url = self._polygon_details_url(symbol)
+        logger.warning(f"[{symbol}] → Fetching company details from Polygon...")
+        
+        async with session.get(details_url) as response:
+            logger.warning(f"[{symbol}] → Polygon details HTTP status: {response.status}")
+            if response.status != 200:
+                error_text = await response.text()
+                logger.warning(f"[{symbol}] ❌ Polygon HTTP {response.status}: {error_text[:200]}")
+                return None
+            
+            data = await response.json()
+            logger.warning(f"[{symbol}] → Polygon response keys: {list(data.keys())}")
+            
+            if 'results' not in data:
+                logger.warning(f"[{symbol}] ❌ No 'results' in Polygon response: {data}")
+                return None
+            return data['results']
+    
+    async def _polygon_annual_reports(self, symbol: str, session: aiohttp.ClientSession) -> Optional[List[Dict]]:
+        """Up to 10 annual reports in one call - every fiscal year we track"""
+        financials_url = self._polygon_financials_url(symbol)
+        logger.warning(f"[{symbol}] → Fetching annual financials from Polygon...")
+        
+        async with session.get(financials_url) as fin_response:
+            logger.warning(f"[{symbol}] → Polygon financials HTTP status: {fin_response.status}")
+            if fin_response.status != 200:
+                error_text = await fin_response.text()
+                logger.warning(f"[{symbol}] ❌ Polygon financials HTTP {fin_response.status}: {error_text[:200]}")
+                return None
+            
+            fin_data = await fin_response.json()
+            
+            if 'results' not in fin_data or not fin_data['results']:
+                logger.warning(f"[{symbol}] ❌ No financial results from Polygon")
+                return []
+            return fin_data['results']
+    
+    def _polygon_record(self, symbol: str, year: int, details: Dict, report: Dict) -> Optional[Dict]:
+        """Magic Formula metrics of one annual report, or None when it cannot be ranked"""
+        logger.warning(f"[{symbol}] → Using fiscal year {report.get('fiscal_year')} data")
+        market_cap = details.get('market_cap', 0)
+        financials = report['financials']
+        income = financials.get('income_statement', {})
+        balance = financials.get('balance_sheet', {})
+        
+        # Helper function to safely extract numeric values from Polygon's varying formats
+        def safe_extract(data, default=0):
+            """Extract value from Polygon's dict format or return raw value"""
+            if data is None:
+                return default
+            if isinstance(data, dict):
+                return data.get('value', default)
+            if isinstance(data, (int, float)):
+                return data
+            return default
+        
+        # Extract EBIT (operating income)
+        ebit = safe_extract(income.get('operating_income_loss'))
+        logger.warning(f"[{symbol}] → EBIT: ${ebit:,.0f}")
+        if ebit <= 0:
+            logger.warning(f"[{symbol}] ❌ EBIT <= 0")
+            return None
+        
+        # Extract balance sheet items - use safe_extract for all
+        total_assets = safe_extract(balance.get('assets'))
+        intangibles = safe_extract(balance.get('intangible_assets'))
+        current_liabilities = safe_extract(balance.get('current_liabilities'))
+        
+        # Cash - try multiple possible field names
+        cash = safe_extract(balance.get('cash_and_cash_equivalents'))
+        if cash == 0:
+            # Try alternative field names
+            cash = safe_extract(balance.get('cash'))
+        
+        # Debt - try multiple possible field names
+        debt = safe_extract(balance.get('long_term_debt'))
+        if debt == 0:
+            debt = safe_extract(balance.get('debt'))
+        
+        enterprise_value = market_cap + debt - cash
+        tangible_capital = total_assets - intangibles - current_liabilities
+        
+        if enterprise_value <= 0 or tangible_capital <= 0:
+            return None
+        
+        earnings_yield = (ebit / enterprise_value) * 100
+        return_on_capital = (ebit / tangible_capital) * 100
+        
+        sector = details.get('sic_description', '')
+        if any(excluded in sector for excluded in settings.EXCLUDED_SECTORS):
+            return None
+        
+        logger.warning(f"[{symbol}] ✅ POLYGON SUCCESS - Building response...")
+        return {
+            'symbol': symbol,
+            'company_name': details.get('name', symbol),
+            'sector': sector,
+            'market_cap': market_cap,
+            'ebit': ebit,
+            'enterprise_value': enterprise_value,
+            'tangible_capital': tangible_capital,
+            'earnings_yield': earnings_yield,
+            'return_on_capital': return_on_capital,
+            'current_price': details.get('market_cap', 0) / details.get('share_class_shares_outstanding', 1),
+            'year': year,  # Use the requested year, not current year
+            'source': 'polygon'
+        }
+    
     async def _fetch_from_sp500_direct(self, symbol: str, session: aiohttp.ClientSession) -> Optional[Dict]:
         """
         Fetch basic S&P 500 company info from Wikipedia.
@@ -0,0 +1,224 @@
+"""
+Parquet Bulk Transfer of stock_data
+Moves whole periods between environments without re-fetching them
+
+- export: one Parquet file per year, hive layout (<root>/year=2023/part-0.parquet),
+  symbol / sector / data_source dictionary-encoded; the year lives in the directory name
+- import: record batches streamed into a temporary table (COPY on PostgreSQL),
+  then one UPDATE + one INSERT merge into stock_data in a single transaction.
+  Rows match on (symbol, year, month) with month IS NOT DISTINCT FROM, so yearly
+  rows (month NULL) are upserted too - ON CONFLICT cannot see NULL months
+"""
+import io
+import logging
+import os
+from typing import Dict, Optional, Sequence, Set, Tuple
+from sqlalchemy import Column, MetaData, Table, and_, exists, insert, select, update
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.database import StockData
+from app.services.dynamic_magic_formula import dynamic_magic_formula
+from app.services.period_summary import period_summary_service
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Everything but the surrogate id; year is carried by the partition directory
+TRANSFER_COLUMNS = (
+    StockData.symbol,
+    StockData.company_name,
+    StockData.sector,
+    StockData.year,
+    StockData.month,
+    StockData.ebit,
+    StockData.enterprise_value,
+    StockData.tangible_capital,
+    StockData.earnings_yield,
+    StockData.return_on_capital,
+    StockData.market_cap,
+    StockData.current_price,
+    StockData.data_source,
+    StockData.fetched_at,
+    StockData.updated_at,
+)
+FILE_COLUMNS = tuple(column for column in TRANSFER_COLUMNS if column.key != 'year')
+DICTIONARY_COLUMNS = ['symbol', 'sector', 'data_source']
+MATCH_KEYS = ('symbol', 'year', 'month')
+PART_FILE = 'part-0.parquet'
+
+
+def _arrow_types() -> Dict[str, 'pyarrow.DataType']:
+    strings = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    types = {column.key: pyarrow.float64() for column in TRANSFER_COLUMNS}
+    types.update({
+        'symbol': strings,
+        'company_name': pyarrow.string(),
+        'sector': strings,
+        'year': pyarrow.int32(),
+        'month': pyarrow.int8(),
+        'data_source': strings,
+        'fetched_at': pyarrow.timestamp('us'),
+        'updated_at': pyarrow.timestamp('us'),
+    })
+    return types
+
+
+def file_schema() -> 'pyarrow.Schema':
+    """Schema of the Parquet files (no year column)"""
+    types = _arrow_types()
+    return pyarrow.schema([(column.key, types[column.key]) for column in FILE_COLUMNS])
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is required for Parquet transfers (pip install pyarrow)")
+
+
+class ParquetTransferService:
+    """Parquet export / import of stock_data periods"""
+
+    def export(
+        self,
+        db: Session,
+        years: Sequence[int],
+        destination: str,
+        month: Optional[int] = None
+    ) -> Dict:
+        """
+        Write the given years (optionally one month of each) under destination
+        Existing year partitions are overwritten; years without rows are skipped
+        """
+        require_pyarrow()
+        schema = file_schema()
+        written = {}
+        for year in years:
+            clauses = [StockData.year == year]
+            if month is not None:
+                clauses.append(StockData.month == month)
+            rows = db.execute(
+                select(*FILE_COLUMNS).where(*clauses).order_by(StockData.month, StockData.symbol)
+            ).all()
+            if not rows:
+                continue
+
+            columns = list(zip(*rows))
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            )
+            partition = os.path.join(destination, f"year={year}")
+            os.makedirs(partition, exist_ok=True)
+            pyarrow.parquet.write_table(
+                table, os.path.join(partition, PART_FILE),
+                use_dictionary=DICTIONARY_COLUMNS, compression=settings.PARQUET_COMPRESSION
+            )
+            written[year] = len(rows)
+
+        logger.info(f"📦 Exported {sum(written.values())} stock_data rows for {len(written)} years to {destination}")
+        return {"years": sorted(written), "rows_by_year": written, "rows": sum(written.values())}
+
+    def import_dataset(self, db: Session, source: str, batch_size: int = settings.EXPORT_BATCH_SIZE) -> Dict:
+        """
+        Upsert a dataset written by export() into stock_data - all or nothing
+        Returns inserted / updated counts and the periods touched
+        """
+        require_pyarrow()
+        dataset = pyarrow.dataset.dataset(
+            source, format='parquet',
+            partitioning=pyarrow.dataset.partitioning(pyarrow.schema([('year', pyarrow.int32())]), flavor='hive')
+        )
+        column_names = [column.key for column in TRANSFER_COLUMNS]
+        plain_types = {
+            name: (kind.value_type if pyarrow.types.is_dictionary(kind) else kind)
+            for name, kind in _arrow_types().items()
+        }
+        plain_schema = pyarrow.schema([(name, plain_types[name]) for name in column_names])
+
+        staging = Table(
+            'stock_data_import', MetaData(),
+            *(Column(column.key, column.type) for column in TRANSFER_COLUMNS),
+            prefixes=['TEMPORARY']
+        )
+        connection = db.connection()
+        staging.drop(connection, checkfirst=True)
+        staging.create(connection)
+
+        periods: Set[Tuple[int, Optional[int]]] = set()
+        loaded = 0
+        try:
+            for batch in dataset.to_batches(columns=column_names, batch_size=batch_size):
+                table = pyarrow.Table.from_batches([batch]).cast(plain_schema)
+                years = table.column('year').to_pylist()
+                months = table.column('month').to_pylist()
+                periods.update(zip(years, months))
+                self._load(db, staging, table)
+                loaded += table.num_rows
+
+            updated, inserted = self._merge(db, staging)
+            staging.drop(db.connection())
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        touched = sorted(periods, key=lambda p: (p[0], p[1] or 0))
+        for year, month in touched:
+            dynamic_magic_formula.notify_period_updated(year, month)
+        dynamic_magic_formula.rebuild_rankings_for_writes(db, touched)
+        period_summary_service.refresh_for_writes(db, touched)
+
+        logger.info(f"📥 Imported {loaded} rows from {source}: {inserted} new, {updated} updated")
+        return {
+            "rows": loaded,
+            "inserted": inserted,
+            "updated": updated,
+            "periods": [{"year": year, "month": month} for year, month in touched]
+        }
+
+    def _load(self, db: Session, staging: Table, table: 'pyarrow.Table'):
+        """One batch into the staging table - COPY on PostgreSQL, executemany elsewhere"""
+        if db.bind.dialect.name == 'postgresql':
+            buffer = io.BytesIO()
+            pyarrow.csv.write_csv(table, buffer, pyarrow.csv.WriteOptions(include_header=False))
+            buffer.seek(0)
+            cursor = db.connection().connection.cursor()
+            try:
+                cursor.copy_expert(
+                    f"COPY {staging.name} ({', '.join(table.column_names)}) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+            finally:
+                cursor.close()
+        elif table.num_rows:
+            db.execute(insert(staging), table.to_pylist())
+
+    def _merge(self, db: Session, staging: Table) -> Tuple[int, int]:
+        """Update matching stock_data rows, insert the rest; returns (updated, inserted)"""
+        match = and_(
+            StockData.symbol == staging.c.symbol,
+            StockData.year == staging.c.year,
+            StockData.month.is_not_distinct_from(staging.c.month)
+        )
+        updated = db.execute(
+            update(StockData).where(match).values({
+                column.key: staging.c[column.key] for column in TRANSFER_COLUMNS if column.key not in MATCH_KEYS
+            })
+        ).rowcount
+        inserted = db.execute(
+            insert(StockData).from_select(
+                [column.key for column in TRANSFER_COLUMNS],
+                select(*staging.c).where(~exists().where(match))
+            )
+        ).rowcount
+        return updated, inserted
+
+
+# Global instance
+parquet_transfer_service = ParquetTransferService()
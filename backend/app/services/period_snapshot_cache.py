@@ -0,0 +1,156 @@
+"""
+Period Snapshot Cache
+Per-worker LRU of immutable columnar copies of one (year, month) period
+Lets filter + rank requests run entirely in memory instead of re-reading Postgres
+
+Each snapshot carries a data version (row count, max updated_at). A cached
+snapshot is revalidated with one tiny aggregate query at most every
+SNAPSHOT_REVALIDATE_SECONDS, and dropped immediately when the fetchers in
+this process commit new rows for its period.
+"""
+import logging
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from app.core.config import settings
+from app.services.ranking_engine import RankingColumns
+
+logger = logging.getLogger(__name__)
+
+PeriodKey = Tuple[int, Optional[int]]
+
+
+class PeriodSnapshot:
+    """
+    Immutable columnar copy of every stock_data row of one period (id order)
+    """
+
+    __slots__ = ('year', 'month', 'version', 'ids', 'columns', 'fields', 'rows')
+
+    def __init__(
+        self,
+        year: int,
+        month: Optional[int],
+        version: Hashable,
+        ids: np.ndarray,
+        columns: RankingColumns,
+        fields: Tuple[str, ...],
+        rows: List[tuple]
+    ):
+        self.year = year
+        self.month = month
+        self.version = version
+        self.ids = ids
+        self.columns = columns
+        self.fields = fields
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def record(self, position: int) -> Dict:
+        """Fresh response dict for one row - callers may mutate it"""
+        return dict(zip(self.fields, self.rows[position]))
+
+
+class PeriodSnapshotCache:
+    """
+    Thread-safe LRU of PeriodSnapshot keyed by (year, month)
+    Loading/versioning SQL lives in the caller (DynamicMagicFormulaService)
+    """
+
+    def __init__(self, max_periods: int, revalidate_seconds: float):
+        self.max_periods = max_periods
+        self.revalidate_seconds = revalidate_seconds
+        self._snapshots: "OrderedDict[PeriodKey, PeriodSnapshot]" = OrderedDict()
+        self._validated_at: Dict[PeriodKey, float] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_periods > 0
+
+    def get(
+        self,
+        key: PeriodKey,
+        current_version: Callable[[], Hashable],
+        load: Callable[[Hashable], PeriodSnapshot]
+    ) -> PeriodSnapshot:
+        """
+        Return the snapshot for key, reloading it if its data version changed
+
+        Args:
+            key: (year, month) - month None = every record of the year
+            current_version: runs the cheap version query against the database
+            load: builds a new snapshot for the given version
+        """
+        now = time.monotonic()
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and now - self._validated_at.get(key, 0.0) < self.revalidate_seconds:
+                self._snapshots.move_to_end(key)
+                self.hits += 1
+                return snapshot
+
+        version = current_version()
+
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and snapshot.version == version:
+                self._snapshots.move_to_end(key)
+                self._validated_at[key] = now
+                self.revalidations += 1
+                return snapshot
+
+        snapshot = load(version)
+        with self._lock:
+            self._snapshots[key] = snapshot
+            self._snapshots.move_to_end(key)
+            self._validated_at[key] = now
+            self.loads += 1
+            while len(self._snapshots) > self.max_periods:
+                evicted, _ = self._snapshots.popitem(last=False)
+                self._validated_at.pop(evicted, None)
+        logger.info(f"📦 Loaded snapshot {key}: {len(snapshot)} rows, version {version}")
+        return snapshot
+
+    def invalidate(self, year: int, month: Optional[int] = None):
+        """
+        Drop snapshots affected by a write to (year, month)
+        The whole-year snapshot (year, None) always contains the month's rows
+        """
+        with self._lock:
+            for key in {(year, month), (year, None)}:
+                if self._snapshots.pop(key, None) is not None:
+                    self.invalidations += 1
+                self._validated_at.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._validated_at.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "cached_periods": [list(key) for key in self._snapshots],
+                "max_periods": self.max_periods,
+                "cached_rows": sum(len(s) for s in self._snapshots.values()),
+                "hits": self.hits,
+                "revalidations": self.revalidations,
+                "loads": self.loads,
+                "invalidations": self.invalidations
+            }
+
+
+# Global instance
+period_snapshot_cache = PeriodSnapshotCache(
+    max_periods=settings.SNAPSHOT_CACHE_SIZE,
+    revalidate_seconds=settings.SNAPSHOT_REVALIDATE_SECONDS
+)
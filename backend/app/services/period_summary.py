@@ -0,0 +1,332 @@
+"""
+Period Summary Service
+Period catalog and zone-map statistics kept in the small period_summary table
+
+- Counters (stored rows, last update, pending / failed fetches) are updated by
+  the ingest code inside the transaction of each write or failure transition
+- Statistics (min / max / quantiles / null count per metric, rows per sector)
+  are refreshed after each write batch; min / max are widened on every write
+
+Read by the API to list periods, report completion, reject filters that cannot
+match and preview "N stocks would match" without touching stock_data
+"""
+import logging
+import numpy as np
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models.database import StockData, FailedStock, PeriodSummary
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_METRICS = ('ebit', 'market_cap', 'earnings_yield', 'return_on_capital')
+QUANTILE_POINTS = np.linspace(0.0, 1.0, 21)  # every 5%
+UNKNOWN_SECTOR = 'Unknown'
+FAILURE_COUNTERS = {'pending': 'pending_count', 'failed': 'failed_count'}
+
+
+def summarize_columns(values: Dict[str, np.ndarray], sectors: Iterable[Optional[str]]) -> Tuple[Dict, Dict]:
+    """
+    Column statistics of one period
+
+    Returns:
+        (column_stats, sector_counts) as stored in period_summary
+    """
+    column_stats = {}
+    for metric, column in values.items():
+        present = column[~np.isnan(column)]
+        column_stats[metric] = {
+            "min": float(present.min()) if len(present) else None,
+            "max": float(present.max()) if len(present) else None,
+            "null_count": int(len(column) - len(present)),
+            "quantiles": np.quantile(present, QUANTILE_POINTS).tolist() if len(present) else []
+        }
+    sector_counts = dict(Counter(sector or UNKNOWN_SECTOR for sector in sectors))
+    return column_stats, sector_counts
+
+
+def fraction_at_least(stats: Dict, stock_count: int, minimum: float, strict: bool = False) -> float:
+    """
+    Estimated share of the period's rows with metric >= minimum (> when strict)
+    Exactly 0.0 when the zone map proves no row can match
+    """
+    present = stock_count - stats["null_count"]
+    if present <= 0 or stats["max"] is None:
+        return 0.0
+    if stats["max"] < minimum or (strict and stats["max"] <= minimum):
+        return 0.0
+    if stats["min"] > minimum or (not strict and stats["min"] == minimum):
+        return present / stock_count
+    below = float(np.interp(minimum, stats["quantiles"], QUANTILE_POINTS))
+    # max >= minimum: at least one row passes even where the 5% grid says otherwise
+    return max((1.0 - below) * present, 1.0) / stock_count
+
+
+def estimate_matches(
+    summary: PeriodSummary,
+    min_earnings_yield: float,
+    min_return_on_capital: float,
+    min_market_cap: float,
+    excluded_sectors: Iterable[str]
+) -> Dict:
+    """
+    Match-count preview from the zone map (metrics assumed independent)
+
+    Returns:
+        {'stock_count', 'estimated_matches', 'impossible'} - impossible=True is exact
+    """
+    count = summary.stock_count or 0
+    if count == 0:
+        return {"stock_count": 0, "estimated_matches": 0, "impossible": True}
+
+    stats = summary.column_stats
+    excluded = set(excluded_sectors)
+    allowed = sum(n for sector, n in summary.sector_counts.items() if sector not in excluded)
+    fractions = [
+        fraction_at_least(stats["ebit"], count, 0.0, strict=True),
+        fraction_at_least(stats["market_cap"], count, min_market_cap),
+        fraction_at_least(stats["earnings_yield"], count, min_earnings_yield),
+        fraction_at_least(stats["return_on_capital"], count, min_return_on_capital),
+        allowed / count
+    ]
+    impossible = any(fraction == 0.0 for fraction in fractions)
+    return {
+        "stock_count": count,
+        "estimated_matches": 0 if impossible else max(1, int(round(count * float(np.prod(fractions))))),
+        "impossible": impossible
+    }
+
+
+class PeriodSummaryService:
+    """Maintains and reads the period_summary table"""
+
+    def _period_clauses(self, model, year: int, month: Optional[int]) -> list:
+        if month is None:
+            return [model.year == year]
+        return [model.year == year, model.month == month]
+
+    def _summary_clauses(self, year: int, month: Optional[int]) -> list:
+        month_clause = PeriodSummary.month.is_(None) if month is None else PeriodSummary.month == month
+        return [PeriodSummary.year == year, month_clause]
+
+    def get(self, db: Session, year: int, month: Optional[int] = None) -> Optional[PeriodSummary]:
+        return db.execute(
+            select(PeriodSummary).where(*self._summary_clauses(year, month))
+        ).scalars().first()
+
+    def get_for_update(self, db: Session, year: int, month: Optional[int] = None) -> PeriodSummary:
+        """Row-locked summary of a period (created empty if missing) - caller commits"""
+        query = select(PeriodSummary).where(*self._summary_clauses(year, month)).with_for_update()
+        summary = db.execute(query).scalars().first()
+        if summary is None:
+            self._create_missing(db, year, month)
+            summary = db.execute(query).scalars().one()
+        return summary
+
+    def _create_missing(self, db: Session, year: int, month: Optional[int]):
+        """
+        Empty summary row for a period, unless one exists - INSERT ... ON CONFLICT DO NOTHING
+        against the unique (year, month) index, so concurrent writers creating the same
+        period end up sharing one row
+        """
+        insert = postgresql.insert if db.bind.dialect.name == 'postgresql' else sqlite.insert
+        db.execute(
+            insert(PeriodSummary).values(
+                year=year, month=month, stock_count=0, stored_count=0, pending_count=0, failed_count=0,
+                column_stats={}, sector_counts={}
+            ).on_conflict_do_nothing()
+        )
+
+    def get_all(self, db: Session) -> Dict[Tuple[int, Optional[int]], Dict]:
+        """Every summary as a response dict keyed by (year, month)"""
+        return {
+            (summary.year, summary.month): self.to_dict(summary)
+            for summary in db.execute(select(PeriodSummary)).scalars()
+        }
+
+    def to_dict(self, summary: PeriodSummary) -> Dict:
+        return {
+            "stock_count": summary.stock_count,
+            "pending_count": summary.pending_count,
+            "failed_count": summary.failed_count,
+            "columns": summary.column_stats,
+            "sectors": summary.sector_counts,
+            "computed_at": summary.computed_at
+        }
+
+    def record_write(self, db: Session, stock: StockData, is_new: bool, previous_sector: Optional[str] = None):
+        """
+        Ingest hook: account for one inserted / updated stock_data row (caller commits)
+        Keeps counters exact and min / max conservative until the next batch refresh
+        previous_sector: an updated row's sector before the write (None = it had none)
+        """
+        updated_at = stock.updated_at or datetime.utcnow()
+        exact = self.get_for_update(db, stock.year, stock.month)
+        if is_new:
+            exact.stored_count = (exact.stored_count or 0) + 1
+        if exact.last_updated is None or updated_at > exact.last_updated:
+            exact.last_updated = updated_at
+
+        sector = stock.sector or UNKNOWN_SECTOR
+        moved_from = None if is_new else (previous_sector or UNKNOWN_SECTOR)
+        for year, month in {(stock.year, stock.month), (stock.year, None)}:
+            summary = self.get_for_update(db, year, month)
+            if is_new:
+                summary.stock_count = (summary.stock_count or 0) + 1
+            if moved_from != sector:
+                counts = {**summary.sector_counts, sector: summary.sector_counts.get(sector, 0) + 1}
+                if moved_from is not None:
+                    counts[moved_from] = counts.get(moved_from, 0) - 1
+                    if counts[moved_from] <= 0:
+                        del counts[moved_from]
+                summary.sector_counts = counts
+            summary.column_stats = self._widen(summary.column_stats, stock)
+
+    def _widen(self, column_stats: Dict, stock: StockData) -> Dict:
+        """New stats dict with min / max stretched to cover the row's metrics"""
+        widened = {}
+        for metric in SUMMARY_METRICS:
+            stats = dict(column_stats.get(metric) or {"min": None, "max": None, "null_count": 0, "quantiles": []})
+            value = getattr(stock, metric)
+            if value is None:
+                stats["null_count"] += 1
+            else:
+                stats["min"] = value if stats["min"] is None else min(stats["min"], value)
+                stats["max"] = value if stats["max"] is None else max(stats["max"], value)
+            widened[metric] = stats
+        return widened
+
+    def set_failure_status(self, db: Session, failed: FailedStock, status: str, new: bool = False):
+        """
+        Ingest hook: change a failed_stocks row's status and move the period's counters
+        new=True for a row being created (it has no previous status)
+        """
+        previous = None if new else failed.status
+        failed.status = status
+        if previous == status:
+            return
+        if previous not in FAILURE_COUNTERS and status not in FAILURE_COUNTERS:
+            return
+        summary = self.get_for_update(db, failed.year, failed.month)
+        if previous in FAILURE_COUNTERS:
+            counter = FAILURE_COUNTERS[previous]
+            setattr(summary, counter, max(0, (getattr(summary, counter) or 0) - 1))
+        if status in FAILURE_COUNTERS:
+            counter = FAILURE_COUNTERS[status]
+            setattr(summary, counter, (getattr(summary, counter) or 0) + 1)
+
+    def refresh(self, db: Session, year: int, month: Optional[int] = None) -> PeriodSummary:
+        """
+        Recompute one period's statistics and row counters from stock_data (one narrow read) and commit
+        Failure counters are left to set_failure_status
+        """
+        rows = db.execute(
+            select(
+                StockData.ebit, StockData.market_cap, StockData.earnings_yield,
+                StockData.return_on_capital, StockData.sector, StockData.month, StockData.updated_at
+            ).where(*self._period_clauses(StockData, year, month))
+        ).all()
+        metric_rows = [row[:4] for row in rows]
+        matrix = np.array(metric_rows, dtype=np.float64).reshape(len(rows), len(SUMMARY_METRICS))
+        column_stats, sector_counts = summarize_columns(
+            {metric: matrix[:, i] for i, metric in enumerate(SUMMARY_METRICS)},
+            (row[4] for row in rows)
+        )
+        stored = [row for row in rows if row[5] == month]
+
+        summary = self.get_for_update(db, year, month)
+        summary.stock_count = len(rows)
+        summary.stored_count = len(stored)
+        summary.last_updated = max((row[6] for row in stored if row[6] is not None), default=None)
+        summary.column_stats = column_stats
+        summary.sector_counts = sector_counts
+        summary.computed_at = datetime.utcnow()
+        db.commit()
+        return summary
+
+    def refresh_for_writes(self, db: Session, periods: Iterable[Tuple[int, Optional[int]]]) -> None:
+        """
+        Refresh every summary affected by writes to the given (year, month) periods
+        A monthly write also changes its year's summary (month NULL = whole year)
+        """
+        affected = set()
+        for year, month in periods:
+            affected.add((year, month))
+            affected.add((year, None))
+        for year, month in sorted(affected, key=lambda p: (p[0], p[1] or 0)):
+            try:
+                self.refresh(db, year, month)
+            except Exception as e:
+                db.rollback()
+                period_str = f"{year}-{month:02d}" if month else f"{year}"
+                logger.error(f"❌ Failed to refresh period summary for {period_str}: {e}")
+
+    def backfill(self, db: Session) -> int:
+        """
+        Build summaries for periods that do not have one yet (startup) - the only
+        place failure counters are counted from failed_stocks instead of maintained
+        """
+        stored = db.execute(select(StockData.year, StockData.month).distinct()).all()
+        failures = db.execute(
+            select(FailedStock.year, FailedStock.month, FailedStock.status, func.count(FailedStock.id))
+            .where(FailedStock.status.in_(list(FAILURE_COUNTERS)))
+            .group_by(FailedStock.year, FailedStock.month, FailedStock.status)
+        ).all()
+        wanted = {(year, month) for year, month in stored} | {(year, None) for year, _ in stored}
+        wanted |= {(year, month) for year, month, _, _ in failures}
+        existing = {tuple(row) for row in db.execute(select(PeriodSummary.year, PeriodSummary.month))}
+        missing = wanted - existing
+        if not missing:
+            return 0
+
+        for year, month in sorted(missing, key=lambda p: (p[0], p[1] or 0)):
+            self.refresh(db, year, month)
+        for year, month, status, count in failures:
+            if (year, month) in missing:
+                setattr(self.get_for_update(db, year, month), FAILURE_COUNTERS[status], count)
+        db.commit()
+        logger.info(f"📐 Backfilled {len(missing)} period summaries")
+        return len(missing)
+
+    def get_available_periods(self, db: Session) -> List[Dict]:
+        """Periods holding stored rows, newest first - one read of the catalog"""
+        summaries = db.execute(
+            select(PeriodSummary).where(PeriodSummary.stored_count > 0).order_by(
+                PeriodSummary.year.desc(), PeriodSummary.month.desc()
+            )
+        ).scalars().all()
+        return [
+            {
+                'year': summary.year,
+                'month': summary.month,
+                'period': f"{summary.year}-{summary.month:02d}" if summary.month else f"{summary.year}",
+                'stock_count': summary.stored_count,
+                'last_updated': summary.last_updated
+            }
+            for summary in summaries
+        ]
+
+    def estimate(
+        self,
+        db: Session,
+        year: int,
+        month: Optional[int],
+        min_earnings_yield: float,
+        min_return_on_capital: float,
+        min_market_cap: float
+    ) -> Optional[Dict]:
+        """Match-count preview for a filter set, None when the period has no summary yet"""
+        summary = self.get(db, year, month)
+        if summary is None:
+            return None
+        return estimate_matches(
+            summary, min_earnings_yield, min_return_on_capital, min_market_cap, settings.EXCLUDED_SECTORS
+        )
+
+
+# Global instance
+period_summary_service = PeriodSummaryService()
@@ -0,0 +1,285 @@
+"""
+Incremental Rank Index
+Keeps the EY and ROC orderings of a period (default filter profile) as sorted
+lists, updated in place as the fetchers commit single rows
+
+- upsert / delete: O(log n) - SortedList insert / remove in the EY, ROC and
+  combined orderings, for the written stock only
+- combined Magic Formula ordering: a SortedList of (base score, id). One write
+  shifts every other stock by at most one place per ordering, so its score by at
+  most 2: base scores are left to drift (within a tracked bound) instead of
+  patching up to n scores per write. Reads place the stocks within the drift
+  bound of their page by their exact score (EY / ROC positions are O(log n)
+  SortedList lookups)
+- every RANK_INDEX_REBASE_WRITES writes the base scores are re-read in one O(n)
+  pass over the orderings (the old order is nearly sorted), keeping read windows small
+- top-N reads are O(log n + (top_n + w) log n) for the w stocks inside the drift
+  window; single-stock rank lookups likewise
+"""
+import logging
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from sortedcontainers import SortedList
+from app.core.config import settings
+from app.services.ranking_engine import RankResult
+
+logger = logging.getLogger(__name__)
+
+PeriodKey = Tuple[int, Optional[int]]
+
+
+class PeriodRankIndex:
+    """
+    Rank index for one period
+
+    _ey / _roc hold sort keys (-metric, stock_id): ascending order = best first,
+    ties in id order - the same ordinal tie-breaking as ranking_engine.
+    _combined holds (base score, stock_id); the current score (ey_rank + roc_rank)
+    of every entry is within _drift of its base score
+    """
+
+    def __init__(self, version: Tuple[int, Optional[datetime]], rebase_writes: int = settings.RANK_INDEX_REBASE_WRITES):
+        self.version = version
+        self.rebase_writes = rebase_writes
+        self._ey = SortedList()
+        self._roc = SortedList()
+        self._metrics: Dict[int, Tuple[float, float]] = {}  # eligible id -> (ey, roc)
+        self._period_ids: Set[int] = set()  # every row of the period, eligible or not
+        self._base: Dict[int, int] = {}  # eligible id -> score it is filed under in _combined
+        self._combined = SortedList()
+        self._drift = 0
+        self.rebases = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(
+        cls,
+        version: Tuple[int, Optional[datetime]],
+        ids: np.ndarray,
+        earnings_yield: np.ndarray,
+        return_on_capital: np.ndarray,
+        eligible: np.ndarray
+    ) -> 'PeriodRankIndex':
+        """Full build from a period snapshot - O(n log n), done once"""
+        index = cls(version)
+        index._period_ids = set(ids.tolist())
+        selected = np.flatnonzero(eligible)
+        sel_ids = ids[selected].tolist()
+        sel_ey = earnings_yield[selected].tolist()
+        sel_roc = return_on_capital[selected].tolist()
+        index._metrics = dict(zip(sel_ids, zip(sel_ey, sel_roc)))
+        index._ey = SortedList(zip((-v for v in sel_ey), sel_ids))
+        index._roc = SortedList(zip((-v for v in sel_roc), sel_ids))
+        index._rebase()
+        return index
+
+    def __len__(self) -> int:
+        return len(self._metrics)
+
+    def _rebase(self):
+        """File every stock under its current score - one pass over each ordering"""
+        roc_rank = {key[1]: rank for rank, key in enumerate(self._roc, 1)}
+        self._base = {key[1]: rank + roc_rank[key[1]] for rank, key in enumerate(self._ey, 1)}
+        # Scores moved by at most _drift since the last pass: nearly sorted input, ~O(n) for timsort
+        order = (stock_id for _, stock_id in self._combined) if len(self._combined) == len(self._base) else self._base
+        self._combined = SortedList((self._base[stock_id], stock_id) for stock_id in order)
+        self._drift = 0
+
+    def _ranks(self, stock_id: int) -> Tuple[int, int]:
+        """Current (ey_rank, roc_rank) of an eligible stock - O(log n)"""
+        ey, roc = self._metrics[stock_id]
+        return self._ey.index((-ey, stock_id)) + 1, self._roc.index((-roc, stock_id)) + 1
+
+    def _exact(self, entries) -> List[Tuple[int, int]]:
+        """(current score, id) of the given (base score, id) entries, in ranking order"""
+        return sorted((sum(self._ranks(stock_id)), stock_id) for _, stock_id in entries)
+
+    def _apply(self, stock_id: int, metrics: Optional[Tuple[float, float]]):
+        """Move one stock to `metrics` (None = out of the ranking) in every ordering"""
+        old = self._metrics.pop(stock_id, None)
+        if old is not None:
+            self._ey.remove((-old[0], stock_id))
+            self._roc.remove((-old[1], stock_id))
+            self._combined.remove((self._base.pop(stock_id), stock_id))
+        if metrics is not None:
+            self._metrics[stock_id] = metrics
+            self._ey.add((-metrics[0], stock_id))
+            self._roc.add((-metrics[1], stock_id))
+        # Every other stock moved at most one place in each ordering
+        self._drift += 2
+        if metrics is not None:
+            self._base[stock_id] = sum(self._ranks(stock_id))
+            self._combined.add((self._base[stock_id], stock_id))
+        if self._drift >= 2 * self.rebase_writes:
+            self._rebase()
+            self.rebases += 1
+
+    def upsert(
+        self,
+        stock_id: int,
+        earnings_yield: float,
+        return_on_capital: float,
+        eligible: bool,
+        updated_at: Optional[datetime]
+    ):
+        """Insert or move one stock; ineligible stocks leave the ranking"""
+        with self._lock:
+            if eligible or stock_id in self._metrics:
+                self._apply(stock_id, (earnings_yield, return_on_capital) if eligible else None)
+
+            count, last_updated = self.version
+            if stock_id not in self._period_ids:
+                self._period_ids.add(stock_id)
+                count += 1
+            if updated_at is not None and (last_updated is None or updated_at > last_updated):
+                last_updated = updated_at
+            self.version = (count, last_updated)
+
+    def delete(self, stock_id: int):
+        """Remove a stock from the period (version must be refreshed by the caller)"""
+        with self._lock:
+            if stock_id in self._metrics:
+                self._apply(stock_id, None)
+            self._period_ids.discard(stock_id)
+
+    def ranked(self) -> RankResult:
+        """Combined Magic Formula ordering over stock ids (RankResult.positions are stock ids)"""
+        return self.top(len(self))
+
+    def top(self, top_n: int, after_rank: int = 0) -> RankResult:
+        """
+        top_n stocks ranked after after_rank
+        Stocks filed more than 2 * drift below the page's first base score are all
+        ranked before the page, those more than 2 * drift above its last one after
+        it - only the window in between is placed by exact score
+        """
+        with self._lock:
+            combined = self._combined
+            end = min(after_rank + top_n, len(combined))
+            page = []
+            if end > after_rank:
+                margin = 2 * self._drift
+                first = combined.bisect_left((combined[after_rank][0] - margin,))
+                last = combined.bisect_right((combined[end - 1][0] + margin, float('inf')))
+                window = self._exact(combined.islice(first, last))
+                page = window[after_rank - first:end - first]
+            ranks = [self._ranks(stock_id) for _, stock_id in page]
+            return RankResult(
+                positions=np.asarray([stock_id for _, stock_id in page], dtype=np.int64),
+                ey_rank=np.asarray([ey for ey, _ in ranks], dtype=np.int64),
+                roc_rank=np.asarray([roc for _, roc in ranks], dtype=np.int64),
+                score=np.asarray([score for score, _ in page], dtype=np.int64),
+                total_ranked=len(combined)
+            )
+
+    def rank_of(self, stock_id: int) -> Optional[Dict]:
+        """Rank fields of one stock, None when it is not ranked (ineligible / unknown)"""
+        return self.ranks_of([stock_id]).get(stock_id)
+
+    def ranks_of(self, stock_ids: List[int]) -> Dict[int, Dict]:
+        """Rank fields of several stocks (unranked ids are left out)"""
+        with self._lock:
+            combined = self._combined
+            ranks = {}
+            for stock_id in stock_ids:
+                if stock_id not in self._metrics:
+                    continue
+                ey_rank, roc_rank = self._ranks(stock_id)
+                score = ey_rank + roc_rank
+                # Filed below score - drift: ranked ahead; above score + drift: behind
+                first = combined.bisect_left((score - self._drift,))
+                last = combined.bisect_right((score + self._drift, float('inf')))
+                ahead = sum(1 for entry in self._exact(combined.islice(first, last)) if entry < (score, stock_id))
+                ranks[stock_id] = {
+                    "ey_rank": ey_rank,
+                    "roc_rank": roc_rank,
+                    "magic_formula_score": score,
+                    "rank": first + ahead + 1
+                }
+            return ranks
+
+
+class RankIndexRegistry:
+    """Per-worker LRU of PeriodRankIndex keyed by (year, month)"""
+
+    def __init__(self, enabled: bool, revalidate_seconds: float, max_periods: int):
+        self.enabled = enabled
+        self.revalidate_seconds = revalidate_seconds
+        self.max_periods = max_periods
+        self._indexes: "OrderedDict[PeriodKey, PeriodRankIndex]" = OrderedDict()
+        self._validated_at: Dict[PeriodKey, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: PeriodKey) -> Optional[PeriodRankIndex]:
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+            return index
+
+    def is_fresh(self, key: PeriodKey) -> bool:
+        """Validated against the database recently enough to skip the version query"""
+        with self._lock:
+            return time.monotonic() - self._validated_at.get(key, float('-inf')) < self.revalidate_seconds
+
+    def mark_validated(self, key: PeriodKey):
+        with self._lock:
+            self._validated_at[key] = time.monotonic()
+
+    def put(self, key: PeriodKey, index: PeriodRankIndex):
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            self._validated_at[key] = time.monotonic()
+            while len(self._indexes) > self.max_periods:
+                evicted, _ = self._indexes.popitem(last=False)
+                self._validated_at.pop(evicted, None)
+
+    def apply_upsert(
+        self,
+        year: int,
+        month: Optional[int],
+        stock_id: int,
+        earnings_yield: float,
+        return_on_capital: float,
+        eligible: bool,
+        updated_at: Optional[datetime]
+    ):
+        """Commit hook: feed one written row to every index covering its period"""
+        for key in {(year, month), (year, None)}:
+            with self._lock:
+                index = self._indexes.get(key)  # a write is not a use - LRU order unchanged
+            if index is not None:
+                index.upsert(stock_id, earnings_yield, return_on_capital, eligible, updated_at)
+
+    def invalidate(self, year: int, month: Optional[int] = None):
+        """Bulk writes: drop the indexes, they are rebuilt on the next read"""
+        with self._lock:
+            for key in {(year, month), (year, None)}:
+                self._indexes.pop(key, None)
+                self._validated_at.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+            self._validated_at.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                "indexed_periods": [list(key) for key in self._indexes],
+                "max_periods": self.max_periods,
+                "indexed_rows": sum(len(index) for index in self._indexes.values())
+            }
+
+
+# Global instance
+rank_index_registry = RankIndexRegistry(
+    enabled=settings.RANK_INDEX_ENABLED,
+    revalidate_seconds=settings.SNAPSHOT_REVALIDATE_SECONDS,
+    max_periods=settings.RANK_INDEX_CACHE_SIZE
+)
@@ -0,0 +1,334 @@
+"""
+Columnar Magic Formula Ranking Engine
+Vectorized filter + rank over NumPy arrays instead of per-stock Python dicts
+Produces exactly the same ordering as DynamicMagicFormulaService._rank_stocks
+"""
+import numpy as np
+from typing import List, Dict, Iterable, Optional, Sequence, Tuple
+
+
+def encode_sectors(sectors: Iterable[Optional[str]]) -> Tuple[np.ndarray, List[Optional[str]]]:
+    """
+    Dictionary-encode sector names
+
+    Returns:
+        (codes, table) where table[codes[i]] is the sector of row i
+    """
+    table: List[Optional[str]] = []
+    lookup: Dict[Optional[str], int] = {}
+    codes = []
+    for sector in sectors:
+        code = lookup.get(sector)
+        if code is None:
+            code = len(table)
+            lookup[sector] = code
+            table.append(sector)
+        codes.append(code)
+    return np.asarray(codes, dtype=np.int32), table
+
+
+class RankingColumns:
+    """
+    Column-oriented view of one period's stocks
+    Row i of every array describes the same stock (row order = load order)
+    """
+
+    __slots__ = ('ebit', 'market_cap', 'earnings_yield', 'return_on_capital', 'sector_codes', 'sectors',
+                 '_orders', '_threshold_index')
+
+    def __init__(
+        self,
+        ebit: np.ndarray,
+        market_cap: np.ndarray,
+        earnings_yield: np.ndarray,
+        return_on_capital: np.ndarray,
+        sector_codes: np.ndarray,
+        sectors: List[Optional[str]]
+    ):
+        self.ebit = ebit
+        self.market_cap = market_cap
+        self.earnings_yield = earnings_yield
+        self.return_on_capital = return_on_capital
+        self.sector_codes = sector_codes
+        self.sectors = sectors
+        self._orders: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._threshold_index: Optional['ThresholdIndex'] = None
+
+    def __len__(self) -> int:
+        return len(self.ebit)
+
+    @classmethod
+    def from_sequences(
+        cls,
+        ebit: Sequence[float],
+        market_cap: Sequence[float],
+        earnings_yield: Sequence[float],
+        return_on_capital: Sequence[float],
+        sectors: Sequence[Optional[str]]
+    ) -> 'RankingColumns':
+        """Build columns from per-column sequences (e.g. zip(*rows) of a SQL result)"""
+        codes, table = encode_sectors(sectors)
+        return cls(
+            ebit=np.asarray(ebit, dtype=np.float64),
+            market_cap=np.asarray(market_cap, dtype=np.float64),
+            earnings_yield=np.asarray(earnings_yield, dtype=np.float64),
+            return_on_capital=np.asarray(return_on_capital, dtype=np.float64),
+            sector_codes=codes,
+            sectors=table
+        )
+
+    @classmethod
+    def from_records(cls, stocks: Sequence[Dict]) -> 'RankingColumns':
+        """Build columns from the stock dicts used by the dict path"""
+        return cls.from_sequences(
+            [s['ebit'] for s in stocks],
+            [s['market_cap'] for s in stocks],
+            [s['earnings_yield'] for s in stocks],
+            [s['return_on_capital'] for s in stocks],
+            [s.get('sector') for s in stocks]
+        )
+
+    def sort_orders(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Row orders by Earnings Yield and by Return on Capital (best first, ties in row order)
+        Computed once per instance - cached snapshots reuse them across requests
+        """
+        if self._orders is None:
+            self._orders = (
+                np.argsort(-self.earnings_yield, kind='stable'),
+                np.argsort(-self.return_on_capital, kind='stable')
+            )
+        return self._orders
+
+    def threshold_index(self) -> 'ThresholdIndex':
+        """Sorted per-metric index for threshold filters, built once per instance"""
+        if self._threshold_index is None:
+            self._threshold_index = ThresholdIndex(self)
+        return self._threshold_index
+
+    def excluded_sector_codes(self, excluded_sectors: Iterable[str]) -> List[int]:
+        excluded = set(excluded_sectors)
+        return [code for code, sector in enumerate(self.sectors) if sector in excluded]
+
+    def excluded_sector_mask(self, excluded_sectors: Iterable[str]) -> np.ndarray:
+        """Boolean mask of rows whose sector is in excluded_sectors"""
+        return np.isin(self.sector_codes, self.excluded_sector_codes(excluded_sectors))
+
+
+class ThresholdIndex:
+    """
+    Per-metric sorted values + permutation over one RankingColumns instance
+
+    Every Magic Formula filter is "metric >= threshold" (EBIT: > 0), i.e. a suffix
+    of the ascending order: binary search finds it, the most selective suffix
+    becomes the candidate set and the other thresholds are only tested on it
+    NaN (missing) values sort last and never match
+    """
+
+    FIELDS = ('ebit', 'market_cap', 'earnings_yield', 'return_on_capital')
+
+    def __init__(self, columns: RankingColumns):
+        self.columns = columns
+        self._sorted: Dict[str, Tuple[np.ndarray, np.ndarray, int]] = {}
+        for field in self.FIELDS:
+            values = getattr(columns, field)
+            permutation = np.argsort(values, kind='stable')
+            ordered = values[permutation]
+            valid = len(ordered) - int(np.count_nonzero(np.isnan(ordered)))
+            self._sorted[field] = (ordered, permutation, valid)
+
+    def suffix(self, field: str, minimum: float, strict: bool = False) -> np.ndarray:
+        """Rows with value >= minimum (> when strict), in ascending value order"""
+        ordered, permutation, valid = self._sorted[field]
+        start = np.searchsorted(ordered[:valid], minimum, side='right' if strict else 'left')
+        return permutation[start:valid]
+
+    def candidates(
+        self,
+        min_earnings_yield: float,
+        min_return_on_capital: float,
+        min_market_cap: float,
+        excluded_sectors: Iterable[str]
+    ) -> np.ndarray:
+        """
+        Row positions passing the Magic Formula criteria, ascending (same rows as filter_mask)
+        Cost is O(log n) per metric plus O(k) in the most selective suffix
+        """
+        columns = self.columns
+        conditions = [
+            ('ebit', 0.0, True),
+            ('market_cap', min_market_cap, False),
+            ('earnings_yield', min_earnings_yield, False),
+            ('return_on_capital', min_return_on_capital, False),
+        ]
+        suffixes = [self.suffix(field, minimum, strict) for field, minimum, strict in conditions]
+        narrowest = min(range(len(suffixes)), key=lambda i: len(suffixes[i]))
+        rows = suffixes[narrowest]
+
+        # Intersect with the remaining thresholds by probing the candidate rows only
+        for i, (field, minimum, strict) in enumerate(conditions):
+            if i == narrowest or not len(rows):
+                continue
+            values = getattr(columns, field)[rows]
+            rows = rows[values > minimum] if strict else rows[values >= minimum]
+        rows = rows[~np.isin(columns.sector_codes[rows], columns.excluded_sector_codes(excluded_sectors))]
+        return np.sort(rows)
+
+
+class RankResult:
+    """
+    Ranked subset of a RankingColumns instance, best stock first
+
+    positions[i] is the row (in the source columns) of the stock with final rank i + 1
+    """
+
+    __slots__ = ('positions', 'ey_rank', 'roc_rank', 'score', 'total_ranked')
+
+    def __init__(self, positions: np.ndarray, ey_rank: np.ndarray, roc_rank: np.ndarray,
+                 score: np.ndarray, total_ranked: int):
+        self.positions = positions
+        self.ey_rank = ey_rank
+        self.roc_rank = roc_rank
+        self.score = score
+        self.total_ranked = total_ranked
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def after(self, offset: int) -> 'RankResult':
+        """Rows ranked below offset (keyset page start) - the first returned row has rank offset + 1"""
+        return RankResult(
+            positions=self.positions[offset:],
+            ey_rank=self.ey_rank[offset:],
+            roc_rank=self.roc_rank[offset:],
+            score=self.score[offset:],
+            total_ranked=self.total_ranked
+        )
+
+    def iter_ranked(self, start_rank: int = 1):
+        """Yield (position, ey_rank, roc_rank, score, rank) as plain Python ints"""
+        for offset, (pos, ey, roc, score) in enumerate(zip(
+            self.positions.tolist(), self.ey_rank.tolist(), self.roc_rank.tolist(), self.score.tolist()
+        )):
+            yield pos, ey, roc, score, start_rank + offset
+
+
+def filter_mask(
+    columns: RankingColumns,
+    min_earnings_yield: float,
+    min_return_on_capital: float,
+    min_market_cap: float,
+    excluded_sectors: Iterable[str]
+) -> np.ndarray:
+    """
+    Magic Formula criteria as a boolean mask (same rules as _filter_stocks)
+
+    1. EBIT > 0
+    2. Market cap >= min_market_cap
+    3. Earnings yield >= min
+    4. Return on capital >= min
+    5. Not in excluded sectors
+    """
+    mask = columns.ebit > 0
+    mask &= columns.market_cap >= min_market_cap
+    mask &= columns.earnings_yield >= min_earnings_yield
+    mask &= columns.return_on_capital >= min_return_on_capital
+    mask &= ~columns.excluded_sector_mask(excluded_sectors)
+    return mask
+
+
+def ordinal_rank_desc(values: np.ndarray) -> np.ndarray:
+    """
+    1-based ordinal ranks, highest value first
+
+    Ties keep row order, matching sorted(..., reverse=True) which is stable
+    """
+    order = np.argsort(-values, kind='stable')
+    ranks = np.empty(len(values), dtype=np.int64)
+    ranks[order] = np.arange(1, len(values) + 1, dtype=np.int64)
+    return ranks
+
+
+def top_n_by_score(score: np.ndarray, top_n: Optional[int]) -> np.ndarray:
+    """
+    Indices of the top_n lowest scores, ascending, ties broken by row order
+
+    Uses argpartition so only the selected rows get fully sorted
+    """
+    count = len(score)
+    # Unique integer key: score first, then row order (stable tie-break)
+    key = score * count + np.arange(count, dtype=np.int64)
+    if top_n is not None and top_n <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_n is not None and top_n < count:
+        selected = np.argpartition(key, top_n - 1)[:top_n]
+        return selected[np.argsort(key[selected])]
+    return np.argsort(key)
+
+
+def rank_columns(
+    columns: RankingColumns,
+    mask: Optional[np.ndarray] = None,
+    top_n: Optional[int] = None
+) -> RankResult:
+    """
+    Rank the rows selected by mask using the Magic Formula method
+
+    1. Rank by Earnings Yield (descending)
+    2. Rank by Return on Capital (descending)
+    3. Combined score = sum of both ranks
+    4. Order by combined score (ascending), keep top_n
+    """
+    candidates = np.flatnonzero(mask) if mask is not None else np.arange(len(columns))
+    return rank_candidates(columns, candidates, top_n)
+
+
+def rank_candidates(
+    columns: RankingColumns,
+    candidates: np.ndarray,
+    top_n: Optional[int] = None
+) -> RankResult:
+    """rank_columns over an ascending array of row positions instead of a mask"""
+    ey_rank = ordinal_rank_desc(columns.earnings_yield[candidates])
+    roc_rank = ordinal_rank_desc(columns.return_on_capital[candidates])
+    score = ey_rank + roc_rank
+    order = top_n_by_score(score, top_n)
+
+    return RankResult(
+        positions=candidates[order],
+        ey_rank=ey_rank[order],
+        roc_rank=roc_rank[order],
+        score=score[order],
+        total_ranked=len(candidates)
+    )
+
+
+def rank_presorted(
+    columns: RankingColumns,
+    mask: np.ndarray,
+    top_n: Optional[int] = None
+) -> RankResult:
+    """
+    Same result as rank_columns(columns, mask, top_n), reusing columns.sort_orders()
+
+    Restricting the global orders to the masked rows keeps their relative order,
+    so per-mask ranks cost one O(n) pass instead of two sorts
+    """
+    candidates = np.flatnonzero(mask)
+    ranks = []
+    for order in columns.sort_orders():
+        selected = order[mask[order]]
+        by_row = np.empty(len(columns), dtype=np.int64)
+        by_row[selected] = np.arange(1, len(selected) + 1, dtype=np.int64)
+        ranks.append(by_row[candidates])
+    ey_rank, roc_rank = ranks
+    score = ey_rank + roc_rank
+    order = top_n_by_score(score, top_n)
+
+    return RankResult(
+        positions=candidates[order],
+        ey_rank=ey_rank[order],
+        roc_rank=roc_rank[order],
+        score=score[order],
+        total_ranked=len(candidates)
+    )
@@ -0,0 +1,221 @@
+"""
+Per-Provider Token-Bucket Rate Limiter
+Replaces the fixed sleeps in the fetchers: a call waits only as long as its
+provider's quota actually requires, and a throttled provider never holds up
+another one that still has budget
+
+Each provider owns one bucket per window (minute / hour / day). A bucket
+refills continuously at limit / window, so bursts up to the limit are allowed
+and the long-run rate never exceeds it. A limit of 0 disables that window.
+"""
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60.0
+HOUR = 3600.0
+DAY = 86400.0
+
+
+class BudgetExhausted(Exception):
+    """
+    A fetch was not attempted because its providers are out of budget
+    Not a data failure - retry once one of `providers` ({name: calls}) has budget again
+    """
+
+    def __init__(self, providers: Dict[str, int]):
+        super().__init__(f"out of budget: {', '.join(providers)}")
+        self.providers = providers
+
+
+class TokenBucket:
+    """Continuously refilled bucket of `capacity` tokens per `period` seconds"""
+
+    __slots__ = ('capacity', 'period', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity: int, period: float, now: float):
+        self.capacity = float(capacity)
+        self.period = period
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, tokens: int, now: float) -> float:
+        """Seconds until `tokens` are available (0 when they already are)"""
+        self.refill(now)
+        # A cost above the capacity can never be met in one go - wait for a full bucket
+        missing = min(float(tokens), self.capacity) - self.tokens
+        return max(missing / self.rate, 0.0)
+
+    def consume(self, tokens: int):
+        self.tokens -= min(float(tokens), self.capacity)
+
+
+class ProviderLimiter:
+    """
+    Minute / hour / day budgets of one data provider
+    Waiters are served one at a time (FIFO) so a burst cannot overdraw the buckets
+    """
+
+    def __init__(
+        self,
+        name: str,
+        per_minute: int = 0,
+        per_hour: int = 0,
+        per_day: int = 0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.clock = clock
+        now = clock()
+        self.buckets: Dict[str, TokenBucket] = {
+            window: TokenBucket(limit, period, now)
+            for window, limit, period in (
+                ('minute', per_minute, MINUTE),
+                ('hour', per_hour, HOUR),
+                ('day', per_day, DAY),
+            )
+            if limit and limit > 0
+        }
+        self._lock: Optional[asyncio.Lock] = None
+        self.granted = 0
+        self.rejected = 0
+        self.waited_seconds = 0.0
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def delay(self, tokens: int = 1) -> float:
+        """Seconds until `tokens` calls fit every window"""
+        now = self.clock()
+        return max((bucket.delay(tokens, now) for bucket in self.buckets.values()), default=0.0)
+
+    async def _lock_within(self, timeout: Optional[float]) -> bool:
+        """Take the lock, giving up after `timeout` seconds (None = no limit)"""
+        if timeout is None or (timeout <= 0 and not self.lock.locked()):
+            await self.lock.acquire()
+            return True
+        try:
+            await asyncio.wait_for(self.lock.acquire(), timeout=max(timeout, 0.0))
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def acquire(self, tokens: int = 1, max_wait: Optional[float] = None) -> bool:
+        """
+        Wait until `tokens` calls are allowed, then take them
+        Returns False (taking nothing) when that would mean waiting longer than max_wait,
+        counting the time spent queued behind other callers
+        """
+        deadline = None if max_wait is None else self.clock() + max_wait
+        if not await self._lock_within(max_wait):
+            self.rejected += 1
+            return False
+        try:
+            while True:
+                wait = self.delay(tokens)
+                if wait <= 0:
+                    for bucket in self.buckets.values():
+                        bucket.consume(tokens)
+                    self.granted += tokens
+                    return True
+                if deadline is not None and wait > deadline - self.clock():
+                    self.rejected += 1
+                    return False
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+        finally:
+            self.lock.release()
+
+    def get_stats(self) -> Dict:
+        now = self.clock()
+        windows = {}
+        for window, bucket in self.buckets.items():
+            bucket.refill(now)
+            windows[window] = {"limit": int(bucket.capacity), "available": round(bucket.tokens, 2)}
+        return {
+            "windows": windows,
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "waited_seconds": round(self.waited_seconds, 1)
+        }
+
+
+class RateLimiter:
+    """Registry of ProviderLimiter keyed by provider name"""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.providers: Dict[str, ProviderLimiter] = {}
+
+    def configure(self, name: str, per_minute: int = 0, per_hour: int = 0, per_day: int = 0) -> ProviderLimiter:
+        limiter = ProviderLimiter(name, per_minute, per_hour, per_day, clock=self.clock)
+        self.providers[name] = limiter
+        logger.info(f"🚦 Rate limits for {name}: {per_minute}/min, {per_hour}/hour, {per_day}/day (0 = unlimited)")
+        return limiter
+
+    def get(self, name: str) -> ProviderLimiter:
+        """Limiter of a provider - unknown providers are unlimited"""
+        limiter = self.providers.get(name)
+        if limiter is None:
+            limiter = self.providers[name] = ProviderLimiter(name, clock=self.clock)
+        return limiter
+
+    async def acquire(self, name: str, tokens: int = 1, max_wait: Optional[float] = None) -> bool:
+        return await self.get(name).acquire(tokens, max_wait)
+
+    async def wait_for_any(self, costs: Dict[str, int]) -> Optional[str]:
+        """
+        Sleep until at least one of the providers could take its cost, without taking it
+        Returns that provider (None when costs is empty)
+        """
+        if not costs:
+            return None
+        while True:
+            wait, name = min((self.get(name).delay(tokens), name) for name, tokens in costs.items())
+            if wait <= 0:
+                return name
+            logger.info(f"⏳ Every provider is out of budget - next one ({name}) in {wait:.0f}s")
+            await asyncio.sleep(wait)
+
+    def get_stats(self) -> Dict:
+        return {name: limiter.get_stats() for name, limiter in self.providers.items()}
+
+
+def build_rate_limiter() -> RateLimiter:
+    limiter = RateLimiter()
+    limiter.configure(
+        'polygon',
+        per_minute=settings.POLYGON_RATE_LIMIT_PER_MINUTE,
+        per_hour=settings.POLYGON_RATE_LIMIT,
+        per_day=settings.POLYGON_RATE_LIMIT_PER_DAY
+    )
+    limiter.configure(
+        'alpha_vantage',
+        per_minute=settings.ALPHA_VANTAGE_RATE_LIMIT_PER_MINUTE,
+        per_hour=settings.ALPHA_VANTAGE_RATE_LIMIT,
+        per_day=settings.ALPHA_VANTAGE_RATE_LIMIT_PER_DAY
+    )
+    limiter.configure(
+        'yfinance',
+        per_minute=settings.YFINANCE_RATE_LIMIT_PER_MINUTE,
+        per_hour=settings.YFINANCE_RATE_LIMIT,
+        per_day=settings.YFINANCE_RATE_LIMIT_PER_DAY
+    )
+    return limiter
+
+
+# Global instance
+rate_limiter = build_rate_limiter()
@@ -4,12 +4,14 @@ Fetches stock data using multi-source fallback strategy
 """
 import yfinance as yf
 import pandas as pd
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set
 import logging
 import asyncio
 import aiohttp
 import time
+from .http_client import http_client
 from .multi_source_fetcher import MultiSourceFetcher
+from .rate_limiter import BudgetExhausted
 
 logger = logging.getLogger(__name__)
 
@@ -18,15 +20,13 @@ class StockDataService:
     
     def __init__(self):
         self._sp500_symbols = None
-        self.max_concurrent_requests = 1
-        self.request_delay = 3.0
+        self.max_concurrent_requests = 5  # throughput is bounded by the per-provider rate limiter
         self.batch_size = 100
-        self.batch_break = 300
         self.multi_source = MultiSourceFetcher()
         self.source_rotation_index = 0
         self.sources = ['yfinance', 'alpha_vantage', 'polygon', 'wikipedia']
         
-        logger.info("Stock Data Service initialized: 20 stocks/min, 100/batch, 5min breaks")
+        logger.info("Stock Data Service initialized: 100/batch, paced by the per-provider rate limiter")
     
     def get_all_market_symbols(self) -> List[str]:
         """Get S&P 500 + NASDAQ 100 + Dow 30 symbols"""
@@ -105,18 +105,41 @@ class StockDataService:
             return []
     
     async def fetch_stock_data_async(self, symbol: str, year: int, semaphore: asyncio.Semaphore, session: aiohttp.ClientSession) -> Optional[Dict]:
-        """Fetch single stock with rate limiting"""
+        """Fetch single stock - each source call waits on its provider's rate limit"""
         async with semaphore:
             try:
-                stock_data = await self.multi_source.fetch_stock_data(symbol, year, session)
-                await asyncio.sleep(self.request_delay)
-                return stock_data
+                return await self.multi_source.fetch_stock_data(symbol, year, session)
+            except BudgetExhausted:
+                raise
             except Exception as e:
                 logger.error(f"Failed to fetch {symbol}: {e}")
                 return None
     
-    async def fetch_multiple_stocks_async(self, symbols: List[str], year: int, limit: Optional[int] = None) -> List[Dict]:
-        """Fetch multiple stocks in batches with breaks"""
+    async def fetch_one_stock_async(self, symbol: str, year: int) -> Optional[Dict]:
+        """
+        One symbol and year from the multi-source chain on the shared session
+        Raises BudgetExhausted when the providers it needs are out of budget
+        """
+        session = await http_client.get_session()
+        return await self.multi_source.fetch_stock_data(symbol, year, session)
+    
+    async def fetch_symbol_years_async(self, symbol: str, years: List[int]) -> Optional[Dict[int, Dict]]:
+        """
+        Every requested year of one symbol from a single Polygon financials call
+        Returns {year: stock_data} or None when Polygon could not be asked;
+        raises BudgetExhausted when Polygon is out of budget
+        """
+        session = await http_client.get_session()
+        return await self.multi_source.fetch_polygon_years(symbol, years, session)
+    
+    async def fetch_multiple_stocks_async(
+        self, symbols: List[str], year: int, limit: Optional[int] = None, deferred: Optional[Set[str]] = None
+    ) -> List[Dict]:
+        """
+        Fetch multiple stocks in batches (progress logged per batch)
+        Symbols skipped because their providers were out of budget are added to
+        `deferred` - they were not attempted, so callers must not count them as failed
+        """
         if limit:
             symbols = symbols[:limit]
         
@@ -128,27 +151,26 @@ class StockDataService:
         all_results = []
         semaphore = asyncio.Semaphore(self.max_concurrent_requests)
         
-        async with aiohttp.ClientSession() as session:
-            for batch_num in range(0, total_symbols, BATCH_SIZE):
-                batch_symbols = symbols[batch_num:batch_num + BATCH_SIZE]
-                batch_end = min(batch_num + BATCH_SIZE, total_symbols)
-                
-                logger.info(f"Processing batch {batch_num//BATCH_SIZE + 1}: stocks {batch_num + 1}-{batch_end}")
-                
-                tasks = [self.fetch_stock_data_async(symbol, year, semaphore, session) for symbol in batch_symbols]
-                batch_results = await asyncio.gather(*tasks, return_exceptions=True)
-                all_results.extend(batch_results)
-                
-                batch_success = sum(1 for r in batch_results if r is not None and not isinstance(r, Exception))
-                logger.info(f"Batch complete: {batch_success}/{len(batch_symbols)} successful")
-                
-                if batch_end < total_symbols:
-                    logger.info(f"Taking {self.batch_break}s break...")
-                    await asyncio.sleep(self.batch_break)
+        session = await http_client.get_session()
+        
+        for batch_num in range(0, total_symbols, BATCH_SIZE):
+            batch_symbols = symbols[batch_num:batch_num + BATCH_SIZE]
+            batch_end = min(batch_num + BATCH_SIZE, total_symbols)
+            
+            logger.info(f"Processing batch {batch_num//BATCH_SIZE + 1}: stocks {batch_num + 1}-{batch_end}")
+            
+            tasks = [self.fetch_stock_data_async(symbol, year, semaphore, session) for symbol in batch_symbols]
+            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
+            all_results.extend(batch_results)
             
-            results = all_results
+            batch_success = sum(1 for r in batch_results if r is not None and not isinstance(r, Exception))
+            batch_deferred = [symbol for symbol, r in zip(batch_symbols, batch_results) if isinstance(r, BudgetExhausted)]
+            if deferred is not None:
+                deferred.update(batch_deferred)
+            logger.info(f"Batch complete: {batch_success}/{len(batch_symbols)} successful"
+                        f"{f', {len(batch_deferred)} deferred (out of budget)' if batch_deferred else ''}")
         
-        valid_results = [r for r in results if r is not None and not isinstance(r, Exception)]
+        valid_results = [r for r in all_results if r is not None and not isinstance(r, Exception)]
         total_time = time.time() - start_time
         logger.info(f"Complete! {len(valid_results)}/{len(symbols)} successful in {total_time/60:.1f} min")
         
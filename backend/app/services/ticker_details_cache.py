@@ -0,0 +1,81 @@
+"""
+Polygon Ticker Details Cache
+Company name, SIC description and share count barely change, so
+v3/reference/tickers/{symbol} is asked at most once per refresh age per symbol,
+shared by every fetcher (continuous fetcher, multi-source fallback, stock info fetcher)
+
+Entries live in Redis (polygon:ticker_details:<SYMBOL>, expiring after
+TICKER_DETAILS_MAX_AGE_SECONDS) so all workers share them; without Redis a
+per-process dict with the same max age is used. market_cap comes with the
+details, so the refresh age also bounds how stale it may get.
+"""
+import json
+import logging
+import time
+from typing import Callable, Dict, Optional, Tuple
+from app.core.config import settings
+from app.services.cache_service import cache_service
+
+logger = logging.getLogger(__name__)
+
+
+class TickerDetailsCache:
+    """TTL'd Polygon ticker details keyed by symbol"""
+
+    def __init__(self, max_age: float = settings.TICKER_DETAILS_MAX_AGE_SECONDS, clock: Callable[[], float] = time.time):
+        self.max_age = max_age
+        self.clock = clock
+        self._local: Dict[str, Tuple[float, Dict]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(symbol: str) -> str:
+        return f"polygon:ticker_details:{symbol.upper()}"
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        """Cached details younger than the refresh age, or None"""
+        if self.max_age <= 0:
+            return None
+        details = None
+        if cache_service.redis:
+            try:
+                data = cache_service.redis.get(self._key(symbol))
+                details = json.loads(data) if data else None
+            except Exception as e:
+                logger.error(f"Ticker details cache read error: {e}")
+        else:
+            entry = self._local.get(symbol.upper())
+            if entry and self.clock() - entry[0] < self.max_age:
+                details = dict(entry[1])
+        if details is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return details
+
+    def set(self, symbol: str, details: Dict):
+        if self.max_age <= 0:
+            return
+        if cache_service.redis:
+            try:
+                cache_service.redis.setex(self._key(symbol), int(self.max_age), json.dumps(details))
+            except Exception as e:
+                logger.error(f"Ticker details cache write error: {e}")
+        else:
+            self._local[symbol.upper()] = (self.clock(), dict(details))
+
+    def clear(self):
+        self._local.clear()
+
+    def get_stats(self) -> Dict:
+        return {
+            "backend": "redis" if cache_service.redis else "memory",
+            "max_age_seconds": self.max_age,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Global instance
+ticker_details_cache = TickerDetailsCache()
@@ -0,0 +1,4 @@
+"""
+Benchmarks for Stock Analysis Backend
+Run from backend/: python -m benchmarks.<module>
+"""
@@ -0,0 +1,94 @@
+"""
+Benchmark: incremental rank index ingest vs full re-rank of the period
+
+Worst case for the index: every write is a new stock at the top of both
+orderings, shifting the EY and ROC rank (and score) of every ranked stock
+
+Usage (from backend/):
+    python -m benchmarks.bench_rank_index --stocks 11000 --writes 500
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.rank_index import PeriodRankIndex
+from app.services.ranking_engine import RankingColumns, filter_mask, rank_columns
+from benchmarks.bench_ranking import make_stocks
+
+
+def build(args, columns, eligible) -> PeriodRankIndex:
+    return PeriodRankIndex.build(
+        (args.stocks, None), np.arange(1, args.stocks + 1, dtype=np.int64),
+        columns.earnings_yield, columns.return_on_capital, eligible
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stocks', type=int, default=11000)
+    parser.add_argument('--writes', type=int, default=500)
+    parser.add_argument('--top-n', type=int, default=50)
+    args = parser.parse_args()
+
+    stocks = make_stocks(args.stocks)
+    columns = RankingColumns.from_records(stocks)
+    eligible = filter_mask(columns, 0.0, 0.0, settings.MIN_MARKET_CAP, settings.EXCLUDED_SECTORS)
+
+    start = time.perf_counter()
+    index = build(args, columns, eligible)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # New stocks above every existing one: each write shifts all ranks
+    best_ey = float(np.nanmax(columns.earnings_yield))
+    best_roc = float(np.nanmax(columns.return_on_capital))
+    writes = [
+        (args.stocks + i + 1, best_ey + i + 1, best_roc + i + 1)
+        for i in range(args.writes)
+    ]
+    middle = args.stocks // 2
+
+    # Ingest only (amortized RANK_INDEX_REBASE_WRITES re-reads included)
+    start = time.perf_counter()
+    for stock_id, ey, roc in writes:
+        index.upsert(stock_id, ey, roc, True, datetime.utcnow())
+    upsert_us = (time.perf_counter() - start) / args.writes * 1e6
+
+    # Ingest + top-N read + mid-table rank lookup after each write
+    index = build(args, columns, eligible)
+    start = time.perf_counter()
+    for stock_id, ey, roc in writes:
+        index.upsert(stock_id, ey, roc, True, datetime.utcnow())
+        index.top(args.top_n)
+        index.rank_of(middle)
+    upsert_read_ms = (time.perf_counter() - start) / args.writes * 1000
+
+    # Read between writes at the largest drift (one write short of a re-read)
+    index = build(args, columns, eligible)
+    for stock_id, ey, roc in writes[:settings.RANK_INDEX_REBASE_WRITES - 1]:
+        index.upsert(stock_id, ey, roc, True, datetime.utcnow())
+    start = time.perf_counter()
+    for _ in range(args.writes):
+        index.top(args.top_n)
+    read_us = (time.perf_counter() - start) / args.writes * 1e6
+
+    # Baseline: full filter + re-rank of the period on every read
+    start = time.perf_counter()
+    for _ in range(args.writes):
+        rank_columns(columns, filter_mask(
+            columns, 0.0, 0.0, settings.MIN_MARKET_CAP, settings.EXCLUDED_SECTORS
+        ), top_n=args.top_n)
+    rerank_ms = (time.perf_counter() - start) / args.writes * 1000
+
+    print(f"Stocks: {args.stocks:,}  ranked: {len(index):,}  writes at the top: {args.writes}")
+    print(f"  index build (once):                 {build_ms:8.2f} ms")
+    print(f"  upsert per committed row:           {upsert_us:8.2f} us")
+    print(f"  upsert + top-N + rank_of:           {upsert_read_ms:8.3f} ms")
+    print(f"  top-N read at maximum drift:        {read_us:8.2f} us")
+    print(f"  full filter + re-rank per read:     {rerank_ms:8.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark: dict ranking path vs columnar NumPy ranking engine
+
+Usage (from backend/):
+    python -m benchmarks.bench_ranking --stocks 11000 --top-n 50 --repeat 20
+"""
+import argparse
+import copy
+import random
+import time
+from typing import List, Dict
+
+from app.core.config import settings
+from app.services.dynamic_magic_formula import DynamicMagicFormulaService
+from app.services.ranking_engine import RankingColumns, filter_mask, rank_candidates, rank_columns
+
+SECTORS = ['Technology', 'Healthcare', 'Industrials', 'Consumer Cyclical', 'Energy',
+           'Financial Services', 'Utilities', 'Basic Materials', None]
+
+
+def make_stocks(count: int, seed: int = 42) -> List[Dict]:
+    """Synthetic period with realistic spread, plenty of ties and some filtered rows"""
+    rng = random.Random(seed)
+    stocks = []
+    for i in range(count):
+        stocks.append({
+            'symbol': f"S{i:05d}",
+            'company_name': f"Company {i}",
+            'sector': rng.choice(SECTORS),
+            'year': 2024,
+            'month': None,
+            'ebit': rng.uniform(-5e8, 5e9),
+            'enterprise_value': rng.uniform(1e8, 1e11),
+            'tangible_capital': rng.uniform(1e8, 5e10),
+            'earnings_yield': round(rng.uniform(-5, 40), 1),
+            'return_on_capital': round(rng.uniform(-10, 120), 1),
+            'market_cap': rng.uniform(1e8, 5e11),
+            'current_price': rng.uniform(5, 500),
+            'data_source': 'polygon',
+            'updated_at': None
+        })
+    return stocks
+
+
+def run_dict_path(service: DynamicMagicFormulaService, stocks: List[Dict], top_n: int) -> List[str]:
+    filtered = service._filter_stocks(
+        stocks, min_earnings_yield=0.0, min_return_on_capital=0.0, min_market_cap=settings.MIN_MARKET_CAP
+    )
+    return [s['symbol'] for s in service._rank_stocks(filtered)[:top_n]]
+
+
+def run_columnar_path(stocks: List[Dict], top_n: int) -> List[str]:
+    columns = RankingColumns.from_records(stocks)
+    mask = filter_mask(columns, 0.0, 0.0, settings.MIN_MARKET_CAP, settings.EXCLUDED_SECTORS)
+    ranked = rank_columns(columns, mask, top_n=top_n)
+    return [stocks[pos]['symbol'] for pos in ranked.positions.tolist()]
+
+
+def timed(fn, repeat: int) -> float:
+    """Best-of-N wall time in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stocks', type=int, default=11000)
+    parser.add_argument('--top-n', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    service = DynamicMagicFormulaService()
+    stocks = make_stocks(args.stocks)
+
+    # The dict path mutates its input, so every run gets a fresh copy
+    dict_result = run_dict_path(service, copy.deepcopy(stocks), args.top_n)
+    columnar_result = run_columnar_path(stocks, args.top_n)
+    assert dict_result == columnar_result, "Columnar ranking diverged from the dict path"
+
+    copies = [copy.deepcopy(stocks) for _ in range(args.repeat)]
+    dict_ms = timed(lambda: run_dict_path(service, copies.pop(), args.top_n), args.repeat)
+    columnar_ms = timed(lambda: run_columnar_path(stocks, args.top_n), args.repeat)
+
+    columns = RankingColumns.from_records(stocks)
+    kernel_ms = timed(lambda: rank_columns(
+        columns, filter_mask(columns, 0.0, 0.0, settings.MIN_MARKET_CAP, settings.EXCLUDED_SECTORS), top_n=args.top_n
+    ), args.repeat)
+
+    # Selective quant filter: full-scan mask vs sorted threshold index
+    selective = (35.0, 100.0, 1e11)
+    index = columns.threshold_index()
+    scan_ms = timed(lambda: rank_columns(
+        columns, filter_mask(columns, *selective, settings.EXCLUDED_SECTORS), top_n=args.top_n
+    ), args.repeat)
+    index_ms = timed(lambda: rank_candidates(
+        columns, index.candidates(*selective, settings.EXCLUDED_SECTORS), top_n=args.top_n
+    ), args.repeat)
+    matches = len(index.candidates(*selective, settings.EXCLUDED_SECTORS))
+
+    print(f"Stocks: {args.stocks:,}  top_n: {args.top_n}  repeat: {args.repeat} (best of)")
+    print(f"  dict path (_filter_stocks + _rank_stocks): {dict_ms:8.2f} ms")
+    print(f"  columnar (incl. dict -> columns):          {columnar_ms:8.2f} ms  ({dict_ms / columnar_ms:.1f}x)")
+    print(f"  columnar kernel only:                      {kernel_ms:8.2f} ms  ({dict_ms / kernel_ms:.1f}x)")
+    print(f"  selective filter, full-scan mask:          {scan_ms:8.3f} ms  ({matches} matches)")
+    print(f"  selective filter, threshold index:         {index_ms:8.3f} ms  ({scan_ms / index_ms:.1f}x)")
+    print("  ordering: identical")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Stock Data Transfer - Parquet export / import CLI
+Seed or move stock_data between environments in one step
+
+Usage:
+    python stock_data_transfer.py export --years 2017-2024 --out ./stock_data
+    python stock_data_transfer.py export --years 2024 --month 3 --out ./stock_data
+    python stock_data_transfer.py import ./stock_data
+"""
+import argparse
+import logging
+import sys
+from app.core.periods import parse_years
+from app.models.database import SessionLocal, init_db
+from app.services.parquet_transfer import parquet_transfer_service
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+logger = logging.getLogger(__name__)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Parquet export / import of stock_data")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Write periods to a Parquet dataset (one partition per year)")
+    export.add_argument("--years", required=True, help="e.g. 2017-2024 or 2017,2019")
+    export.add_argument("--month", type=int, choices=range(1, 13), help="Only this month of each year")
+    export.add_argument("--out", required=True, help="Dataset directory")
+
+    load = commands.add_parser("import", help="Upsert a Parquet dataset into stock_data")
+    load.add_argument("source", help="Dataset directory written by export")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        try:
+            years = parse_years(args.years)
+        except ValueError as e:
+            parser.error(str(e))
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.command == "export":
+            result = parquet_transfer_service.export(db, years, args.out, month=args.month)
+            logger.info(f"✅ {result['rows']} rows written for years {result['years']}")
+        else:
+            result = parquet_transfer_service.import_dataset(db, args.source)
+            logger.info(f"✅ {result['inserted']} inserted, {result['updated']} updated "
+                        f"across {len(result['periods'])} periods")
+    except Exception as e:
+        logger.error(f"❌ Transfer failed: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
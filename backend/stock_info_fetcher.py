@@ -14,6 +14,8 @@ from pymongo import MongoClient
 from typing import Optional, Dict
 import sys
 import os
+from app.services.http_client import http_client
+from app.services.ticker_details_cache import ticker_details_cache
 
 # Configure logging
 logging.basicConfig(
@@ -39,41 +41,41 @@ async def fetch_all_stock_symbols(api_key: str) -> list:
     symbols = []
     next_url = f"https://api.polygon.io/v3/reference/tickers?market=stocks&active=true&limit=1000&apiKey={api_key}"
     
-    async with aiohttp.ClientSession() as session:
-        page = 1
-        while next_url:
-            try:
-                logger.info(f"   Page {page}...")
-                async with session.get(next_url) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        
-                        # Extract symbols from results
-                        if 'results' in data:
-                            page_symbols = [ticker['ticker'] for ticker in data['results'] if 'ticker' in ticker]
-                            symbols.extend(page_symbols)
-                            logger.info(f"   Page {page}: +{len(page_symbols)} symbols (Total: {len(symbols)})")
-                        
-                        # Check for next page
-                        next_url = data.get('next_url')
-                        if next_url:
-                            # Add API key to next_url if not present
-                            if 'apiKey=' not in next_url:
-                                next_url = f"{next_url}&apiKey={api_key}"
-                            page += 1
-                            await asyncio.sleep(12.1)  # Rate limit: 5 calls/minute for free tier
-                        else:
-                            break
-                    elif response.status == 429:
-                        logger.warning(f"⚠️  Rate limited on page {page}, waiting 60 seconds...")
-                        await asyncio.sleep(60)
+    session = await http_client.get_session()
+    page = 1
+    while next_url:
+        try:
+            logger.info(f"   Page {page}...")
+            async with session.get(next_url) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    
+                    # Extract symbols from results
+                    if 'results' in data:
+                        page_symbols = [ticker['ticker'] for ticker in data['results'] if 'ticker' in ticker]
+                        symbols.extend(page_symbols)
+                        logger.info(f"   Page {page}: +{len(page_symbols)} symbols (Total: {len(symbols)})")
+                    
+                    # Check for next page
+                    next_url = data.get('next_url')
+                    if next_url:
+                        # Add API key to next_url if not present
+                        if 'apiKey=' not in next_url:
+                            next_url = f"{next_url}&apiKey={api_key}"
+                        page += 1
+                        await asyncio.sleep(12.1)  # Rate limit: 5 calls/minute for free tier
                     else:
-                        logger.error(f"❌ Failed to fetch symbols page {page}: HTTP {response.status}")
                         break
-                        
-            except Exception as e:
-                logger.error(f"❌ Error fetching symbols page {page}: {e}")
-                break
+                elif response.status == 429:
+                    logger.warning(f"⚠️  Rate limited on page {page}, waiting 60 seconds...")
+                    await asyncio.sleep(60)
+                else:
+                    logger.error(f"❌ Failed to fetch symbols page {page}: HTTP {response.status}")
+                    break
+                    
+        except Exception as e:
+            logger.error(f"❌ Error fetching symbols page {page}: {e}")
+            break
     
     logger.info(f"✅ Total symbols fetched: {len(symbols)}")
     return sorted(symbols)
@@ -97,13 +99,19 @@ class StockInfoFetcher:
         logger.info(f"✅ Connected to MongoDB: {MONGO_DB}.{MONGO_COLLECTION}")
     
     async def fetch_company_details(self, symbol: str, session: aiohttp.ClientSession) -> Optional[Dict]:
-        """Fetch company details from Polygon API"""
+        """Fetch company details from Polygon API (shared ticker details cache first)"""
+        cached = ticker_details_cache.get(symbol)
+        if cached is not None:
+            return cached
         try:
             url = f"https://api.polygon.io/v3/reference/tickers/{symbol}?apiKey={self.api_key}"
             async with session.get(url) as response:
                 if response.status == 200:
                     data = await response.json()
-                    return data.get('results', {})
+                    details = data.get('results', {})
+                    if details:
+                        ticker_details_cache.set(symbol, details)
+                    return details
                 else:
                     logger.warning(f"[{symbol}] Company details failed: HTTP {response.status}")
                     return None
@@ -140,51 +148,51 @@ class StockInfoFetcher:
     async def fetch_stock_info(self, symbol: str, year: int) -> bool:
         """Fetch complete stock information and store in MongoDB"""
         try:
-            async with aiohttp.ClientSession() as session:
-                # Fetch company details
-                company_data = await self.fetch_company_details(symbol, session)
-                if not company_data:
-                    logger.warning(f"❌ [{symbol}] No company data available")
-                    return False
-                
-                # Fetch financial data
-                financial_data = await self.fetch_financials(symbol, year, session)
-                if not financial_data:
-                    logger.warning(f"❌ [{symbol}] No financial data for year {year}")
-                    return False
-                
-                # Prepare document for MongoDB
-                document = {
-                    'symbol': symbol,
-                    'year': year,
-                    'month': None,  # Annual data
-                    'company_name': company_data.get('name', symbol),
-                    'company_details': company_data,  # Full company response
-                    'financial_data': financial_data,  # Full financial response
-                    'fiscal_year': financial_data.get('fiscal_year'),
-                    'fiscal_period': financial_data.get('fiscal_period'),
-                    'start_date': financial_data.get('start_date'),
-                    'end_date': financial_data.get('end_date'),
-                    'filing_date': financial_data.get('filing_date'),
-                    'source': 'polygon',
-                    'api_key_used': self.api_key[:10] + '...',  # Don't store full key
-                    'fetched_at': datetime.utcnow()
-                }
-                
-                # Upsert into MongoDB (insert or update if exists)
-                result = self.collection.update_one(
-                    {'symbol': symbol, 'year': year, 'month': None},
-                    {'$set': document},
-                    upsert=True
-                )
-                
-                if result.upserted_id:
-                    logger.info(f"✅ Inserted {symbol} ({year}) - New record")
-                else:
-                    logger.info(f"✅ Updated {symbol} ({year}) - Existing record")
-                
-                return True
-                
+            session = await http_client.get_session()
+            # Fetch company details
+            company_data = await self.fetch_company_details(symbol, session)
+            if not company_data:
+                logger.warning(f"❌ [{symbol}] No company data available")
+                return False
+            
+            # Fetch financial data
+            financial_data = await self.fetch_financials(symbol, year, session)
+            if not financial_data:
+                logger.warning(f"❌ [{symbol}] No financial data for year {year}")
+                return False
+            
+            # Prepare document for MongoDB
+            document = {
+                'symbol': symbol,
+                'year': year,
+                'month': None,  # Annual data
+                'company_name': company_data.get('name', symbol),
+                'company_details': company_data,  # Full company response
+                'financial_data': financial_data,  # Full financial response
+                'fiscal_year': financial_data.get('fiscal_year'),
+                'fiscal_period': financial_data.get('fiscal_period'),
+                'start_date': financial_data.get('start_date'),
+                'end_date': financial_data.get('end_date'),
+                'filing_date': financial_data.get('filing_date'),
+                'source': 'polygon',
+                'api_key_used': self.api_key[:10] + '...',  # Don't store full key
+                'fetched_at': datetime.utcnow()
+            }
+            
+            # Upsert into MongoDB (insert or update if exists)
+            result = self.collection.update_one(
+                {'symbol': symbol, 'year': year, 'month': None},
+                {'$set': document},
+                upsert=True
+            )
+            
+            if result.upserted_id:
+                logger.info(f"✅ Inserted {symbol} ({year}) - New record")
+            else:
+                logger.info(f"✅ Updated {symbol} ({year}) - Existing record")
+            
+            return True
+            
         except Exception as e:
             logger.error(f"❌ Error processing {symbol} ({year}): {e}")
             return False
@@ -273,6 +281,8 @@ async def main():
     except Exception as e:
         logger.error(f"❌ Fatal error: {e}")
         sys.exit(1)
+    finally:
+        await http_client.close()
 
 if __name__ == "__main__":
     print("""
@@ -0,0 +1,52 @@
+"""
+Shared test fixtures: stock_data row factory and in-memory SQLite sessions
+Test modules that need seeded data override `db` and build on this one
+"""
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.models.database import Base, StockData
+from app.services.period_snapshot_cache import period_snapshot_cache
+from app.services.rank_index import rank_index_registry
+
+
+def stock(symbol, year=2023, month=None, ebit=1.0, market_cap=2e9, ey=5.0, roc=10.0, sector='Technology', **fields):
+    """One stock_data row with passing defaults; any other column through **fields"""
+    values = dict(
+        symbol=symbol, company_name=symbol, sector=sector, year=year, month=month,
+        ebit=ebit, enterprise_value=10.0, tangible_capital=10.0, earnings_yield=ey,
+        return_on_capital=roc, market_cap=market_cap, current_price=1.0, data_source='polygon'
+    )
+    values.update(fields)
+    return StockData(**values)
+
+
+@pytest.fixture
+def new_session():
+    """Factory of independent empty in-memory databases, closed after the test"""
+    sessions = []
+
+    def make():
+        engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+        sessions.append(session)
+        return session
+
+    yield make
+    for session in sessions:
+        session.close()
+
+
+@pytest.fixture
+def db(new_session):
+    """Empty in-memory database; process-wide period caches start and end empty"""
+    period_snapshot_cache.clear()
+    rank_index_registry.clear()
+    try:
+        yield new_session()
+    finally:
+        period_snapshot_cache.clear()
+        rank_index_registry.clear()
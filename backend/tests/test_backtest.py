@@ -0,0 +1,144 @@
+"""
+Test for the vectorized Magic Formula backtest engine
+"""
+import pytest
+from datetime import datetime
+
+from app.core.config import settings
+from app.services.backtest import BacktestData, BacktestService, run_backtest
+from tests.conftest import stock
+
+
+def row(symbol, year, ey, roc, price, sector='Technology', ebit=1.0, market_cap=2e9):
+    return (symbol, year, ebit, market_cap, ey, roc, price, sector)
+
+
+@pytest.fixture
+def data():
+    """A and B always rank best; C is cheap but a utility; D has negative EBIT"""
+    rows = []
+    prices = {'A': [10, 11, 22, 11], 'B': [10, 9, 9, 18], 'C': [10, 50, 50, 50], 'D': [10, 20, 40, 80]}
+    for pos, year in enumerate(range(2020, 2024)):
+        rows += [
+            row('A', year, 9.0, 9.0, prices['A'][pos]),
+            row('B', year, 8.0, 8.0, prices['B'][pos]),
+            row('C', year, 20.0, 20.0, prices['C'][pos], sector='Utilities'),
+            row('D', year, 7.0, 7.0, prices['D'][pos], ebit=-1.0),
+        ]
+    return BacktestData.from_rows(rows, 2020, 2023)
+
+
+class TestBacktestEngine:
+    """Portfolio construction and performance metrics"""
+
+    def test_period_returns(self, data):
+        """Equal-weight returns of the two eligible stocks"""
+        result = run_backtest(data, top_n=2)
+        returns = [p['return'] for p in result['periods']]
+        assert returns == pytest.approx([0.0, 0.5, 0.25])
+        assert result['total_return'] == pytest.approx(0.875)
+        assert result['cagr'] == pytest.approx(1.875 ** (1 / 3) - 1)
+
+    def test_drawdown_and_turnover(self, data):
+        """Top 1 holds A only: +10%, +100%, -50%"""
+        result = run_backtest(data, top_n=1)
+        assert [p['return'] for p in result['periods']] == pytest.approx([0.1, 1.0, -0.5])
+        assert result['max_drawdown'] == pytest.approx(-0.5)
+        assert result['average_turnover'] == 0.0
+
+    def test_price_coverage(self, data):
+        """Every stored row of the fixture carries a price"""
+        assert run_backtest(data, top_n=2)['price_coverage'] == 1.0
+
+    def test_missing_price_left_out(self):
+        """A stock without next-year price does not count towards the mean"""
+        rows = [row('A', 2020, 9.0, 9.0, 10), row('B', 2020, 8.0, 8.0, 10), row('B', 2021, 8.0, 8.0, 12)]
+        result = run_backtest(BacktestData.from_rows(rows, 2020, 2021), top_n=2)
+        assert result['periods'][0]['holdings'] == 2
+        assert result['periods'][0]['priced_holdings'] == 1
+        assert result['periods'][0]['return'] == pytest.approx(0.2)
+
+    def test_unpriced_periods_are_not_flat(self):
+        """A middle and a last period without prices report no return instead of 0%"""
+        prices = {'A': [10, 12, None, None, None], 'B': [None, None, 20, 30, None]}
+        rows = [
+            row(symbol, year, ey, ey, prices[symbol][pos])
+            for pos, year in enumerate(range(2020, 2025)) for symbol, ey in (('A', 9.0), ('B', 8.0))
+        ]
+        result = run_backtest(BacktestData.from_rows(rows, 2020, 2024), top_n=2)
+        assert [p['year'] for p in result['periods']] == [2020, 2021, 2022]
+        assert [p['return'] for p in result['periods']] == [pytest.approx(0.2), None, pytest.approx(0.5)]
+        assert [p['equity'] for p in result['periods']] == [pytest.approx(1.2), None, pytest.approx(1.8)]
+        assert result['priced_periods'] == 2
+        assert result['total_return'] == pytest.approx(0.8)
+        assert result['cagr'] == pytest.approx(1.8 ** 0.5 - 1)
+
+    def test_too_few_priced_periods_has_no_cagr(self):
+        """One priced period is not enough to annualize; none at all reports no return"""
+        rows = [row('A', year, 9.0, 9.0, price) for year, price in ((2020, 10), (2021, 12), (2022, None))]
+        data = BacktestData.from_rows(rows, 2020, 2022)
+        assert run_backtest(data, top_n=1)['cagr'] is None
+
+        unpriced = run_backtest(BacktestData.from_rows([row('A', 2020, 9.0, 9.0, None), row('A', 2021, 9.0, 9.0, None)],
+                                                       2020, 2021), top_n=1)
+        assert unpriced['periods'] == []
+        assert unpriced['total_return'] is None and unpriced['cagr'] is None
+
+    def test_rebalance_every_keeps_holdings(self):
+        """Without a rebalance the previous portfolio is kept"""
+        rows = [
+            row('A', 2020, 9.0, 9.0, 10), row('B', 2020, 1.0, 1.0, 10),
+            row('A', 2021, 1.0, 1.0, 10), row('B', 2021, 9.0, 9.0, 20),
+            row('A', 2022, 1.0, 1.0, 10), row('B', 2022, 9.0, 9.0, 40),
+        ]
+        data = BacktestData.from_rows(rows, 2020, 2022)
+        yearly = run_backtest(data, top_n=1, rebalance_every=1)
+        held = run_backtest(data, top_n=1, rebalance_every=2)
+        assert [p['return'] for p in yearly['periods']] == pytest.approx([0.0, 1.0])
+        assert yearly['average_turnover'] == 1.0
+        assert [p['return'] for p in held['periods']] == pytest.approx([0.0, 0.0])
+
+
+class TestBacktestService:
+    """Database loading and sweeps"""
+
+    def test_sweep_pool_matches_inline(self, db, monkeypatch):
+        """Spawned pool results equal inline results, in input order, across several sweeps"""
+        db.add_all([
+            stock(f"S{i}", year, ey=float((i * 7 + year) % 13), roc=float((i * 3 + year) % 11),
+                  current_price=float(10 + (i * year) % 17), updated_at=datetime(year, 12, 31))
+            for i in range(30) for year in range(2018, 2023)
+        ])
+        db.commit()
+
+        combinations = [{"top_n": n, "rebalance_every": k} for n in (3, 5, 10) for k in (1, 2)]
+        service = BacktestService()
+        inline = service.sweep(db, 2018, 2022, combinations)
+        monkeypatch.setattr(settings, 'BACKTEST_POOL_THRESHOLD', 1)
+        service.start_pool(max_workers=2)
+        try:
+            pool = service._pool
+            assert service.sweep(db, 2018, 2022, combinations) == inline
+            assert service.sweep(db, 2018, 2022, combinations[:1]) == inline[:1]
+            assert service._pool is pool  # reused, not recreated per sweep
+        finally:
+            service.shutdown_pool()
+        assert [r['top_n'] for r in inline] == [3, 3, 5, 5, 10, 10]
+
+    def test_fetch_time_prices_outside_period_dropped(self, db):
+        """A current price stamped onto older years is not used as their period price"""
+        fetched = {2020: datetime(2024, 6, 1), 2021: datetime(2022, 2, 1), 2022: datetime(2022, 12, 31)}
+        db.add_all([
+            stock('A', year, ey=9.0, roc=9.0, current_price=price, updated_at=fetched[year])
+            for year, price in ((2020, 50.0), (2021, 10.0), (2022, 15.0))
+        ])
+        db.commit()
+
+        result = BacktestService().run(db, 2020, 2022, top_n=1)
+        assert [p['priced_holdings'] for p in result['periods']] == [0, 1]
+        assert result['periods'][1]['return'] == pytest.approx(0.5)
+        assert result['price_coverage'] == pytest.approx(2 / 3)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
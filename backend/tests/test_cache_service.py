@@ -0,0 +1,68 @@
+"""
+Test for generation-keyed result caching (in-memory stand-in for Redis)
+"""
+import json
+import pytest
+
+from app.core.config import settings
+from app.services.cache_service import CacheService
+
+FILTERS = {"min_earnings_yield": 0.0, "min_return_on_capital": 0.0, "min_market_cap": settings.MIN_MARKET_CAP}
+
+
+class FakeRedis:
+    """The handful of Redis commands CacheService uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key) or 0) + 1)
+
+    def pipeline(self):
+        return self
+
+    def execute(self):
+        return []
+
+
+@pytest.fixture
+def cache():
+    service = CacheService.__new__(CacheService)
+    service.redis = FakeRedis()
+    return service
+
+
+class TestRankedResultCache:
+    """Results are filed under the generation read before ranking"""
+
+    def test_write_during_ranking_is_not_cached_as_fresh(self, cache):
+        """A write that lands while ranking runs leaves the stale result unreachable"""
+        generation = cache.get_period_generation(2023, None)
+        cache.bump_period_generation(2023, None)  # concurrent ingest
+        cache.cache_ranked_result(2023, None, 10, generation, **FILTERS, result=json.dumps({"stocks": ["stale"]}))
+
+        assert cache.get_ranked_result(2023, None, 10, cache.get_period_generation(2023, None), **FILTERS) is None
+        assert cache.get_ranked_result(2023, None, 10, generation, **FILTERS) == {"stocks": ["stale"]}
+
+    def test_rank_changes_key_captured_before_delta(self, cache):
+        """A write to either year mid-computation files the delta under the old key"""
+        key = cache.rank_changes_key(2022, 2023, None, 10, **FILTERS)
+        cache.bump_period_generation(2022, None)
+        cache.cache_rank_changes(key, {"entered": ["stale"]})
+
+        assert cache.get_rank_changes(cache.rank_changes_key(2022, 2023, None, 10, **FILTERS)) is None
+        assert cache.get_rank_changes(key) == {"entered": ["stale"]}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
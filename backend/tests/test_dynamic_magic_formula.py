@@ -0,0 +1,483 @@
+"""
+Test for Dynamic Magic Formula Service against an in-memory SQLite database
+"""
+import copy
+import random
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.models.database import StockData, PrecomputedRanking
+from app.services.dynamic_magic_formula import DynamicMagicFormulaService
+from app.services.period_snapshot_cache import period_snapshot_cache
+from app.services.period_summary import period_summary_service
+from app.services.rank_index import PeriodRankIndex, RankIndexRegistry, rank_index_registry
+from tests.conftest import stock
+
+SECTORS = ['Technology', 'Healthcare', 'Financial Services', 'Utilities', 'Energy', None]
+
+
+def make_rows(count, year=2023, month=None, seed=11):
+    """Random stock_data rows with coarse values so ties are common"""
+    rng = random.Random(seed)
+    return [
+        stock(
+            f"S{i}", year, month, company_name=f"Company {i}", sector=rng.choice(SECTORS),
+            ebit=rng.choice([-1.0, 0.0, 1.0, 5.0]),
+            ey=float(rng.randint(-2, 10)), roc=float(rng.randint(-2, 10)),
+            market_cap=rng.choice([5e8, 1e9, 2e9])
+        )
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def db(db):
+    db.add_all(make_rows(250))
+    db.add_all(make_rows(40, year=2022, seed=3))
+    db.commit()
+    return db
+
+
+def reference_ranking(db, year, min_ey=0.0, min_roc=0.0, min_mc=settings.MIN_MARKET_CAP, month=None):
+    """Dict path over every row of the year (or of one month), in id order"""
+    service = DynamicMagicFormulaService()
+    query = db.query(StockData).filter(StockData.year == year)
+    if month is not None:
+        query = query.filter(StockData.month == month)
+    stocks = [
+        {'symbol': s.symbol, 'sector': s.sector, 'ebit': s.ebit, 'market_cap': s.market_cap,
+         'earnings_yield': s.earnings_yield, 'return_on_capital': s.return_on_capital}
+        for s in query.order_by(StockData.id)
+    ]
+    filtered = service._filter_stocks(copy.deepcopy(stocks), min_ey, min_roc, min_mc)
+    return [(s['symbol'], s['rank'], s['magic_formula_score']) for s in service._rank_stocks(filtered)]
+
+
+@pytest.fixture(params=['snapshot', 'pushdown', 'sql'])
+def backend(request, monkeypatch):
+    """Run each test against every ranking path"""
+    monkeypatch.setattr(settings, 'RANKING_BACKEND', 'sql' if request.param == 'sql' else 'python')
+    if request.param == 'pushdown':
+        monkeypatch.setattr(period_snapshot_cache, 'max_periods', 0)
+    return request.param
+
+
+class TestGetTopStocks:
+    """Every ranking path must match the dict reference (ordinal tie-breaking included)"""
+    
+    def test_excluded_sectors_setting(self, db, backend, monkeypatch):
+        """Every path, the dict reference included, excludes the configured sectors"""
+        monkeypatch.setattr(settings, 'EXCLUDED_SECTORS', ['Energy'])
+        top = DynamicMagicFormulaService().get_top_stocks(db, year=2023, top_n=500, min_earnings_yield=1.0)
+        assert [(s['symbol'], s['rank']) for s in top] == [
+            (symbol, rank) for symbol, rank, _ in reference_ranking(db, 2023, min_ey=1.0)
+        ]
+        assert 'Utilities' in {s['sector'] for s in top} and 'Energy' not in {s['sector'] for s in top}
+    
+    def test_default_filters_match_reference(self, db, backend):
+        """Same symbols, ranks and scores as the dict path"""
+        top = DynamicMagicFormulaService().get_top_stocks(db, year=2023, top_n=500)
+        assert [(s['symbol'], s['rank'], s['magic_formula_score']) for s in top] == reference_ranking(db, 2023)
+    
+    def test_custom_filters_match_reference(self, db, backend):
+        """EY / ROC / market cap thresholds are applied in SQL"""
+        top = DynamicMagicFormulaService().get_top_stocks(
+            db, year=2023, top_n=25, min_earnings_yield=3, min_return_on_capital=5, min_market_cap=2e9
+        )
+        expected = reference_ranking(db, 2023, min_ey=3, min_roc=5, min_mc=2e9)[:25]
+        assert [(s['symbol'], s['rank'], s['magic_formula_score']) for s in top] == expected
+    
+    def test_details_loaded_for_top_rows(self, db, backend):
+        """Top rows carry the full response fields"""
+        top = DynamicMagicFormulaService().get_top_stocks(db, year=2023, top_n=3)
+        assert len(top) == 3
+        for stock in top:
+            assert stock['company_name'] == f"Company {stock['symbol'][1:]}"
+            assert stock['year'] == 2023
+            assert stock['sector'] not in settings.EXCLUDED_SECTORS
+    
+    def test_rank_fields_present(self, db, backend):
+        """ey_rank + roc_rank adds up to the score, ranks are 1..n"""
+        top = DynamicMagicFormulaService().get_top_stocks(db, year=2023, top_n=20)
+        assert [s['rank'] for s in top] == list(range(1, len(top) + 1))
+        assert all(s['ey_rank'] + s['roc_rank'] == s['magic_formula_score'] for s in top)
+    
+    def test_missing_period_returns_empty(self, db, backend):
+        """Unknown period returns an empty list"""
+        assert DynamicMagicFormulaService().get_top_stocks(db, year=2019) == []
+    
+    def test_rank_period_counts(self, db, backend):
+        """Row counts come back with the ranking"""
+        service = DynamicMagicFormulaService()
+        result = service.rank_period(db, year=2023, top_n=5, min_earnings_yield=3)
+        assert result['total_in_database'] == 250
+        assert result['total_matching'] == len(reference_ranking(db, 2023, min_ey=3))
+        assert result['stocks'] == service.get_top_stocks(db, year=2023, top_n=5, min_earnings_yield=3)
+        
+        default = service.rank_period(db, year=2023, top_n=5)
+        assert default['total_matching'] == len(reference_ranking(db, 2023))
+        
+        empty = service.rank_period(db, year=2023, top_n=5, min_earnings_yield=99)
+        assert (empty['total_in_database'], empty['total_matching'], empty['stocks']) == (250, 0, [])
+    
+    def test_monthly_fallback_cached(self, db, backend):
+        """Months without rows rank the whole year; the decision is cached until a write"""
+        service = DynamicMagicFormulaService()
+        result = service.rank_period(db, year=2023, month=6, top_n=5, fallback_to_yearly=True)
+        assert result['month'] is None and result['total_in_database'] == 250
+        assert service._known_fallback(2023, 6)
+        
+        db.add_all(make_rows(3, month=6, seed=5))
+        db.commit()
+        service.notify_period_updated(2023, 6)
+        result = service.rank_period(db, year=2023, month=6, top_n=5, fallback_to_yearly=True)
+        assert result['month'] == 6 and result['total_in_database'] == 3
+    
+    def test_keyset_pages_concatenate(self, db, backend):
+        """after_rank pages join up to the full ranking, default and custom filters"""
+        service = DynamicMagicFormulaService()
+        for filters in ({}, {'min_earnings_yield': 3}):
+            expected = reference_ranking(db, 2023, min_ey=filters.get('min_earnings_yield', 0.0))
+            pages, after_rank = [], 0
+            while after_rank is not None:
+                page = service.rank_period(db, year=2023, top_n=7, after_rank=after_rank, **filters)
+                pages += [(s['symbol'], s['rank'], s['magic_formula_score']) for s in page['stocks']]
+                after_rank = page['next_after_rank']
+            assert pages == expected
+        
+        past_end = service.rank_period(db, year=2023, top_n=7, after_rank=10_000)
+        assert past_end['stocks'] == [] and past_end['next_after_rank'] is None
+
+
+class TestPeriodSnapshotCache:
+    """Test cases for snapshot versioning and invalidation"""
+    
+    def test_snapshot_reused_until_data_changes(self, db, monkeypatch):
+        """Unchanged version reuses the snapshot, a new row forces a reload"""
+        monkeypatch.setattr(period_snapshot_cache, 'revalidate_seconds', 0)
+        service = DynamicMagicFormulaService()
+        first = service.get_snapshot(db, 2023)
+        assert service.get_snapshot(db, 2023) is first
+        
+        db.add_all(make_rows(1, seed=99))
+        db.commit()
+        second = service.get_snapshot(db, 2023)
+        assert second is not first
+        assert len(second) == len(first) + 1
+    
+    def test_notify_drops_month_and_year_snapshots(self, db):
+        """A write to (year, month) invalidates the whole-year snapshot too"""
+        service = DynamicMagicFormulaService()
+        year_snapshot = service.get_snapshot(db, 2023)
+        service.notify_period_updated(2023, 6)
+        assert service.get_snapshot(db, 2023) is not year_snapshot
+    
+    def test_lru_eviction(self, db, monkeypatch):
+        """Only max_periods snapshots are kept"""
+        monkeypatch.setattr(period_snapshot_cache, 'max_periods', 1)
+        service = DynamicMagicFormulaService()
+        service.get_snapshot(db, 2023)
+        service.get_snapshot(db, 2022)
+        assert period_snapshot_cache.get_stats()['cached_periods'] == [[2022, None]]
+    
+    def test_preload_latest_periods(self, db):
+        """Startup preload loads the newest years"""
+        DynamicMagicFormulaService().preload_snapshots(db, periods=2)
+        assert period_snapshot_cache.get_stats()['cached_periods'] == [[2023, None], [2022, None]]
+
+
+class TestRankIndex:
+    """Incremental rank maintenance must match a full re-rank"""
+    
+    def test_single_row_writes_applied_in_place(self, db, monkeypatch):
+        """Inserts and updates fed through the commit hook keep the ordering exact"""
+        monkeypatch.setattr(period_snapshot_cache, 'revalidate_seconds', 0)
+        monkeypatch.setattr(rank_index_registry, 'revalidate_seconds', 0)
+        service = DynamicMagicFormulaService()
+        index = service.get_rank_index(db, 2023)
+        
+        rng = random.Random(5)
+        for i, row in enumerate(make_rows(30, seed=21)):
+            row.symbol = f"N{i}"
+            db.add(row)
+            db.commit()
+            service.notify_period_updated(2023, row.month, stock=row)
+            
+            existing = db.query(StockData).filter(StockData.year == 2023).order_by(StockData.id).all()[rng.randrange(200)]
+            existing.earnings_yield = float(rng.randint(-2, 10))
+            db.commit()
+            service.notify_period_updated(2023, existing.month, stock=existing)
+        
+        # Version was maintained in place, so no rebuild happened
+        assert service.get_rank_index(db, 2023) is index
+        top = service.get_top_stocks(db, year=2023, top_n=500)
+        assert [(s['symbol'], s['rank'], s['magic_formula_score']) for s in top] == reference_ranking(db, 2023)
+    
+    @pytest.mark.parametrize('rebase_writes', [1, 8, 1000])
+    def test_patched_ordering_matches_full_build(self, rebase_writes):
+        """Moves, inserts and removals keep every read exact, whatever the score drift"""
+        rng = random.Random(9)
+        metrics = {i: (float(rng.randint(-2, 10)), float(rng.randint(-2, 10))) for i in range(200)}
+        
+        def fresh():
+            ids = np.asarray(sorted(metrics), dtype=np.int64)
+            return PeriodRankIndex.build(
+                (len(ids), None), ids,
+                np.asarray([metrics[i][0] for i in ids.tolist()]),
+                np.asarray([metrics[i][1] for i in ids.tolist()]),
+                np.ones(len(ids), dtype=bool)
+            )
+        
+        index = fresh()
+        index.rebase_writes = rebase_writes
+        for step in range(300):
+            stock_id = rng.randrange(220)
+            if step % 7 == 0:
+                metrics.pop(stock_id, None)
+                index.delete(stock_id)
+            else:
+                metrics[stock_id] = (float(rng.randint(-2, 10)), float(rng.randint(-2, 10)))
+                index.upsert(stock_id, *metrics[stock_id], eligible=True, updated_at=None)
+            expected, actual = fresh().ranked(), index.top(len(metrics))
+            assert actual.positions.tolist() == expected.positions.tolist()
+            assert actual.score.tolist() == expected.score.tolist()
+            assert actual.ey_rank.tolist() == expected.ey_rank.tolist()
+            page = index.top(10, after_rank=step % 50)
+            assert page.positions.tolist() == expected.positions.tolist()[step % 50:step % 50 + 10]
+            assert index.rank_of(stock_id) == fresh().rank_of(stock_id)
+        assert (index.rebases > 0) == (rebase_writes < 300)
+    
+    def test_insert_at_top_is_not_a_rebuild(self):
+        """A new best stock shifts every rank; it is filed in O(log n), reads stay exact"""
+        ids = np.arange(1, 101, dtype=np.int64)
+        index = PeriodRankIndex.build((100, None), ids, ids.astype(float), ids.astype(float), np.ones(100, dtype=bool))
+        index.upsert(500, 1000.0, 1000.0, eligible=True, updated_at=None)
+        assert index.rebases == 0
+        top = index.top(3)
+        assert top.positions.tolist() == [500, 100, 99]
+        assert top.score.tolist() == [2, 4, 6]
+        assert index.rank_of(1)['rank'] == 101
+    
+    def test_registry_is_an_lru(self):
+        """Only the RANK_INDEX_CACHE_SIZE most recently read periods keep their index"""
+        registry = RankIndexRegistry(enabled=True, revalidate_seconds=5.0, max_periods=2)
+        for year in (2021, 2022):
+            registry.put((year, None), PeriodRankIndex((0, None)))
+        registry.get((2021, None))
+        registry.put((2023, None), PeriodRankIndex((0, None)))
+        assert registry.get_stats()['indexed_periods'] == [[2021, None], [2023, None]]
+    
+    def test_foreign_write_triggers_rebuild(self, db, monkeypatch):
+        """A write that bypassed the hook changes the version and forces a rebuild"""
+        monkeypatch.setattr(rank_index_registry, 'revalidate_seconds', 0)
+        monkeypatch.setattr(period_snapshot_cache, 'revalidate_seconds', 0)
+        service = DynamicMagicFormulaService()
+        index = service.get_rank_index(db, 2023)
+        db.add_all(make_rows(1, seed=77))
+        db.commit()
+        assert service.get_rank_index(db, 2023) is not index
+
+
+class TestPrecomputedRankings:
+    """stock_rankings rebuild + indexed read"""
+    
+    def test_rebuild_matches_reference(self, db, monkeypatch):
+        """Rebuilt table serves the same ranking as the dynamic path"""
+        monkeypatch.setattr(settings, 'RANKING_BACKEND', 'sql')
+        service = DynamicMagicFormulaService()
+        count = service.rebuild_rankings(db, 2023)
+        assert count == len(reference_ranking(db, 2023))
+        
+        top = service._top_stocks_precomputed(db, 2023, None, 500)['stocks']
+        assert [(s['symbol'], s['rank'], s['magic_formula_score']) for s in top] == reference_ranking(db, 2023)
+        assert service.get_top_stocks(db, year=2023, top_n=500) == top
+    
+    def test_precomputed_keyset_page(self, db, monkeypatch):
+        """after_rank reads the next slice of stock_rankings"""
+        monkeypatch.setattr(settings, 'RANKING_BACKEND', 'sql')
+        service = DynamicMagicFormulaService()
+        service.rebuild_rankings(db, 2023)
+        page = service._top_stocks_precomputed(db, 2023, None, 10, after_rank=20)['stocks']
+        assert [(s['symbol'], s['rank'], s['magic_formula_score']) for s in page] == reference_ranking(db, 2023)[20:30]
+    
+    def test_rebuild_replaces_previous_rows(self, db):
+        """Rebuilding a period twice does not duplicate rankings"""
+        service = DynamicMagicFormulaService()
+        service.rebuild_rankings_for_writes(db, [(2023, None), (2022, None)])
+        first = db.query(PrecomputedRanking).count()
+        service.rebuild_rankings(db, 2023)
+        assert db.query(PrecomputedRanking).count() == first
+    
+    def test_missing_rankings_fall_back_to_dynamic(self, db, monkeypatch):
+        """Periods without pre-computed rows use the window-function query"""
+        monkeypatch.setattr(settings, 'RANKING_BACKEND', 'sql')
+        top = DynamicMagicFormulaService().get_top_stocks(db, year=2023, top_n=500)
+        assert [(s['symbol'], s['rank'], s['magic_formula_score']) for s in top] == reference_ranking(db, 2023)
+
+
+class TestSymbolHistory:
+    """Per-symbol history and bulk symbol lookup"""
+    
+    def test_ranks_from_rankings_table_and_index(self, db):
+        """Pre-computed and index-served periods both match the reference ranks"""
+        service = DynamicMagicFormulaService()
+        service.rebuild_rankings(db, 2023)
+        ranks = {year: {s: r for s, r, _ in reference_ranking(db, year)} for year in (2022, 2023)}
+        symbol = next(s for s in ranks[2022] if s in ranks[2023])
+        
+        history = service.get_symbol_history(db, symbol)
+        assert history['company_name'] == f"Company {symbol[1:]}"
+        assert [(p['year'], p['month'], p['rank']) for p in history['periods']] == [
+            (2022, None, ranks[2022][symbol]), (2023, None, ranks[2023][symbol])
+        ]
+    
+    def test_unranked_periods_ranked_in_one_query(self, db, monkeypatch):
+        """Yearly and monthly periods without rankings match the reference without a rank index"""
+        monthly = make_rows(30, year=2023, month=3, seed=5)
+        for stock in monthly:
+            stock.symbol = stock.symbol.replace('S', 'M')
+        db.add_all(monthly)
+        db.commit()
+        service = DynamicMagicFormulaService()
+        monkeypatch.setattr(service, 'get_rank_index', lambda *args: pytest.fail("rank index built"))
+        ranks = {
+            (year, month): {s: r for s, r, _ in reference_ranking(db, year, month=month)}
+            for year, month in ((2022, None), (2023, None), (2023, 3))
+        }
+        for symbol in ('S0', 'S7', 'M21', 'M4'):
+            history = service.get_symbol_history(db, symbol)
+            assert {(p['year'], p['month']): p['rank'] for p in history['periods']} == {
+                period: ranks[period].get(symbol) for period in ranks
+                if (period[1] is None) == symbol.startswith('S')
+            }
+    
+    def test_rankings_written_since_rebuild_are_not_used(self, db):
+        """A row written after the rebuild shifts every rank - stale stock_rankings are bypassed"""
+        service = DynamicMagicFormulaService()
+        service.rebuild_rankings(db, 2023)
+        best = stock('TOP', ebit=5.0, ey=50.0, roc=50.0, updated_at=datetime.utcnow() + timedelta(seconds=1))
+        db.add(best)
+        db.flush()
+        period_summary_service.record_write(db, best, is_new=True)
+        db.commit()
+        
+        ranks = {s: r for s, r, _ in reference_ranking(db, 2023)}
+        symbol = next(s for s in ranks if s != 'TOP')
+        assert service.get_symbol_history(db, symbol)['periods'][-1]['rank'] == ranks[symbol]
+        assert [r['rank'] for r in service.lookup_symbols(db, ['TOP', symbol], 2023)] == [1, ranks[symbol]]
+        
+        service.rebuild_rankings(db, 2023)
+        assert service.get_symbol_history(db, symbol)['periods'][-1]['rank'] == ranks[symbol]
+    
+    def test_unranked_and_unknown_symbols(self, db):
+        """Ineligible periods carry rank None; unknown symbols return None"""
+        service = DynamicMagicFormulaService()
+        ranked = {s for s, _, _ in reference_ranking(db, 2023)}
+        symbol = next(f"S{i}" for i in range(40, 250) if f"S{i}" not in ranked)
+        period, = service.get_symbol_history(db, symbol)['periods']
+        assert period['rank'] is None and period['earnings_yield'] is not None
+        assert service.get_symbol_history(db, 'NOPE') is None
+    
+    def test_lookup_symbols_in_request_order(self, db):
+        """Bulk lookup matches the reference ranks, from stock_rankings or the rank index"""
+        service = DynamicMagicFormulaService()
+        ranks = {s: r for s, r, _ in reference_ranking(db, 2023)}
+        symbols = ['S163', 'NOPE', 'S3', 'S156', 'S3']
+        for precomputed in (False, True):
+            if precomputed:
+                service.rebuild_rankings(db, 2023)
+            results = service.lookup_symbols(db, symbols, 2023)
+            assert [r['symbol'] for r in results] == symbols
+            assert [r['found'] for r in results] == [True, False, True, True, True]
+            assert [r.get('rank') for r in results if r['found']] == [ranks.get(s) for s in ('S163', 'S3', 'S156', 'S3')]
+    
+    def test_history_served_by_unique_index(self):
+        """No second index repeats the (symbol, year, month) key of uix_symbol_year_month"""
+        keys = [tuple(column.name for column in index.columns) for index in StockData.__table__.indexes]
+        assert ('symbol', 'year', 'month') not in keys
+
+
+class TestBatchRanking:
+    """Multi-period ranking from one grouped read"""
+    
+    def test_batch_matches_single_period(self, db):
+        """Every period equals its own get_top_stocks call"""
+        service = DynamicMagicFormulaService()
+        periods = service.get_top_stocks_batch(db, [2021, 2022, 2023], top_n=15)
+        assert [p['year'] for p in periods] == [2021, 2022, 2023]
+        assert periods[0]['stocks'] == [] and periods[0]['total_in_database'] == 0
+        for period in periods[1:]:
+            assert period['stocks'] == service.get_top_stocks(db, year=period['year'], top_n=15)
+            assert period['total_after_filter'] == len(reference_ranking(db, period['year']))
+        assert periods[2]['total_in_database'] == 250
+    
+    def test_streaming_yields_same_periods(self, db):
+        """iter_top_stocks_batch yields the combined response period by period"""
+        service = DynamicMagicFormulaService()
+        streamed = list(service.iter_top_stocks_batch(db, [2022, 2023], top_n=5, min_earnings_yield=4))
+        assert streamed == service.get_top_stocks_batch(db, [2022, 2023], top_n=5, min_earnings_yield=4)
+    
+    def test_filter_sweep_matches_single_requests(self, db):
+        """Each combination equals its own get_top_stocks call"""
+        service = DynamicMagicFormulaService()
+        combinations = [
+            {},
+            {"min_earnings_yield": 3},
+            {"min_earnings_yield": 3, "min_return_on_capital": 5, "min_market_cap": 2e9},
+            {"min_earnings_yield": 99},
+        ]
+        results = service.sweep_filters(db, 2023, None, combinations, top_n=20)
+        assert [r['filters']['min_earnings_yield'] for r in results] == [0.0, 3.0, 3.0, 99.0]
+        for combination, result in zip(combinations, results):
+            assert result['stocks'] == service.get_top_stocks(db, year=2023, top_n=20, **combination)
+        assert results[3] == {"filters": results[3]['filters'], "total_after_filter": 0, "stocks": []}
+    
+    def test_rank_changes_match_reference(self, db):
+        """Entries, exits and movements agree with both reference rankings"""
+        before = {symbol: rank for symbol, rank, _ in reference_ranking(db, 2022)}
+        after = {symbol: rank for symbol, rank, _ in reference_ranking(db, 2023)}
+        top_before = {s for s, r in before.items() if r <= 10}
+        top_after = {s for s, r in after.items() if r <= 10}
+
+        result = DynamicMagicFormulaService().rank_changes(db, 2022, 2023, top_n=10)
+        assert result['ranked_symbols'] == {'from': len(before), 'to': len(after)}
+        assert [(e['symbol'], e['rank'], e['previous_rank']) for e in result['entries']] == sorted(
+            ((s, after[s], before.get(s)) for s in top_after - top_before), key=lambda e: e[1]
+        )
+        assert {(e['symbol'], e['previous_rank'], e['rank']) for e in result['exits']} == {
+            (s, before[s], after.get(s)) for s in top_before - top_after
+        }
+        assert {(m['symbol'], m['change']) for m in result['movements']} == {
+            (s, before[s] - after[s]) for s in top_before & top_after
+        }
+        assert all(e['company_name'] == f"Company {e['symbol'][1:]}" for e in result['entries'])
+
+    def test_parse_years(self):
+        """Ranges and lists are accepted, bad input is a ValueError"""
+        from app.core.periods import parse_years
+        assert parse_years("2017-2019,2021") == [2017, 2018, 2019, 2021]
+        for bad in ("2019-2017", "abc", "1990", ""):
+            with pytest.raises(ValueError):
+                parse_years(bad)
+
+
+class TestRankingExport:
+    """Full ranked universe streamed from a server-side cursor"""
+    
+    def test_export_rows_match_reference(self, db):
+        """Every passing stock, best first, with details and rank fields"""
+        rows = list(DynamicMagicFormulaService().iter_ranked_rows(db, 2023, min_return_on_capital=2, batch_size=16))
+        assert [(r['symbol'], r['rank'], r['magic_formula_score']) for r in rows] == reference_ranking(db, 2023, min_roc=2)
+        assert all(r['company_name'] and r['year'] == 2023 for r in rows)
+    
+    def test_csv_columns(self, db):
+        """CSV header covers every exported field"""
+        from app.routers.stocks import EXPORT_FIELDS
+        row = next(DynamicMagicFormulaService().iter_ranked_rows(db, 2023))
+        assert set(row) == set(EXPORT_FIELDS)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,141 @@
+"""
+Test for the on-disk HTTP record / replay cache
+"""
+import asyncio
+import os
+import pytest
+
+from app.services.http_cache import HttpCache, normalize_url
+
+DETAILS_URL = "https://api.polygon.io/v3/reference/tickers/AAPL?apiKey=secret"
+
+
+class FakeResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+        self.headers = {'Content-Type': 'application/json'}
+
+    async def read(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeSession:
+    """Stands in for aiohttp.ClientSession - counts network GETs"""
+
+    def __init__(self, status=200, body=b'{"results": {"name": "Apple Inc."}}'):
+        self.status = status
+        self.body = body
+        self.urls = []
+
+    def get(self, url, **kwargs):
+        self.urls.append(url)
+        return FakeResponse(self.status, self.body)
+
+
+def fetch(session, url):
+    async def run():
+        async with session.get(url) as response:
+            return response.status, await response.json()
+    return asyncio.run(run())
+
+
+def make_cache(tmp_path, mode='record'):
+    return HttpCache(
+        root=str(tmp_path), mode=mode,
+        ttls={'api.polygon.io/v3/reference': 60, 'api.polygon.io/v3/reference/tickers': 3600},
+        default_ttl=10
+    )
+
+
+class TestHttpCache:
+    """Record, expire and replay provider responses"""
+
+    def test_normalized_key_strips_api_key(self):
+        """Query order, host case and the API key do not change the key"""
+        assert normalize_url("HTTPS://API.Polygon.io/vX/reference/financials?limit=10&ticker=A&apiKey=x") == \
+            normalize_url("https://api.polygon.io/vX/reference/financials?ticker=A&apikey=y&limit=10") == \
+            "https://api.polygon.io/vX/reference/financials?limit=10&ticker=A"
+
+    def test_record_then_hit(self, tmp_path):
+        """The second GET (even with another key) is served from disk"""
+        cache = make_cache(tmp_path)
+        network = FakeSession()
+        session = cache.wrap(network)
+
+        assert fetch(session, DETAILS_URL) == (200, {"results": {"name": "Apple Inc."}})
+        assert fetch(session, DETAILS_URL.replace('secret', 'other')) == (200, {"results": {"name": "Apple Inc."}})
+        assert len(network.urls) == 1
+        assert cache.get_stats()['hits'] == 1
+        assert cache.network_calls([DETAILS_URL]) == 0
+        assert os.path.exists(cache.path(DETAILS_URL)) and cache.path(DETAILS_URL).endswith('.gz')
+
+    def test_ttl_per_endpoint(self, tmp_path):
+        """Longest matching prefix decides the TTL; stale recordings are fetched again"""
+        cache = make_cache(tmp_path)
+        assert cache.ttl(DETAILS_URL) == 3600
+        assert cache.ttl("https://api.polygon.io/v3/reference/exchanges") == 60
+        assert cache.ttl("https://en.wikipedia.org/wiki/Nasdaq-100") == 10
+
+        network = FakeSession()
+        fetch(cache.wrap(network), DETAILS_URL)
+        stale = os.path.getmtime(cache.path(DETAILS_URL)) - 3601
+        os.utime(cache.path(DETAILS_URL), (stale, stale))
+        fetch(cache.wrap(network), DETAILS_URL)
+        assert len(network.urls) == 2
+
+    def test_errors_and_throttle_notices_not_recorded(self, tmp_path):
+        """Non-200s and Alpha Vantage throttling notices are never written"""
+        cache = make_cache(tmp_path)
+        fetch(cache.wrap(FakeSession(status=429)), DETAILS_URL)
+        fetch(cache.wrap(FakeSession(body=b'{"Note": "Thank you for using Alpha Vantage!"}')), DETAILS_URL)
+        assert cache.get_stats()['stored'] == 0
+        assert not os.path.exists(cache.path(DETAILS_URL))
+
+    def test_replay_never_touches_network(self, tmp_path):
+        """Replay serves recordings regardless of age and answers misses with 504"""
+        fetch(make_cache(tmp_path).wrap(FakeSession()), DETAILS_URL)
+        os.utime(make_cache(tmp_path).path(DETAILS_URL), (0, 0))
+
+        replay = make_cache(tmp_path, mode='replay')
+        network = FakeSession()
+        assert fetch(replay.wrap(network), DETAILS_URL)[0] == 200
+        assert fetch(replay.wrap(network), DETAILS_URL.replace('AAPL', 'MSFT')) == (504, {"error": "not recorded"})
+        assert network.urls == []
+        assert replay.network_calls([DETAILS_URL.replace('AAPL', 'MSFT')]) == 0
+
+    def test_concurrent_record_of_one_url(self, tmp_path):
+        """Parallel misses of one URL each store through their own temp file; the loop is never blocked on gzip"""
+        cache = make_cache(tmp_path)
+        network = FakeSession()
+        session = cache.wrap(network)
+
+        async def run():
+            async def one():
+                async with session.get(DETAILS_URL) as response:
+                    return await response.json()
+            return await asyncio.gather(*(one() for _ in range(4)))
+
+        assert asyncio.run(run()) == [{"results": {"name": "Apple Inc."}}] * 4
+        stats = cache.get_stats()
+        assert stats['stored'] == stats['misses'] == len(network.urls) and stats['stored'] + stats['hits'] == 4
+        assert os.listdir(os.path.dirname(cache.path(DETAILS_URL))) == [os.path.basename(cache.path(DETAILS_URL))]
+
+    def test_off_by_default(self, tmp_path):
+        """Recording is opt-in (HTTP_CACHE_MODE=record)"""
+        assert HttpCache(root=str(tmp_path)).mode == 'off'
+
+    def test_off_returns_session(self, tmp_path):
+        """Mode off leaves the session untouched"""
+        network = FakeSession()
+        assert make_cache(tmp_path, mode='off').wrap(network) is network
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,105 @@
+"""
+Test for the shared pooled HTTP client
+"""
+import asyncio
+import threading
+import time
+import pytest
+from aiohttp import web
+
+from app.services.http_cache import http_cache
+from app.services.http_client import HttpClient
+
+
+async def serve(on_request=None):
+    async def handler(request):
+        if on_request is not None:
+            on_request()
+        return web.json_response({"results": {"ticker": request.match_info['symbol']}})
+
+    app = web.Application()
+    app.router.add_get('/v3/reference/tickers/{symbol}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture(autouse=True)
+def no_disk_cache(monkeypatch):
+    monkeypatch.setattr(http_cache, 'mode', 'off')
+
+
+class TestHttpClient:
+    """One keep-alive pool for every provider call"""
+
+    def test_connections_reused(self):
+        """Sequential GETs share one pooled connection; stats describe the pool"""
+        client = HttpClient()
+        seen_in_flight = []
+
+        async def run():
+            runner, base = await serve(lambda: seen_in_flight.append(client.get_stats()['pool']['in_flight']))
+            try:
+                for symbol in ('AAPL', 'MSFT', 'NVDA'):
+                    session = await client.get_session()
+                    async with session.get(f"{base}/v3/reference/tickers/{symbol}") as response:
+                        assert (await response.json())['results']['ticker'] == symbol
+                stats = client.get_stats()
+                await client.close()
+                return stats
+            finally:
+                await runner.cleanup()
+
+        stats = asyncio.run(run())
+        assert (stats['requests'], stats['connections_created'], stats['connections_reused']) == (3, 1, 2)
+        assert stats['status'] == 'open' and stats['pool']['in_flight'] == 0
+        assert seen_in_flight == [1, 1, 1]
+        assert stats['sessions_created'] == 1
+        assert client.get_stats()['status'] == 'closed'
+
+    def test_session_per_event_loop(self):
+        """Started once per loop; a new loop (CLI asyncio.run) gets a fresh session"""
+        client = HttpClient()
+
+        async def open_twice():
+            first = await client.start()
+            assert await client.start() is first
+
+        asyncio.run(open_twice())
+        asyncio.run(open_twice())
+        assert client.stats['sessions_created'] == 2
+
+    def test_stale_session_closed(self):
+        """The session of a finished loop is closed and its pooled connection ended"""
+        server_loop = asyncio.new_event_loop()
+        threading.Thread(target=server_loop.run_forever, daemon=True).start()
+        runner, base = asyncio.run_coroutine_threadsafe(serve(), server_loop).result()
+        client = HttpClient()
+        sessions = []
+
+        async def fetch():
+            session = await client.start()
+            sessions.append(session)
+            async with session.get(f"{base}/v3/reference/tickers/AAPL") as response:
+                await response.json()
+
+        try:
+            asyncio.run(fetch())
+            assert len(runner.server.connections) == 1  # kept alive in the old loop's pool
+            asyncio.run(fetch())
+            assert sessions[0].closed and not sessions[1].closed
+            deadline = time.monotonic() + 5
+            while len(runner.server.connections) > 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert len(runner.server.connections) == 1  # only the new session's
+            asyncio.run(client.close())
+        finally:
+            asyncio.run_coroutine_threadsafe(runner.cleanup(), server_loop).result()
+            server_loop.call_soon_threadsafe(server_loop.stop)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,72 @@
+"""
+Test for Parquet bulk export / import of stock_data
+"""
+import pytest
+
+from app.models.database import StockData
+from app.services.parquet_transfer import ParquetTransferService
+from tests.conftest import stock
+
+pyarrow = pytest.importorskip('pyarrow')
+import pyarrow.parquet  # noqa: E402
+
+
+def snapshot(db):
+    return sorted((
+        (s.symbol, s.year, s.month, s.sector, s.earnings_yield, s.current_price, s.updated_at)
+        for s in db.query(StockData)
+    ), key=repr)
+
+
+@pytest.fixture
+def source(db):
+    db.add_all([
+        stock('A', 2022), stock('B', 2022, sector=None),
+        stock('A', 2023), stock('A', 2023, month=3), stock('C', 2023, month=3, sector='Energy'),
+    ])
+    db.commit()
+    return db
+
+
+class TestParquetTransfer:
+    """Round trips between two databases"""
+
+    def test_export_layout(self, source, tmp_path):
+        """One dictionary-encoded file per year, year in the partition directory"""
+        result = ParquetTransferService().export(source, [2021, 2022, 2023], str(tmp_path))
+        assert result['rows_by_year'] == {2022: 2, 2023: 3}
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['year=2022', 'year=2023']
+
+        schema = pyarrow.parquet.read_schema(tmp_path / 'year=2023' / 'part-0.parquet')
+        assert 'year' not in schema.names
+        assert pyarrow.types.is_dictionary(schema.field('symbol').type)
+
+    def test_import_round_trip(self, source, new_session, tmp_path):
+        """A fresh database ends up with the same rows"""
+        service = ParquetTransferService()
+        service.export(source, [2022, 2023], str(tmp_path))
+        target = new_session()
+        result = service.import_dataset(target, str(tmp_path), batch_size=2)
+        assert (result['inserted'], result['updated'], result['rows']) == (5, 0, 5)
+        assert snapshot(target) == snapshot(source)
+        assert {(p['year'], p['month']) for p in result['periods']} == {(2022, None), (2023, None), (2023, 3)}
+
+    def test_import_upserts_null_months(self, source, new_session, tmp_path):
+        """Re-importing updates rows in place - yearly (month NULL) rows included"""
+        service = ParquetTransferService()
+        target = new_session()
+        service.export(source, [2022, 2023], str(tmp_path))
+        service.import_dataset(target, str(tmp_path))
+
+        source.query(StockData).filter(StockData.symbol == 'A').update({'earnings_yield': 9.0})
+        source.commit()
+        service.export(source, [2022, 2023], str(tmp_path))
+        result = service.import_dataset(target, str(tmp_path))
+
+        assert (result['inserted'], result['updated']) == (0, 5)
+        assert target.query(StockData).count() == 5
+        assert snapshot(target) == snapshot(source)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,192 @@
+"""
+Test for Period Summary (zone-map statistics) Service
+"""
+import asyncio
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.models.database import StockData, FailedStock, PeriodSummary, drop_duplicate_period_summaries
+from app.services.dynamic_magic_formula import DynamicMagicFormulaService
+from app.services.period_summary import PeriodSummaryService
+from tests.conftest import stock
+
+
+@pytest.fixture
+def db(db):
+    db.add_all([
+        stock('A', ey=2.0, roc=4.0),
+        stock('B', ey=8.0, roc=30.0, market_cap=5e8),
+        stock('C', ey=12.0, roc=20.0, sector='Utilities'),
+        stock('D', ey=1.0, roc=15.0, sector=None),
+        stock('E', month=3, ey=20.0, roc=50.0),
+    ])
+    db.commit()
+    return db
+
+
+class TestPeriodSummary:
+    """Statistics, estimates and maintenance"""
+
+    def test_refresh_statistics(self, db):
+        """min / max / null count / sector counts over every record of the year"""
+        summary = PeriodSummaryService().refresh(db, 2023)
+        assert summary.stock_count == 5
+        ey = summary.column_stats['earnings_yield']
+        assert (ey['min'], ey['max'], ey['null_count']) == (1.0, 20.0, 0)
+        assert len(ey['quantiles']) == 21
+        assert summary.sector_counts == {'Technology': 3, 'Utilities': 1, 'Unknown': 1}
+
+    def test_impossible_filters_are_exact(self, db):
+        """Thresholds above the period maximum can never match"""
+        service = PeriodSummaryService()
+        service.refresh(db, 2023)
+        assert service.estimate(db, 2023, None, 21.0, 0.0, 0.0)['impossible']
+        assert service.estimate(db, 2023, None, 0.0, 0.0, 1e12)['impossible']
+        estimate = service.estimate(db, 2023, None, 20.0, 0.0, 0.0)
+        assert not estimate['impossible'] and estimate['estimated_matches'] >= 1
+        assert service.estimate(db, 2019, None, 0.0, 0.0, 0.0) is None
+
+    def test_writes_refresh_month_and_year(self, db):
+        """A monthly write refreshes the month and the whole-year summary"""
+        service = PeriodSummaryService()
+        service.refresh_for_writes(db, [(2023, 3)])
+        assert service.get(db, 2023, 3).stock_count == 1
+        assert service.get(db, 2023, None).stock_count == 5
+
+        db.add(stock('F', month=3, ey=90.0))
+        db.commit()
+        service.refresh_for_writes(db, [(2023, 3)])
+        assert service.get(db, 2023, None).column_stats['earnings_yield']['max'] == 90.0
+        assert db.query(PeriodSummary).count() == 2
+
+    def test_backfill_missing_only(self, db):
+        """Startup backfill creates summaries once"""
+        service = PeriodSummaryService()
+        assert service.backfill(db) == 2
+        assert service.backfill(db) == 0
+
+    def test_router_rejects_impossible_filters(self, db):
+        """The top routes answer 404 from the zone map"""
+        from app.routers.stocks import reject_impossible_filters
+        PeriodSummaryService().refresh(db, 2023)
+        filters = {"min_earnings_yield": 50.0, "min_return_on_capital": 0.0, "min_market_cap": settings.MIN_MARKET_CAP}
+        with pytest.raises(HTTPException) as exc:
+            reject_impossible_filters(db, 2023, None, filters)
+        assert exc.value.status_code == 404
+        reject_impossible_filters(db, 2023, None, dict(filters, min_earnings_yield=10.0))
+
+    def test_estimate_route_validates_year(self, db):
+        """Out-of-range years are a 400, like the other period routes"""
+        from app.routers.stocks import estimate_matches
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(estimate_matches(
+                1999, None, 0.0, 0.0, settings.MIN_MARKET_CAP, current_user={"username": "tester"}, db=db
+            ))
+        assert exc.value.status_code == 400
+
+
+class TestPeriodCatalog:
+    """Counters maintained by the ingest hooks"""
+
+    def test_record_write_updates_counters(self, db):
+        """Inserted rows count once per period; min / max stretch immediately"""
+        service = PeriodSummaryService()
+        service.backfill(db)
+        row = stock('F', month=3, ey=75.0)
+        db.add(row)
+        service.record_write(db, row, is_new=True)
+        db.commit()
+
+        month, year = service.get(db, 2023, 3), service.get(db, 2023, None)
+        assert (month.stored_count, month.stock_count) == (2, 2)
+        assert (year.stored_count, year.stock_count) == (4, 6)
+        assert year.column_stats['earnings_yield']['max'] == 75.0
+        assert not service.estimate(db, 2023, None, 70.0, 0.0, 0.0)['impossible']
+
+        service.record_write(db, row, is_new=False)
+        db.commit()
+        assert service.get(db, 2023, 3).stored_count == 2
+
+    def test_record_write_moves_sector(self, db):
+        """An update that changes the sector moves the row between sector counts"""
+        service = PeriodSummaryService()
+        service.backfill(db)
+        row = db.query(StockData).filter_by(symbol='D').one()
+        row.sector = 'Technology'
+        service.record_write(db, row, is_new=False, previous_sector=None)
+        service.record_write(db, row, is_new=False, previous_sector='Technology')
+        db.commit()
+
+        assert service.get(db, 2023).sector_counts == {'Technology': 4, 'Utilities': 1}
+        assert service.get(db, 2023).sector_counts == service.refresh(db, 2023).sector_counts
+
+    def test_failure_transitions(self, db):
+        """pending / failed counters follow every status change"""
+        service = PeriodSummaryService()
+        failed = FailedStock(symbol='X', year=2023, month=None, status='pending')
+        db.add(failed)
+        service.set_failure_status(db, failed, 'pending', new=True)
+        db.commit()
+        assert (service.get(db, 2023).pending_count, service.get(db, 2023).failed_count) == (1, 0)
+
+        for status in ('retrying', 'pending', 'failed'):
+            service.set_failure_status(db, failed, status)
+        db.commit()
+        assert (service.get(db, 2023).pending_count, service.get(db, 2023).failed_count) == (0, 1)
+
+        service.set_failure_status(db, failed, 'completed')
+        db.commit()
+        assert (service.get(db, 2023).pending_count, service.get(db, 2023).failed_count) == (0, 0)
+
+    def test_backfill_counts_failures(self, db):
+        """Startup backfill counts existing failed_stocks rows"""
+        db.add_all([
+            FailedStock(symbol='X', year=2022, month=None, status='pending'),
+            FailedStock(symbol='Y', year=2022, month=None, status='failed'),
+            FailedStock(symbol='Z', year=2022, month=None, status='completed'),
+        ])
+        db.commit()
+        service = PeriodSummaryService()
+        service.backfill(db)
+        summary = service.get(db, 2022)
+        assert (summary.pending_count, summary.failed_count, summary.stored_count) == (1, 1, 0)
+
+    def test_one_row_per_period(self, db):
+        """A period created twice (racing writers) keeps one row; duplicates are rejected, yearly ones too"""
+        service = PeriodSummaryService()
+        service._create_missing(db, 2019, None)
+        service._create_missing(db, 2019, None)
+        service.get_for_update(db, 2019, None).stock_count = 3
+        db.commit()
+        assert db.query(PeriodSummary).filter(PeriodSummary.year == 2019).count() == 1
+        assert service.get(db, 2019).stock_count == 3
+
+        db.add(PeriodSummary(year=2019, month=None, column_stats={}, sector_counts={}))
+        with pytest.raises(IntegrityError):
+            db.commit()
+        db.rollback()
+
+    def test_duplicates_dropped_before_unique_index(self, db):
+        """Periods summarized twice before the index existed are removed for backfill to rebuild"""
+        db.execute(text("DROP INDEX uix_period_summary_period"))
+        db.add_all([PeriodSummary(year=2023, month=None, column_stats={}, sector_counts={}) for _ in range(2)])
+        db.add(PeriodSummary(year=2023, month=3, column_stats={}, sector_counts={}))
+        db.commit()
+
+        drop_duplicate_period_summaries(db.connection())
+        assert [(s.year, s.month) for s in db.query(PeriodSummary)] == [(2023, 3)]
+        assert PeriodSummaryService().backfill(db) == 1
+
+    def test_available_periods_match_group_by(self, db):
+        """Catalog lookup returns what the GROUP BY scan returns"""
+        service = PeriodSummaryService()
+        service.backfill(db)
+        expected = DynamicMagicFormulaService().get_available_periods(db)
+        assert service.get_available_periods(db) == expected
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
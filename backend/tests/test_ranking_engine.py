@@ -0,0 +1,153 @@
+"""
+Test for Columnar Ranking Engine
+"""
+import copy
+import random
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services.dynamic_magic_formula import DynamicMagicFormulaService
+from app.services.ranking_engine import (
+    RankingColumns, filter_mask, rank_candidates, rank_columns, rank_presorted, top_n_by_score
+)
+
+
+def make_stocks(count, seed=7):
+    """Random period with coarse values so ties are common"""
+    rng = random.Random(seed)
+    sectors = ['Technology', 'Healthcare', 'Financial Services', 'Utilities', 'Energy', None]
+    return [
+        {
+            'symbol': f"S{i}",
+            'sector': rng.choice(sectors),
+            'ebit': rng.choice([-1.0, 0.0, 1.0, 5.0]),
+            'market_cap': rng.choice([5e8, 1e9, 2e9]),
+            'earnings_yield': float(rng.randint(-2, 10)),
+            'return_on_capital': float(rng.randint(-2, 10))
+        }
+        for i in range(count)
+    ]
+
+
+def dict_path(stocks, min_ey=0.0, min_roc=0.0, min_mc=settings.MIN_MARKET_CAP):
+    service = DynamicMagicFormulaService()
+    filtered = service._filter_stocks(copy.deepcopy(stocks), min_ey, min_roc, min_mc)
+    return service._rank_stocks(filtered)
+
+
+def columnar_path(stocks, min_ey=0.0, min_roc=0.0, min_mc=settings.MIN_MARKET_CAP, top_n=None):
+    columns = RankingColumns.from_records(stocks)
+    mask = filter_mask(columns, min_ey, min_roc, min_mc, settings.EXCLUDED_SECTORS)
+    return rank_columns(columns, mask, top_n=top_n)
+
+
+class TestRankingParity:
+    """Columnar engine must reproduce the dict path exactly"""
+    
+    @pytest.mark.parametrize("seed", [1, 2, 3, 4, 5])
+    def test_full_ordering_matches_dict_path(self, seed):
+        """Same symbols, ranks and scores in the same order"""
+        stocks = make_stocks(400, seed=seed)
+        expected = dict_path(stocks)
+        ranked = columnar_path(stocks)
+        
+        actual = [
+            (stocks[pos]['symbol'], ey, roc, score, rank)
+            for pos, ey, roc, score, rank in ranked.iter_ranked()
+        ]
+        assert actual == [
+            (s['symbol'], s['ey_rank'], s['roc_rank'], s['magic_formula_score'], s['rank'])
+            for s in expected
+        ]
+    
+    @pytest.mark.parametrize("top_n", [1, 10, 57, 1000])
+    def test_top_n_matches_prefix(self, top_n):
+        """argpartition top-N equals the prefix of the full ranking"""
+        stocks = make_stocks(300)
+        expected = [s['symbol'] for s in dict_path(stocks)][:top_n]
+        ranked = columnar_path(stocks, top_n=top_n)
+        assert [stocks[pos]['symbol'] for pos in ranked.positions.tolist()] == expected
+        assert ranked.total_ranked == len(dict_path(stocks))
+    
+    def test_custom_filters_match(self):
+        """Threshold filters behave like the dict path"""
+        stocks = make_stocks(300)
+        expected = [s['symbol'] for s in dict_path(stocks, min_ey=4, min_roc=3, min_mc=1e9)]
+        ranked = columnar_path(stocks, min_ey=4, min_roc=3, min_mc=1e9)
+        assert [stocks[pos]['symbol'] for pos in ranked.positions.tolist()] == expected
+    
+    def test_empty_period(self):
+        """No rows ranks to an empty result"""
+        ranked = columnar_path([], top_n=10)
+        assert len(ranked) == 0
+        assert ranked.total_ranked == 0
+
+
+class TestRankPresorted:
+    """Shared sort orders must give the same ranking for every mask"""
+    
+    @pytest.mark.parametrize("min_ey,min_roc,min_mc,top_n", [
+        (0.0, 0.0, settings.MIN_MARKET_CAP, None),
+        (3.0, 5.0, 2e9, 25),
+        (-5.0, -5.0, 0.0, 10),
+        (50.0, 0.0, 0.0, 10),
+    ])
+    def test_matches_rank_columns(self, min_ey, min_roc, min_mc, top_n):
+        """Positions, ranks and scores identical to a fresh sort"""
+        columns = RankingColumns.from_records(make_stocks(500, seed=9))
+        mask = filter_mask(columns, min_ey, min_roc, min_mc, settings.EXCLUDED_SECTORS)
+        expected = rank_columns(columns, mask, top_n=top_n)
+        actual = rank_presorted(columns, mask, top_n=top_n)
+        assert list(actual.iter_ranked()) == list(expected.iter_ranked())
+        assert actual.total_ranked == expected.total_ranked
+    
+    def test_orders_computed_once(self):
+        """sort_orders is cached on the columns"""
+        columns = RankingColumns.from_records(make_stocks(50))
+        assert columns.sort_orders() is columns.sort_orders()
+
+
+class TestThresholdIndex:
+    """Binary-search filtering must select exactly the filter_mask rows"""
+    
+    @pytest.mark.parametrize("min_ey,min_roc,min_mc", [
+        (0.0, 0.0, settings.MIN_MARKET_CAP),
+        (9.0, 9.0, 0.0),
+        (5.0, -1.0, 2e9),
+        (-10.0, -10.0, 0.0),
+        (11.0, 0.0, 0.0),
+    ])
+    def test_candidates_match_mask(self, min_ey, min_roc, min_mc):
+        """Same rows as the full scan, in row order"""
+        stocks = make_stocks(300, seed=4)
+        stocks[3]['earnings_yield'] = None  # missing metric never matches
+        stocks[8]['market_cap'] = None
+        columns = RankingColumns.from_records(stocks)
+        mask = filter_mask(columns, min_ey, min_roc, min_mc, settings.EXCLUDED_SECTORS)
+        candidates = columns.threshold_index().candidates(min_ey, min_roc, min_mc, settings.EXCLUDED_SECTORS)
+        assert candidates.tolist() == np.flatnonzero(mask).tolist()
+        assert list(rank_candidates(columns, candidates, top_n=10).iter_ranked()) == \
+            list(rank_columns(columns, mask, top_n=10).iter_ranked())
+    
+    def test_strict_ebit_threshold(self):
+        """EBIT must be strictly positive"""
+        columns = RankingColumns.from_sequences([0.0, 1.0], [2e9, 2e9], [1.0, 1.0], [1.0, 1.0], [None, None])
+        assert columns.threshold_index().candidates(0.0, 0.0, 0.0, []).tolist() == [1]
+
+
+class TestTopNByScore:
+    """Test cases for argpartition top-N selection"""
+    
+    def test_ties_broken_by_row_order(self):
+        """Equal scores keep their original order"""
+        score = np.array([4, 2, 4, 2, 3], dtype=np.int64)
+        assert top_n_by_score(score, 3).tolist() == [1, 3, 4]
+    
+    def test_zero_top_n(self):
+        """top_n=0 selects nothing"""
+        assert top_n_by_score(np.array([1, 2], dtype=np.int64), 0).tolist() == []
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,120 @@
+"""
+Test for the per-provider token-bucket rate limiter
+"""
+import asyncio
+import pytest
+
+from app.services import rate_limiter as rate_limiter_module
+from app.services.rate_limiter import ProviderLimiter, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    real_sleep = asyncio.sleep
+
+    async def sleep(seconds):
+        # Yield before time moves on, so other callers can queue while this one sleeps
+        clock.slept.append(seconds)
+        await real_sleep(0)
+        clock.now += seconds
+
+    monkeypatch.setattr(rate_limiter_module.asyncio, 'sleep', sleep)
+    return clock
+
+
+class TestRateLimiter:
+    """Token buckets on a fake clock"""
+
+    def test_burst_then_wait_for_refill(self, clock):
+        """Calls within the budget never sleep; the next one waits exactly one refill interval"""
+        limiter = ProviderLimiter('polygon', per_minute=5, clock=clock)
+
+        async def run():
+            for _ in range(5):
+                assert await limiter.acquire()
+            assert clock.slept == []
+            assert await limiter.acquire(2)
+
+        asyncio.run(run())
+        assert clock.slept == [pytest.approx(24.0)]  # 2 tokens at 5 per 60s
+
+    def test_day_budget_and_max_wait(self, clock):
+        """The tightest window wins; waits beyond max_wait are refused without taking tokens"""
+        limiter = ProviderLimiter('alpha_vantage', per_minute=10, per_day=6, clock=clock)
+
+        async def run():
+            assert await limiter.acquire(3)
+            assert await limiter.acquire(3)
+            assert not await limiter.acquire(1, max_wait=60)
+            clock.now += 3600.0
+            assert not await limiter.acquire(1, max_wait=60)
+
+        asyncio.run(run())
+        assert clock.slept == []
+        assert limiter.get_stats()['rejected'] == 2
+        assert limiter.delay(1) == pytest.approx(86400.0 / 6 - 3600.0)
+
+    def test_max_wait_counts_time_queued(self, clock):
+        """A caller queued behind a long wait is refused once its max_wait is used up"""
+        limiter = ProviderLimiter('polygon', per_minute=5, clock=clock)
+
+        async def run():
+            assert await limiter.acquire(5)
+            return await asyncio.gather(limiter.acquire(1), limiter.acquire(1, max_wait=15))
+
+        assert asyncio.run(run()) == [True, False]
+        assert clock.slept == [pytest.approx(12.0)]  # the refill wait alone (12s) would have fit
+
+    def test_max_wait_bounds_lock_wait(self):
+        """Waiting for a held lock gives up after max_wait"""
+        limiter = ProviderLimiter('polygon', per_minute=5)
+
+        async def run():
+            async with limiter.lock:
+                return await limiter.acquire(1, max_wait=0.01)
+
+        assert not asyncio.run(run())
+        assert limiter.get_stats()['rejected'] == 1 and not limiter.lock.locked()
+
+    def test_providers_are_independent(self, clock):
+        """An exhausted provider does not delay one with spare budget"""
+        limiter = RateLimiter(clock=clock)
+        limiter.configure('polygon', per_minute=1)
+        limiter.configure('yfinance', per_hour=100)
+
+        async def run():
+            assert await limiter.acquire('polygon')
+            assert await limiter.wait_for_any({'polygon': 1, 'yfinance': 1}) == 'yfinance'
+            assert await limiter.acquire('yfinance')
+            assert await limiter.acquire('unknown', 50)
+
+        asyncio.run(run())
+        assert clock.slept == []
+
+    def test_wait_for_any_sleeps_until_first_refill(self, clock):
+        """When every provider is out of budget, sleep only until the soonest one refills"""
+        limiter = RateLimiter(clock=clock)
+        limiter.configure('polygon', per_minute=5)
+        limiter.configure('alpha_vantage', per_day=25)
+
+        async def run():
+            assert await limiter.acquire('polygon', 5)
+            assert await limiter.acquire('alpha_vantage', 25)
+            return await limiter.wait_for_any({'polygon': 2, 'alpha_vantage': 3})
+
+        assert asyncio.run(run()) == 'polygon'
+        assert sum(clock.slept) == pytest.approx(24.0)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,96 @@
+"""
+Test for negotiated (Accept / Accept-Encoding) API responses
+"""
+import gzip
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+
+from app.core import responses
+from app.core.config import settings
+from app.core.responses import negotiate_media_type, negotiated_response
+
+
+def make_request(accept=None, accept_encoding=None):
+    headers = []
+    if accept:
+        headers.append((b"accept", accept.encode()))
+    if accept_encoding:
+        headers.append((b"accept-encoding", accept_encoding.encode()))
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def make_content(count):
+    stocks = [
+        {'symbol': f"S{i}", 'rank': np.int64(i + 1), 'earnings_yield': 5.5,
+         'sector': None, 'updated_at': datetime(2024, 1, 2, 3, 4, 5, 678)}
+        for i in range(count)
+    ]
+    return {'year': 2023, 'month': None, 'stocks': stocks}
+
+
+class TestNegotiation:
+    """Media type and encoding selection"""
+
+    def test_media_type_from_accept(self, monkeypatch):
+        """Highest q supported type wins; unknown types fall back to JSON"""
+        monkeypatch.setattr(responses, 'msgpack', object())
+        assert negotiate_media_type(None) == responses.JSON
+        assert negotiate_media_type("text/html, */*;q=0.1") == responses.JSON
+        assert negotiate_media_type("application/json;q=0.5, application/x-msgpack") == responses.MSGPACK
+        assert negotiate_media_type("application/x-msgpack;q=0") == responses.JSON
+
+    def test_arrow_needs_rows(self, monkeypatch):
+        """Arrow is only offered for responses with a table part"""
+        monkeypatch.setattr(responses, 'pyarrow', object())
+        assert negotiate_media_type(responses.ARROW, has_rows=True) == responses.ARROW
+        assert negotiate_media_type(responses.ARROW, has_rows=False) == responses.JSON
+
+
+class TestNegotiatedResponse:
+    """Serialized bodies"""
+
+    def test_json_matches_jsonable_encoder(self):
+        """Same document as the default FastAPI encoding (datetimes, NumPy scalars)"""
+        content = make_content(3)
+        response = negotiated_response(make_request(), content, rows=content['stocks'])
+        assert response.media_type == responses.JSON
+        assert json.loads(response.body) == json.loads(json.dumps(jsonable_encoder(
+            {**content, 'stocks': [{**s, 'rank': int(s['rank'])} for s in content['stocks']]}
+        )))
+
+    def test_gzip_above_threshold(self, monkeypatch):
+        """Large bodies are compressed, small ones are not"""
+        monkeypatch.setattr(responses, 'brotli', None)
+        request = make_request(accept_encoding="gzip, br")
+        large = negotiated_response(request, make_content(200))
+        assert large.headers['content-encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(large.body))['stocks'][199]['symbol'] == 'S199'
+
+        small = negotiated_response(request, make_content(1))
+        assert len(small.body) < settings.RESPONSE_COMPRESSION_MIN_BYTES
+        assert 'content-encoding' not in small.headers
+
+    def test_msgpack_round_trip(self):
+        """msgpack bodies decode to the JSON document"""
+        msgpack = pytest.importorskip('msgpack')
+        content = make_content(2)
+        response = negotiated_response(make_request(accept=responses.MSGPACK), content)
+        assert msgpack.unpackb(response.body) == json.loads(responses.dumps_json(content))
+
+    def test_arrow_round_trip(self):
+        """Arrow stream carries the rows, scalar fields ride in the metadata"""
+        pyarrow = pytest.importorskip('pyarrow')
+        content = make_content(4)
+        response = negotiated_response(make_request(accept=responses.ARROW), content, rows=content['stocks'])
+        table = pyarrow.ipc.open_stream(response.body).read_all()
+        assert table.column('symbol').to_pylist() == ['S0', 'S1', 'S2', 'S3']
+        assert json.loads(table.schema.metadata[b'response']) == {'year': 2023, 'month': None}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
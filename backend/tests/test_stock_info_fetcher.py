@@ -0,0 +1,67 @@
+"""
+Import smoke test for the standalone stock info fetcher
+Its container installs only stock_info_requirements.txt, so the fetcher and the
+shared app modules it pulls in must import with nothing else available
+"""
+import os
+import re
+import subprocess
+import sys
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Distribution name -> top-level module, where they differ
+IMPORT_NAMES = {
+    "uvicorn[standard]": "uvicorn",
+    "python-jose[cryptography]": "jose",
+    "pydantic-settings": "pydantic_settings",
+    "beautifulsoup4": "bs4",
+    "psycopg2-binary": "psycopg2",
+    "python-dotenv": "dotenv",
+}
+
+# Loaded by the fetcher requirements' own dependencies, not only by the backend
+TRANSITIVE = {"pydantic", "dotenv"}
+
+BLOCKER = """
+import importlib.abc, sys
+BLOCKED = set(sys.argv[1].split(','))
+class Blocker(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] in BLOCKED:
+            raise ModuleNotFoundError(f"No module named '{name}'")
+        return None
+sys.meta_path.insert(0, Blocker())
+import stock_info_fetcher
+"""
+
+
+def requirement_modules(filename):
+    modules = set()
+    with open(os.path.join(BACKEND_DIR, filename)) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line:
+                dist = re.split(r'[<>=!~]', line)[0].strip()
+                modules.add(IMPORT_NAMES.get(dist, dist.replace('-', '_')))
+    return modules
+
+
+def test_imports_with_fetcher_requirements_only():
+    """Backend-only packages (fastapi, sqlalchemy, numpy, ...) are blocked during the import"""
+    for module in ("aiohttp", "pymongo", "pydantic_settings", "redis"):
+        pytest.importorskip(module)
+    blocked = requirement_modules("requirements.txt") - requirement_modules("stock_info_requirements.txt") - TRANSITIVE
+    assert "fastapi" in blocked
+
+    result = subprocess.run(
+        [sys.executable, "-c", BLOCKER, ",".join(sorted(blocked))],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=60
+    )
+
+    assert result.returncode == 0, result.stderr
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,196 @@
+"""
+Test for the symbol-level Polygon fetch (one financials call for every target year)
+"""
+import asyncio
+import pytest
+from datetime import datetime
+
+from app.models.database import FailedStock, StockData
+from app.services import continuous_fetcher as continuous_fetcher_module
+from app.services.background_processor import BackgroundStockProcessor
+from app.services.http_client import http_client
+from app.services.stock_data_service import stock_data_service
+from app.services.continuous_fetcher import ContinuousFetcher
+from app.services.multi_source_fetcher import MultiSourceFetcher
+from app.services.rate_limiter import BudgetExhausted, ProviderLimiter, rate_limiter
+from app.services.ticker_details_cache import TickerDetailsCache, ticker_details_cache
+from tests.conftest import stock
+
+
+def report(fiscal_year, ebit=2e8):
+    return {
+        'fiscal_year': fiscal_year,
+        'financials': {
+            'income_statement': {'operating_income_loss': {'value': ebit}},
+            'balance_sheet': {'assets': {'value': 5e9}, 'current_liabilities': {'value': 1e9}},
+        }
+    }
+
+
+DETAILS = {'name': 'Acme Inc', 'market_cap': 4e9, 'sic_description': 'Machinery', 'share_class_shares_outstanding': 1e8}
+REPORTS = [report('2023'), report(2022), report('2021', ebit=-1.0), report('bad')]
+
+
+@pytest.fixture
+def fetcher(monkeypatch):
+    fetcher = MultiSourceFetcher()
+    fetcher.polygon_key = 'key'
+    calls = []
+
+    async def details(symbol, session):
+        calls.append('details')
+        return DETAILS
+
+    async def reports(symbol, session):
+        calls.append('financials')
+        return REPORTS
+
+    monkeypatch.setattr(fetcher, '_polygon_details', details)
+    monkeypatch.setattr(fetcher, '_polygon_annual_reports', reports)
+    fetcher.calls = calls
+    monkeypatch.setitem(rate_limiter.providers, 'polygon', ProviderLimiter('polygon'))
+    ticker_details_cache.clear()
+    yield fetcher
+    ticker_details_cache.clear()
+
+
+class TestSymbolLevelFetch:
+    """Fan one Polygon response out to every target year"""
+
+    def test_all_years_from_one_call(self, fetcher):
+        """Every parseable fiscal year is returned from a single details + financials round trip"""
+        records = asyncio.run(fetcher.fetch_polygon_years('ACME', [2024, 2023, 2022, 2021], None))
+        assert sorted(records) == [2022, 2023]
+        assert records[2023]['year'] == 2023 and records[2023]['source'] == 'polygon'
+        assert records[2022]['earnings_yield'] == pytest.approx(2e8 / 4e9 * 100)
+        assert fetcher.calls == ['details', 'financials']
+
+    def test_failed_details_call_spends_one_call(self, fetcher, monkeypatch):
+        """Financials are never asked - nor charged - when the details call fails"""
+        async def no_details(symbol, session):
+            fetcher.calls.append('details')
+            return None
+
+        monkeypatch.setattr(fetcher, '_polygon_details', no_details)
+        assert asyncio.run(fetcher.fetch_polygon_years('ACME', [2023], None)) is None
+        assert fetcher.calls == ['details']
+        assert rate_limiter.get('polygon').granted == 1
+
+    def test_budget_checked_per_call(self, fetcher, monkeypatch):
+        """Out of budget after the details call: only financials are owed, details are kept"""
+        limiter = ProviderLimiter('polygon', per_day=1)
+        monkeypatch.setitem(rate_limiter.providers, 'polygon', limiter)
+        with pytest.raises(BudgetExhausted) as excinfo:
+            asyncio.run(fetcher.fetch_polygon_years('ACME', [2023], None))
+        assert excinfo.value.providers == {'polygon': 1}
+        assert fetcher.calls == ['details']
+        assert ticker_details_cache.get('ACME') == DETAILS
+
+    def test_upserts_years_and_marks_the_rest(self, fetcher, db, monkeypatch):
+        """Returned years are stored in one commit; missing ones are marked failed and not asked again"""
+        monkeypatch.setattr(continuous_fetcher_module.stock_data_service, 'multi_source', fetcher)
+        continuous = ContinuousFetcher()
+        continuous.target_years = [2024, 2023, 2022, 2021]
+        db.add(stock('ACME', 2023, company_name='Acme Inc', sector='Machinery', ey=1.0, roc=1.0, current_price=None))
+        db.commit()
+
+        assert continuous.get_missing_years(db, 'ACME') == [2024, 2022, 2021]
+        assert asyncio.run(continuous.fetch_symbol_years('ACME', db)) == (1, 2)
+
+        assert sorted(year for (year,) in db.query(StockData.year).filter(StockData.symbol == 'ACME')) == [2022, 2023]
+        assert set(continuous.failed_attempts) == {'ACME_2024', 'ACME_2021'}
+        assert continuous.pending_ranking_periods == {(2022, None)}
+        assert continuous.get_missing_years(db, 'ACME') == []
+
+
+class TestBudgetRejection:
+    """Out of budget means retry later - never the Wikipedia placeholder, never a failure"""
+
+    @pytest.fixture
+    def exhausted(self, fetcher, monkeypatch):
+        fetcher.alpha_vantage_key = None
+        for name in ('polygon', 'yfinance'):
+            limiter = ProviderLimiter(name, per_day=2)
+            limiter.buckets['day'].tokens = 0.0
+            monkeypatch.setitem(rate_limiter.providers, name, limiter)
+
+        async def placeholder(symbol, session):
+            raise AssertionError("placeholder fetched while a real source was only out of budget")
+
+        monkeypatch.setattr(fetcher, '_fetch_from_sp500_direct', placeholder)
+        return fetcher
+
+    def test_fetch_raises_instead_of_placeholder(self, exhausted):
+        """The skipped providers and their costs travel with the exception"""
+        with pytest.raises(BudgetExhausted) as excinfo:
+            asyncio.run(exhausted.fetch_stock_data('ACME', 2023, None))
+        assert excinfo.value.providers == {'polygon': 2, 'yfinance': 1}
+        assert exhausted.calls == []
+
+    def test_single_year_fetch_not_marked_failed(self, exhausted, db, monkeypatch):
+        """The per-year fallback defers the symbol instead of recording a failure"""
+        monkeypatch.setattr(continuous_fetcher_module.stock_data_service, 'multi_source', exhausted)
+        continuous = ContinuousFetcher()
+        with pytest.raises(BudgetExhausted):
+            asyncio.run(continuous.fetch_one_stock('ACME', 2023, db))
+        assert continuous.failed_attempts == {}
+
+    def test_symbol_level_fetch_deferred(self, exhausted, db, monkeypatch):
+        """A Polygon budget rejection surfaces to the loop instead of falling back per year"""
+        monkeypatch.setattr(continuous_fetcher_module.stock_data_service, 'multi_source', exhausted)
+        continuous = ContinuousFetcher()
+        with pytest.raises(BudgetExhausted) as excinfo:
+            asyncio.run(continuous.fetch_symbol_years('ACME', db))
+        assert excinfo.value.providers == {'polygon': 2}
+        assert continuous.failed_attempts == {}
+
+    def test_batch_processing_defers_without_failure(self, exhausted, db, monkeypatch):
+        """The background processor records no FailedStock row and no retry for a deferred symbol"""
+        monkeypatch.setattr(stock_data_service, 'multi_source', exhausted)
+        monkeypatch.setattr(stock_data_service, 'get_all_market_symbols', lambda: ['ACME'])
+        processor = BackgroundStockProcessor()
+
+        async def run():
+            try:
+                await processor.process_year(2023, db)
+                assert db.query(FailedStock).count() == 0
+
+                db.add(FailedStock(symbol='ACME', year=2022, retry_count=1, status='pending',
+                                   next_retry=datetime(2000, 1, 1)))
+                db.commit()
+                await processor.retry_failed_stocks(db)
+            finally:
+                await http_client.close()
+
+        asyncio.run(run())
+        failed = db.query(FailedStock).one()
+        assert (failed.status, failed.retry_count) == ('pending', 1)
+
+
+class TestTickerDetailsCache:
+    """Repeat details calls are skipped while the cached copy is fresh"""
+
+    def test_second_fetch_skips_details(self, fetcher):
+        """Only the financials call is made - and charged to the Polygon budget - on a cache hit"""
+        polygon = rate_limiter.get('polygon')
+        asyncio.run(fetcher.fetch_polygon_years('ACME', [2023], None))
+        asyncio.run(fetcher.fetch_polygon_years('ACME', [2022], None))
+        assert fetcher.calls == ['details', 'financials', 'financials']
+        assert polygon.granted == 3
+
+    def test_refresh_age(self):
+        """Entries expire after max_age; max_age 0 disables the cache"""
+        now = [0.0]
+        cache = TickerDetailsCache(max_age=60, clock=lambda: now[0])
+        cache.set('acme', {'name': 'Acme Inc'})
+        assert cache.get('ACME') == {'name': 'Acme Inc'}
+        now[0] = 60.0
+        assert cache.get('ACME') is None
+
+        disabled = TickerDetailsCache(max_age=0)
+        disabled.set('ACME', {'name': 'Acme Inc'})
+        assert disabled.get('ACME') is None
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
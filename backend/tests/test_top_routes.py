@@ -0,0 +1,68 @@
+"""
+Test for the /top routes through the FastAPI app (auth and database overridden)
+"""
+import pytest
+from datetime import datetime
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core import responses
+from app.models.database import get_db
+from app.routers import stocks
+from app.services.cache_service import cache_service
+from app.services.keycloak_auth import get_current_user
+from tests.test_cache_service import FILTERS, FakeRedis
+from tests.test_dynamic_magic_formula import db, reference_ranking  # noqa: F401 - db is a fixture
+
+
+@pytest.fixture
+def client(db):
+    app = FastAPI()
+    app.include_router(stocks.router, prefix="/api/stocks")
+    app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[get_current_user] = lambda: {"username": "tester"}
+    return TestClient(app)
+
+
+class TestTopRoutes:
+    """Current and legacy top-stocks routes share one code path"""
+
+    def test_legacy_route_matches_top_year(self, client, db):
+        """The legacy route answers with the default-filter ranking of /top/year"""
+        legacy = client.get("/api/stocks/legacy/top/year/2023", params={"top_n": 5})
+        current = client.get("/api/stocks/top/year/2023", params={"top_n": 5})
+        assert legacy.status_code == current.status_code == 200
+
+        expected = [(symbol, rank) for symbol, rank, _ in reference_ranking(db, 2023)[:5]]
+        for response in (legacy, current):
+            body = response.json()
+            assert [(s['symbol'], s['rank']) for s in body['stocks']] == expected
+            assert body['after_rank'] == 0
+
+    def test_legacy_route_validates_year(self, client):
+        """Year validation applies to the legacy route too"""
+        assert client.get("/api/stocks/legacy/top/year/1999").status_code == 400
+
+    def test_batch_rejects_bad_years(self, client):
+        """parse_years' ValueError reaches the client as a 400 with its message"""
+        response = client.get("/api/stocks/top/batch", params={"years": "2019-2017"})
+        assert response.status_code == 400
+        assert "Invalid years" in response.json()["detail"]
+
+    def test_cache_hit_matches_miss(self, db, monkeypatch):
+        """A fresh (native) result and its cached copy render the same bytes in every format"""
+        monkeypatch.setattr(cache_service, 'redis', FakeRedis())
+        miss = {**stocks.top_stocks_for_year(db, 2023, 5, FILTERS), 'generated_at': None}
+        assert cache_service.redis.data  # stored
+        hit = {**stocks.top_stocks_for_year(db, 2023, 5, FILTERS), 'generated_at': None}
+
+        assert isinstance(miss['stocks'][0]['updated_at'], datetime)
+        assert isinstance(hit['stocks'][0]['updated_at'], str)
+        assert responses.dumps_json(miss) == responses.dumps_json(hit)
+        assert responses.dumps_msgpack(miss) == responses.dumps_msgpack(hit)
+        if responses.pyarrow is not None:
+            assert responses.dumps_arrow(miss, miss['stocks']) == responses.dumps_arrow(hit, hit['stocks'])
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])